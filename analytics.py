@@ -0,0 +1,169 @@
+# Columns behind the analytics commands (!summary, !trend, !overlaps).
+# Answering "average credit per month this year" from the parsed divs means a
+# Python loop over every event; here the calendar's events are mirrored in two
+# NumPy arrays (day ordinals and credits, in the same order as
+# Calendar.events) and its periods in arrays of start and end ordinals, so a
+# query is a couple of binary searches and a vectorized reduction.
+#
+# The columns are built once per parsed document (Calendar.columns) and then
+# follow every edit made to it: Calendar calls insert_*/replace_*/delete_* with
+# the position it used in its own sorted lists.
+#
+# Periods are sorted by start, and `_reach` holds the running maximum of their
+# end dates. Every period before the first index whose reach is at or after a
+# date ends before that date, so the periods overlapping [start, end] all sit
+# between two binary searches, however long the calendar is.
+
+from datetime import date
+
+import numpy as np
+
+from calendar_model import date_ordinal
+from validation import parse_date
+
+# numpy counts days from 1970-01-01, the calendar from 0001-01-01
+EPOCH = date(1970, 1, 1).toordinal()
+FIRST = 1
+LAST = date.max.toordinal()
+
+
+def _credit(record):
+    try:
+        return float(record.attrs['credit'])
+    except (KeyError, ValueError):
+        return np.nan
+
+
+class CalendarColumns:
+    def __init__(self, events, periods):
+        self.ordinals = np.fromiter((event.ordinal for event in events), np.int32, len(events))
+        self.credits = np.fromiter((_credit(event) for event in events), np.float32, len(events))
+        self.starts = np.fromiter((period.start_ordinal for period in periods), np.int32, len(periods))
+        self.ends = np.fromiter((period.end_ordinal for period in periods), np.int32, len(periods))
+        # the credit of a base period, NaN for an ordinary one
+        self.period_credits = np.fromiter((_credit(period) if period.base else np.nan for period in periods),
+                                          np.float32, len(periods))
+        self._reach = None
+
+    def insert_event(self, index, event):
+        self.ordinals = np.insert(self.ordinals, index, event.ordinal)
+        self.credits = np.insert(self.credits, index, _credit(event))
+
+    def replace_event(self, index, event):
+        self.credits[index] = _credit(event)
+
+    def delete_event(self, index):
+        self.ordinals = np.delete(self.ordinals, index)
+        self.credits = np.delete(self.credits, index)
+
+    def insert_period(self, index, period):
+        self.starts = np.insert(self.starts, index, period.start_ordinal)
+        self.ends = np.insert(self.ends, index, period.end_ordinal)
+        self.period_credits = np.insert(self.period_credits, index, _credit(period) if period.base else np.nan)
+        self._reach = None
+
+    def replace_period(self, index, period):
+        self.period_credits[index] = _credit(period) if period.base else np.nan
+
+    def delete_period(self, index):
+        self.starts = np.delete(self.starts, index)
+        self.ends = np.delete(self.ends, index)
+        self.period_credits = np.delete(self.period_credits, index)
+        self._reach = None
+
+    # (ordinals, credits) of the events from `start` to `end` inclusive that have a credit
+    def credits_between(self, start, end):
+        low, high = np.searchsorted(self.ordinals, [start, end + 1])
+        ordinals, credits = self.ordinals[low:high], self.credits[low:high]
+        valid = ~np.isnan(credits)
+        return ordinals[valid], credits[valid]
+
+    # positions in Calendar.periods of the periods sharing a day with [start, end]
+    def overlapping(self, start, end):
+        if self._reach is None:
+            self._reach = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+        low = np.searchsorted(self._reach, start)
+        high = np.searchsorted(self.starts, end, side='right')
+        return low + np.flatnonzero(self.ends[low:high] >= start)
+
+
+# the credits of several calendars (the shards of a sharded layout), in date order
+def credits_between(calendars, start, end):
+    parts = [calendar.columns.credits_between(start, end) for calendar in calendars]
+    if not parts:
+        return np.empty(0, np.int32), np.empty(0, np.float32)
+    ordinals = np.concatenate([ordinals for ordinals, _ in parts])
+    credits = np.concatenate([credits for _, credits in parts])
+    order = np.argsort(ordinals, kind='stable')
+    return ordinals[order], credits[order]
+
+
+def periods_overlapping(calendars, start, end):
+    periods = [calendar.periods[index] for calendar in calendars for index in calendar.columns.overlapping(start, end)]
+    return sorted(periods, key=lambda period: period.key)
+
+
+def to_date(ordinal):
+    return date.fromordinal(int(ordinal)).strftime('%m/%d/%Y')
+
+
+# ('mm/yyyy' or 'yyyy' labels, mean credit, number of days) per month or year,
+# for ordinals in date order: every group is a run of equal keys
+def group_means(ordinals, credits, by='month'):
+    if not len(ordinals):
+        return [], np.empty(0), np.empty(0, np.int64)
+    days = (ordinals.astype(np.int64) - EPOCH).astype('datetime64[D]')
+    keys = days.astype('datetime64[M]' if by == 'month' else 'datetime64[Y]')
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    counts = np.diff(np.append(starts, len(keys)))
+    means = np.add.reduceat(credits.astype(np.float64), starts) / counts
+    labels = [f'{str(group)[5:7]}/{str(group)[:4]}' if by == 'month' else str(group) for group in keys[starts]]
+    return labels, means, counts
+
+
+# least squares slope of the credit, in points per 30 days
+def slope(ordinals, credits):
+    if len(ordinals) < 2 or ordinals[0] == ordinals[-1]:
+        return 0.0
+    return float(np.polyfit(ordinals.astype(np.float64), credits.astype(np.float64), 1)[0] * 30)
+
+
+# {count, mean, median, std, min, max, min_date, max_date} of a non-empty selection
+def summarize(ordinals, credits):
+    lowest, highest = int(np.argmin(credits)), int(np.argmax(credits))
+    return {
+        'count': len(credits), 'mean': float(credits.mean()), 'median': float(np.median(credits)),
+        'std': float(credits.std()), 'min': float(credits[lowest]), 'max': float(credits[highest]),
+        'min_date': to_date(ordinals[lowest]), 'max_date': to_date(ordinals[highest]),
+    }
+
+
+# The range of an analytics command: nothing (this year), "all", a year
+# ("2023"), a month ("03/2023"), a date, or two dates. Returns (start, end,
+# label) with ordinals; ValueError with a message for the user otherwise.
+def parse_range(args, today):
+    args = args or (str(today.year),)
+    if len(args) == 1 and args[0].lower() == 'all':
+        return FIRST, LAST, 'all time'
+    try:
+        start, end, label = _range(args)
+    except ValueError:
+        raise ValueError('Please give a year (2023), a month (03/2023), a date, two dates (mm/dd/yyyy mm/dd/yyyy) '
+                         'or "all".') from None
+    if end < start:
+        raise ValueError('The end date must be after the start date.')
+    return start, end, label
+
+
+def _range(args):
+    if len(args) == 1 and args[0].isdigit():
+        year = int(args[0])
+        return date(year, 1, 1).toordinal(), date(year, 12, 31).toordinal(), str(year)
+    if len(args) == 1 and args[0].count('/') == 1:
+        month, year = (int(part) for part in args[0].split('/'))
+        following = date(year + month // 12, month % 12 + 1, 1)
+        return date(year, month, 1).toordinal(), following.toordinal() - 1, f'{month:02d}/{year}'
+    if len(args) not in (1, 2):
+        raise ValueError('too many arguments')
+    start, end = (date_ordinal(parse_date(value)) for value in (args[0], args[-1]))
+    return start, end, to_date(start) if start == end else f'{to_date(start)} to {to_date(end)}'
@@ -0,0 +1,116 @@
+# One-shot arguments, so that an edit fits in a single message:
+#   !new_event [credit] [events]                    !new_event 85 "gym | paper deadline"
+#   !revise_event [date] [credit] [events]          !revise_event 01/05/2023 70 "gym"
+#   !delete_event [date]                            !delete_event 01/05/2023
+#   !new_period [start end] [#color | credit hue] [description]
+#                                                   !new_period 01/02/2023 03/04/2023 #ff8800 "Winter break"
+#                                                   !new_period 01/02/2023 03/04/2023 80 200 "Winter break"
+#   !delete_period [start end]                      !delete_period 01/02/2023 03/04/2023
+# Fields are told apart by their shape: dates have slashes, colors start with
+# '#', credit and hue are integers, and whatever is left is the text. Trailing
+# fields can be left out, but dates cannot be skipped: once there are
+# arguments, the first ones are the dates. Every parser returns (values,
+# errors): the fields that were given and passed the same checks as the
+# prompts, and a message for each argument that is invalid or left over. The
+# command asks for everything else, and only skips its confirmation when
+# complete() says every field it needs came from the arguments.
+
+import re
+
+from validation import CREDIT_RANGE, HUE_RANGE, parse_color, parse_date, parse_integer, parse_period_dates, split_events
+
+_integer = re.compile(r'^[+-]?\d+$')
+
+
+def _is_date(token):
+    return '/' in token
+
+
+def _is_color(token):
+    return token.startswith('#')
+
+
+def _is_integer(token):
+    return bool(_integer.match(token))
+
+
+class _Tokens:
+    def __init__(self, args):
+        self.tokens = [token for token in args if token.strip()]
+        self.values = {}
+        self.errors = []
+
+    # consumes the next token if it has the right shape and validates it; a
+    # positional field consumes it whatever its shape (`1-5-2023` for a date)
+    def field(self, name, shape, parse, *parse_args, positional=False):
+        if not self.tokens or not (positional or shape(self.tokens[0])):
+            return
+        token = self.tokens.pop(0)
+        try:
+            self.values[name] = parse(token, *parse_args)
+        except ValueError as e:
+            self.errors.append(f'"{token}": {e}')
+
+    def text(self, name, parse=None):
+        text = ' '.join(self.tokens).strip()
+        self.tokens = []
+        if not text:
+            return
+        try:
+            self.values[name] = parse(text) if parse else text
+        except ValueError as e:
+            self.errors.append(str(e))
+
+    def result(self):
+        if self.tokens:
+            self.errors.append(f'Unexpected arguments: {" ".join(self.tokens)}')
+            self.tokens = []
+        return self.values, self.errors
+
+
+# whether a command can skip its confirmation: no argument was rejected and
+# every field in `names` came from the arguments
+def complete(values, errors, *names):
+    return not errors and all(name in values for name in names)
+
+
+# the same for a new period: the dates, the description, and a color or a credit and hue
+def complete_period(values, errors):
+    return complete(values, errors, 'start', 'end', 'description') and \
+        ('color' in values or complete(values, errors, 'credit', 'hue'))
+
+
+def parse_event_arguments(args, with_date=False):
+    tokens = _Tokens(args)
+    if with_date:
+        tokens.field('date', _is_date, parse_date, positional=True)
+    tokens.field('credit', _is_integer, parse_integer, CREDIT_RANGE)
+    tokens.text('events', split_events)
+    return tokens.result()
+
+
+def parse_date_arguments(args):
+    tokens = _Tokens(args)
+    tokens.field('date', _is_date, parse_date, positional=True)
+    return tokens.result()
+
+
+# with `dates_only` (!delete_period) anything after the dates is left over
+def parse_period_arguments(args, dates_only=False):
+    tokens = _Tokens(args)
+    tokens.field('start', _is_date, parse_date, positional=True)
+    tokens.field('end', _is_date, parse_date, positional=True)
+    if 'start' in tokens.values and 'end' in tokens.values:
+        try:
+            parse_period_dates(tokens.values['start'], tokens.values['end'])
+        except ValueError as e:
+            tokens.errors.append(str(e))
+            del tokens.values['end']
+    if dates_only:
+        return tokens.result()
+    tokens.field('color', _is_color, parse_color)
+    if 'color' not in tokens.values:
+        tokens.field('credit', _is_integer, parse_integer, CREDIT_RANGE)
+        tokens.field('hue', _is_integer, parse_integer, HUE_RANGE)
+    tokens.text('description')
+    return tokens.result()
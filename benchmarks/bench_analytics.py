@@ -0,0 +1,117 @@
+# The analytics queries against the calendar's NumPy columns, next to the same
+# answers computed with a loop over the parsed divs. For every calendar size it
+# reports how long building the columns takes, how long each query takes on
+# them and with the loop, and how long keeping them up to date costs per edit
+# compared with building them again. The answers are checked against the loop,
+# also after a series of edits.
+#
+#   python -m benchmarks.bench_analytics [--days 365 3650 36500] [--runs 50]
+
+import argparse
+import statistics
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from analytics import CalendarColumns, credits_between, group_means, periods_overlapping, summarize
+from benchmarks.synthetic import FIRST_DAY, format_date, generate_calendar
+from calendar_model import Calendar, Mutation, base_period_div, event_div
+
+
+def timed(func, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1e3, result
+
+
+# the loop the columns replace
+def loop_monthly(calendar, start, end):
+    groups = {}
+    for event in calendar.events:
+        if start <= event.ordinal <= end:
+            day = date.fromordinal(event.ordinal)
+            groups.setdefault(f'{day.month:02d}/{day.year}', []).append(event.credit)
+    return {group: sum(values) / len(values) for group, values in groups.items()}
+
+
+def loop_overlapping(calendar, start, end):
+    return sorted((period for period in calendar.periods if period.start_ordinal <= end and period.end_ordinal >= start),
+                  key=lambda period: period.key)
+
+
+def columns_monthly(calendar, start, end):
+    ordinals, credits = credits_between([calendar], start, end)
+    groups, means, _ = group_means(ordinals, credits)
+    summarize(ordinals, credits)
+    return dict(zip(groups, means))
+
+
+def check(calendar, start, end):
+    expected = loop_monthly(calendar, start, end)
+    actual = columns_monthly(calendar, start, end)
+    assert expected.keys() == actual.keys(), 'the months differ'
+    assert all(abs(expected[group] - actual[group]) < 1e-3 for group in expected), 'the means differ'
+    assert loop_overlapping(calendar, start, end) == periods_overlapping([calendar], start, end), 'the periods differ'
+
+
+def edits(days, count):
+    for index in range(count):
+        day = format_date(FIRST_DAY + timedelta(days=(index * 7919) % (days + 60)))
+        start = format_date(FIRST_DAY + timedelta(days=(index * 104729) % days))
+        end = format_date(FIRST_DAY + timedelta(days=(index * 104729) % days + 40))
+        yield [Mutation('put_event', day, event_div(day, index % 101, ['edit'])),
+               Mutation('delete_event', format_date(FIRST_DAY + timedelta(days=(index * 31) % days))),
+               Mutation('put_period', (start, end), base_period_div(start, end, 50, 120, 'Edit'))][index % 3]
+
+
+def run(days, runs):
+    calendar = Calendar.from_html(generate_calendar(days, periods=days // 30, base_periods=days // 90))
+    first = FIRST_DAY.toordinal()
+    year = (first + days // 2, first + days // 2 + 364)
+    everything = (first, first + days)
+
+    build, _ = timed(lambda: CalendarColumns(calendar.events, calendar.periods), runs)
+    calendar.columns
+    row = {'build': build}
+    for name, (start, end) in (('year', year), ('all', everything)):
+        row[f'{name} loop'], _ = timed(lambda: loop_monthly(calendar, start, end), runs)
+        row[f'{name} columns'], _ = timed(lambda: columns_monthly(calendar, start, end), runs)
+    day = first + days // 2
+    row['overlaps loop'], _ = timed(lambda: loop_overlapping(calendar, day, day), runs)
+    row['overlaps columns'], _ = timed(lambda: periods_overlapping([calendar], day, day), runs)
+
+    started = time.perf_counter()
+    count = 0
+    for mutation in edits(days, runs * 3):
+        calendar.apply(mutation)
+        count += 1
+    row['edit'] = (time.perf_counter() - started) / count * 1e3
+    for start, end in (year, everything, (day, day)):
+        check(calendar, start, end)
+    rebuilt = CalendarColumns(calendar.events, calendar.periods)
+    assert np.array_equal(rebuilt.ordinals, calendar.columns.ordinals), 'the columns drifted from the calendar'
+    return row
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, nargs='+', default=[365, 3650, 36500])
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args()
+
+    names = None
+    for days in args.days:
+        row = run(days, args.runs)
+        if names is None:
+            names = list(row)
+            print('days | ' + ' | '.join(f'{name} (ms)' for name in names))
+        print(f'{days} | ' + ' | '.join(f'{row[name]:.3f}' for name in names))
+    print('the columns give the same answers as the loop, also after the edits')
+
+
+if __name__ == '__main__':
+    run_benchmark()
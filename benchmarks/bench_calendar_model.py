@@ -0,0 +1,71 @@
+# Micro-benchmarks of the indexed calendar model against the BeautifulSoup path
+# it replaces: find_all lookups and strptime insertion scans.
+#
+#   python -m benchmarks.bench_calendar_model [--sizes 1000 10000 100000]
+
+import argparse
+import timeit
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from bs4 import BeautifulSoup
+
+from benchmarks.synthetic import FIRST_DAY, format_date, generate_calendar
+from calendar_model import Calendar, date_ordinal, soup_records
+
+
+def soup_lookup(soup, date):
+    return soup.find_all('div', attrs={'date': date, 'credit': True})
+
+
+def soup_insertion_point(soup, date):
+    for div in soup.find_all('div', attrs={'date': True, 'credit': True}):
+        if datetime.strptime(div['date'], '%m/%d/%Y') > datetime.strptime(date, '%m/%d/%Y'):
+            return div
+    return None
+
+
+def model_insertion_point(calendar, date):
+    return bisect_right(calendar._event_ordinals, date_ordinal(date))
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def run(size):
+    text = generate_calendar(size)
+    middle = format_date(FIRST_DAY + timedelta(days=size // 2))
+    missing = format_date(FIRST_DAY + timedelta(days=size + 10))
+
+    soup = BeautifulSoup(text, 'html.parser')
+    records = list(soup_records(text))
+    calendar = Calendar(text, records)
+    assert len(soup_lookup(soup, middle)) == 1 and calendar.find_event(middle) is not None
+
+    number = max(1, 10000 // size)
+    return {
+        'days': size,
+        'index build (ms)': best_of(lambda: Calendar(text, records), 1) * 1e3,
+        'find_all lookup (ms)': best_of(lambda: soup_lookup(soup, middle), number) * 1e3,
+        'model lookup (us)': best_of(lambda: calendar.find_event(middle), 10000) * 1e6,
+        'strptime scan (ms)': best_of(lambda: soup_insertion_point(soup, missing), number) * 1e3,
+        'bisect insert point (us)': best_of(lambda: model_insertion_point(calendar, missing), 10000) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    rows = [run(size) for size in args.sizes]
+    columns = list(rows[0])
+    print(' | '.join(columns))
+    for row in rows:
+        print(' | '.join(f'{row[column]:.2f}' if isinstance(row[column], float) else str(row[column])
+                         for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+# End-to-end benchmark of the bot commands, fully offline: main.py runs against
+# the in-process fake GitHub and scripted discord contexts. For every calendar
+# size it reports per-command latency percentiles (until the user gets an
+# answer, and until the edit is committed), storage calls, peak memory, and
+# the worst event loop stall seen while commands were running.
+#
+#   python -m benchmarks.bench_commands [--days 365 3650 36500] [--runs 20]
+#   python -m benchmarks.bench_commands --sharded    # after !reformat_file
+#   python -m benchmarks.bench_commands --storage filesystem    # or git: a local clone
+#   python -m benchmarks.bench_commands --save baseline.json
+#   python -m benchmarks.bench_commands --compare baseline.json --tolerance 0.25
+#
+# With --compare the exit status is 1 when any command's median latency is
+# more than `tolerance` slower than in the baseline, so it can gate a change.
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+
+import github
+
+from benchmarks.fake_discord import FakeAttachment, FakeContext
+from benchmarks.fake_github import FakeGithub, FakeRepo
+from benchmarks.synthetic import FIRST_DAY, format_date, generate_calendar
+from local_storage import FileSystemStorage, LocalGitStorage
+from metrics import metrics
+from storage import GitHubStorage
+
+# main.py reads its configuration at import time
+os.environ.setdefault('GITHUB_TOKEN', 'offline')
+os.environ.setdefault('GITHUB_REPO_NAME', 'benchmark/calendar')
+os.environ.setdefault('COMMIT_WINDOW_SECONDS', '0')
+os.environ.setdefault('JOURNAL_PATH', ':memory:')
+github.Github = FakeGithub
+import main  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def import_file(days):
+    rows = ['type,date,start,end,credit,hue,color,description']
+    for offset in range(0, days, max(1, days // 50)):
+        rows.append(f'event,{format_date(FIRST_DAY + timedelta(days=offset))},,,70,,,imported | again')
+    return FakeAttachment('backfill.csv', '\n'.join(rows).encode('utf-8'))
+
+
+# (name, command, arguments, answers, attachments); every round leaves the
+# calendar as it found it, apart from the events added by !new_event
+def script(days):
+    day = format_date(FIRST_DAY + timedelta(days=days // 2))
+    start = format_date(FIRST_DAY + timedelta(days=days + 30))
+    end = format_date(FIRST_DAY + timedelta(days=days + 40))
+    return [
+        ('new_event', main.new_event, (), ['gym', 'no', '85', 'yes'], ()),
+        ('revise_event', main.revise_event, (), [day, 'yes', 'revised', 'no', '50', 'yes'], ()),
+        ('delete_event', main.delete_event, (), [day, 'yes'], ()),
+        ('revise_event (add)', main.revise_event, (), [day, 'yes', 'added back', 'no', '60', 'yes'], ()),
+        ('new_period', main.new_period, (), [start, end, 'yes', 'Trip', 'no', '#ff8800', 'yes'], ()),
+        ('new_period (revise)', main.new_period, (), [start, end, 'yes', 'Trip', 'yes', '80', '200', 'yes'], ()),
+        ('delete_period', main.delete_period, (), [start, end, 'yes'], ()),
+        ('new_event (one-shot)', main.new_event, ('85', 'gym | paper deadline'), [], ()),
+        ('new_event (invalid credit)', main.new_event, ('150', 'gym'), ['85', 'yes'], ()),
+        ('revise_event (one-shot)', main.revise_event, (day, '50', 'revised'), [], ()),
+        # an edit that changes nothing still has to leave the journal
+        ('revise_event (unchanged, one-shot)', main.revise_event, (day, '50', 'revised'), [], ()),
+        ('delete_event (one-shot)', main.delete_event, (day,), [], ()),
+        ('revise_event (add, one-shot)', main.revise_event, (day, '60', 'added back'), [], ()),
+        ('new_period (one-shot)', main.new_period, (start, end, '#ff8800', 'Trip'), [], ()),
+        ('new_period (revise, one-shot)', main.new_period, (start, end, '80', '200', 'Trip'), [], ()),
+        ('delete_period (one-shot)', main.delete_period, (start, end), [], ()),
+        ('import', main.import_calendar, (), ['yes'], (import_file(days),)),
+        ('export', main.export_calendar, ('csv',), [], ()),
+        ('summary (all)', main.summary, ('all',), [], ()),
+        ('summary (year)', main.summary, (day[-4:],), [], ()),
+        ('overlaps', main.overlaps, (day,), [], ()),
+    ]
+
+
+async def invoke(command, arguments, answers, attachments):
+    ctx = FakeContext(attachments=attachments)
+    ctx.tenant = await main.tenants.get(None, ctx.author.id)
+    main.conversations.open(ctx)
+    for message in ctx.answers(answers):
+        main.conversations.dispatch(message)
+    started = time.perf_counter()
+    try:
+        await command.callback(ctx, *arguments)
+    finally:
+        main.conversations.close(ctx)
+    elapsed = time.perf_counter() - started
+    await ctx.tenant.replayer.drain()
+    synced = time.perf_counter() - started
+    assert ctx.session.messages.empty(), f'{command.name} did not use every scripted answer: {ctx.sent}'
+    return elapsed, synced
+
+
+# nearest rank: the smallest value with at least q of the sorted values at or below it
+def percentile(values, q):
+    return values[math.ceil(q * len(values)) - 1]
+
+
+async def watch_loop(stalls, stop):
+    interval = 0.005
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - started - interval)
+
+
+def git(directory, *args):
+    subprocess.run(['git', '-C', directory, *args], check=True, capture_output=True)
+
+
+# (storage, number of calls made so far, whether a file exists) for a calendar
+# that starts out as `text`; the git backend pushes to a bare repository next to its clone
+def make_storage(kind, text, directory):
+    if kind == 'github':
+        repo = FakeRepo({'events.html': text})
+        return GitHubStorage(repo), lambda: sum(repo.calls.values()), \
+            lambda path: path in repo._head('master').tree.files
+
+    clone = os.path.join(directory, 'calendar')
+    os.makedirs(clone)
+    with open(os.path.join(clone, 'events.html'), 'w') as f:
+        f.write(text)
+    if kind == 'filesystem':
+        return FileSystemStorage(clone), lambda: 0, lambda path: os.path.exists(os.path.join(clone, path))
+
+    remote = os.path.join(directory, 'remote.git')
+    subprocess.run(['git', 'init', '--quiet', '--bare', remote], check=True)
+    git(clone, 'init', '--quiet')
+    git(clone, 'checkout', '--quiet', '-b', 'master')
+    git(clone, 'config', 'user.email', 'bot@example.com')
+    git(clone, 'config', 'user.name', 'Calendar Bot')
+    git(clone, 'add', 'events.html')
+    git(clone, 'commit', '--quiet', '-m', 'initial')
+    git(clone, 'remote', 'add', 'origin', remote)
+    git(clone, 'push', '--quiet', 'origin', 'master')
+    git(clone, 'fetch', '--quiet', 'origin')
+    return LocalGitStorage(clone), \
+        lambda: int(sum(value for (name, _), value in metrics.counters.items() if name == 'git_commands')), \
+        lambda path: os.path.exists(os.path.join(clone, path))
+
+
+async def run_size(days, runs, delay, sharded=False, kind='github'):
+    with tempfile.TemporaryDirectory() as directory:
+        text = generate_calendar(days, periods=days // 30, base_periods=days // 90)
+        storage, storage_calls, exists = make_storage(kind, text, directory)
+        try:
+            return await run_with_storage(days, runs, delay, sharded, storage, storage_calls, exists)
+        finally:
+            # the git backend keeps pulling and pushing in the background
+            await storage.close()
+
+
+async def run_with_storage(days, runs, delay, sharded, storage, storage_calls, exists):
+    main.tenants.open(main.tenants.configs[main.DEFAULT], storage)
+    if sharded:
+        await invoke(main.reformat_file, ('year',), ['yes'], ())
+        assert exists('events/manifest.json'), 'the calendar was not sharded'
+    if isinstance(storage, GitHubStorage):
+        storage.repo.delay = delay
+
+    latencies = {}
+    synced = {}
+    calls = {}
+    stalls = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(stalls, stop))
+    for _ in range(runs):
+        for name, command, arguments, answers, attachments in script(days):
+            before = storage_calls()
+            elapsed, until_synced = await invoke(command, arguments, answers, attachments)
+            latencies.setdefault(name, []).append(elapsed)
+            synced.setdefault(name, []).append(until_synced)
+            calls[name] = storage_calls() - before
+    stop.set()
+    await watcher
+
+    tracemalloc.start()
+    for name, command, arguments, answers, attachments in script(days):
+        await invoke(command, arguments, answers, attachments)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = {}
+    for name, values in latencies.items():
+        values.sort()
+        results[name] = {
+            'p50': statistics.median(values) * 1e3,
+            'p95': percentile(values, 0.95) * 1e3,
+            'p99': percentile(values, 0.99) * 1e3,
+            'synced_p50': statistics.median(synced[name]) * 1e3,
+            'calls': calls[name],
+        }
+    return {'commands': results, 'peak_memory_mb': peak / 2 ** 20, 'max_loop_stall_ms': max(stalls) * 1e3}
+
+
+def report(results):
+    for days, result in results.items():
+        print(f'\n{days} days: peak memory {result["peak_memory_mb"]:.1f} MB, '
+              f'max event loop stall {result["max_loop_stall_ms"]:.1f} ms')
+        print('command | p50 (ms) | p95 (ms) | p99 (ms) | synced p50 (ms) | storage calls')
+        for name, row in result['commands'].items():
+            print(f'{name} | {row["p50"]:.2f} | {row["p95"]:.2f} | {row["p99"]:.2f} | {row["synced_p50"]:.2f} | '
+                  f'{row["calls"]}')
+
+
+def regressions(results, baseline, tolerance):
+    failures = []
+    for days, result in results.items():
+        for name, row in result['commands'].items():
+            before = baseline.get(days, {}).get('commands', {}).get(name)
+            if before and row['p50'] > before['p50'] * (1 + tolerance):
+                failures.append(f'{name} at {days} days: {before["p50"]:.2f} ms -> {row["p50"]:.2f} ms')
+    return failures
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, nargs='+', default=[365, 3650, 36500])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--github-delay', type=float, default=0.0,
+                        help='seconds added to every fake GitHub call')
+    parser.add_argument('--storage', choices=['github', 'filesystem', 'git'], default='github')
+    parser.add_argument('--sharded', action='store_true', help='split the calendar per year first')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {str(days): asyncio.run(run_size(days, args.runs, args.github_delay, args.sharded, args.storage)) for days in args.days}
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f'REGRESSION: {failure}')
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,178 @@
+# Fault injection for the write-ahead journal, against the fake GitHub:
+#   outage   GitHub is down while edits are confirmed; the bot "crashes", a new
+#            process reopens the journal and pushes everything once GitHub is back
+#   flaky    a share of all GitHub calls fail; every edit still lands exactly once
+#   lost     a share of pushes land but their response is lost, so the entries
+#            are pushed again; edits are add_event, which would add the day twice
+#   reading  edits wait in the journal (nothing pushes them) and every edit is
+#            followed by a read of the calendar as users see it, the file with
+#            the unsynced edits on top
+# Reports how long users wait for an acknowledgement and how long until the
+# edits are on GitHub, and asserts that no edit is lost or applied twice
+# (tests/test_journal.py runs the same scenarios, smaller).
+#
+#   python -m benchmarks.bench_journal [--edits 200] [--failure-rate 0.2] [--lost-rate 0.3]
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+from calendar_model import Calendar, Mutation, event_div
+from commit_queue import CommitQueue
+from journal import Journal, JournalReplayer
+from shards import parse_document
+from storage import DocumentCache, GitHubStorage
+from tenants import Tenant, make_config
+
+from benchmarks.fake_github import FakeRepo
+from benchmarks.synthetic import FIRST_DAY, format_date, generate_calendar
+
+DAYS = 3650
+
+
+def bot(repo, journal_path):
+    storage = GitHubStorage(repo)
+    documents = DocumentCache(storage, lambda path, text: Calendar.from_html(text))
+    journal = Journal(journal_path)
+    replayer = JournalReplayer(journal, CommitQueue(storage, documents, window=0.01), min_delay=0.01, max_delay=0.2)
+    return journal, replayer
+
+
+def edits(count, action='put_event'):
+    for index in range(count):
+        day = format_date(FIRST_DAY + timedelta(days=DAYS + index))
+        yield {'events.html': [Mutation(action, day, event_div(day, index % 101, [f'edit {index}']))]}, \
+            f'[Calendar Bot]: Update events for {day}'
+
+
+# `every`: wait for the journal to drain after this many edits, for more commits
+async def confirm(journal, replayer, count, action='put_event', every=None):
+    latencies = []
+    for index, (edit, message) in enumerate(edits(count, action), 1):
+        started = time.perf_counter()
+        await journal.append(edit, message)
+        replayer.notify()
+        latencies.append(time.perf_counter() - started)
+        if every and index % every == 0:
+            await replayer.drain()
+    return latencies
+
+
+def check(repo, count):
+    calendar = Calendar.from_html(repo.text('events.html'))
+    for index in range(count):
+        day = format_date(FIRST_DAY + timedelta(days=DAYS + index))
+        matches = [event for event in calendar.events if event.date == day]
+        assert len(matches) == 1, f'{day} is on GitHub {len(matches)} times'
+        assert matches[0].descriptions == [f'edit {index}'], f'{day} has the wrong contents'
+
+
+async def outage(journal_path, count):
+    repo = FakeRepo({'events.html': generate_calendar(DAYS)})
+    repo.down = True
+    journal, replayer = bot(repo, journal_path)
+    replayer.start()
+    latencies = await confirm(journal, replayer, count)
+    await asyncio.sleep(0.3)
+    assert len(journal) == count, 'edits left the journal while GitHub was down'
+    attempts = max(entry.attempts for entry in journal.entries.values())
+    # crash: the process goes away without syncing
+    replayer._task.cancel()
+    journal.close()
+
+    repo.down = False
+    journal, replayer = bot(repo, journal_path)
+    assert len(journal) == count, f'only {len(journal)} of {count} edits survived the restart'
+    started = time.perf_counter()
+    replayer.start()
+    await replayer.drain()
+    synced = time.perf_counter() - started
+    check(repo, count)
+    journal.close()
+    return latencies, synced, attempts
+
+
+async def flaky(journal_path, count, failure_rate):
+    repo = FakeRepo({'events.html': generate_calendar(DAYS)})
+    repo.failure_rate = failure_rate
+    journal, replayer = bot(repo, journal_path)
+    replayer.start()
+    started = time.perf_counter()
+    latencies = await confirm(journal, replayer, count)
+    await replayer.drain()
+    synced = time.perf_counter() - started
+    check(repo, count)
+    journal.close()
+    return latencies, synced, sum(repo.calls.values())
+
+
+async def lost(journal_path, count, lost_rate):
+    repo = FakeRepo({'events.html': generate_calendar(DAYS)})
+    repo.lost_rate = lost_rate
+    journal, replayer = bot(repo, journal_path)
+    replayer.start()
+    started = time.perf_counter()
+    latencies = await confirm(journal, replayer, count, action='add_event', every=5)
+    await replayer.drain()
+    synced = time.perf_counter() - started
+    check(repo, count)
+    journal.close()
+    return latencies, synced, repo.lost
+
+
+async def reading(journal_path, count, days):
+    os.environ.setdefault('GITHUB_TOKEN', 'offline')
+    repo = FakeRepo({'events.html': generate_calendar(days)})
+    tenant = Tenant(make_config('default', {'repo': 'benchmark/calendar'}), GitHubStorage(repo), Journal(journal_path))
+    await tenant.read_document('events.html')
+    latencies = []
+    for edit, message in edits(count):
+        await tenant.journal.append(edit, message)
+        started = time.perf_counter()
+        calendar = await tenant.read_document('events.html')
+        latencies.append(time.perf_counter() - started)
+    expected = parse_document('events.html', repo.text('events.html'))
+    for mutation in (mutation for edit, _ in edits(count) for mutation in edit['events.html']):
+        expected.apply(mutation)
+    assert calendar.to_text() == expected.to_text(), 'the calendar as users see it is wrong'
+    tenant.journal.close()
+    return latencies
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--edits', type=int, default=200)
+    parser.add_argument('--failure-rate', type=float, default=0.2)
+    parser.add_argument('--lost-rate', type=float, default=0.3)
+    parser.add_argument('--reading-days', type=int, default=36500, help='size of the calendar read while down')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        latencies, synced, attempts = asyncio.run(outage(os.path.join(directory, 'outage.sqlite3'), args.edits))
+        print(f'outage: {args.edits} edits acknowledged in {statistics.median(latencies) * 1e3:.2f} ms (p50), '
+              f'{attempts} failed attempts before the restart, synced {synced * 1e3:.0f} ms after it')
+
+        latencies, synced, calls = asyncio.run(flaky(os.path.join(directory, 'flaky.sqlite3'), args.edits,
+                                                     args.failure_rate))
+        print(f'flaky ({args.failure_rate:.0%} of calls fail): {args.edits} edits acknowledged in '
+              f'{statistics.median(latencies) * 1e3:.2f} ms (p50), all on GitHub after {synced * 1e3:.0f} ms '
+              f'and {calls} calls')
+
+        latencies, synced, responses = asyncio.run(lost(os.path.join(directory, 'lost.sqlite3'), args.edits,
+                                                        args.lost_rate))
+        print(f'lost ({args.lost_rate:.0%} of push responses lost): {args.edits} edits acknowledged in '
+              f'{statistics.median(latencies) * 1e3:.2f} ms (p50), all on GitHub after {synced * 1e3:.0f} ms, '
+              f'{responses} pushes that landed were retried')
+
+        latencies = asyncio.run(reading(os.path.join(directory, 'reading.sqlite3'), 50, args.reading_days))
+        print(f'reading ({args.reading_days} days): with 1 to 50 unsynced edits the calendar is read in '
+              f'{statistics.median(latencies) * 1e3:.2f} ms (p50), {max(latencies) * 1e3:.2f} ms (max)')
+    print('no edit was lost or applied twice')
+
+
+if __name__ == '__main__':
+    run_benchmark()
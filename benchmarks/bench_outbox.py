@@ -0,0 +1,121 @@
+# Simulated burst of replies against a channel that enforces Discord's limits:
+# 5 messages per 5 seconds per channel (a 429 beyond that), 2000 characters per
+# message, and a fixed round trip per send. Compares sending every ctx.send
+# straight away with going through the outbox, and checks that no text is
+# lost, reordered or sent over the limit.
+#
+#   python -m benchmarks.bench_outbox [--channels 5] [--replies 6] [--latency 0.05]
+
+import argparse
+import asyncio
+import time
+
+from metrics import metrics
+from outbox import FENCE, LIMIT, Outbox, split_message
+
+
+class RateLimited(Exception):
+    status = 429
+
+    def __init__(self, retry_after):
+        super().__init__(f'429, retry after {retry_after:.2f}s')
+        self.retry_after = retry_after
+
+
+class FakeChannel:
+    def __init__(self, latency, rate=5, per=5.0):
+        self.latency = latency
+        self.rate = rate
+        self.per = per
+        self.sent = []
+        self.times = []
+        self.rejected = 0
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        recent = [sent for sent in self.times if now - sent < self.per]
+        if len(recent) >= self.rate:
+            self.rejected += 1
+            raise RateLimited(self.per - (now - recent[0]))
+        assert content is None or len(content) <= LIMIT, f'{len(content)} characters in one message'
+        self.times.append(now)
+        self.sent.append(content)
+
+
+# one conversation turn: a long preview, then the question about it
+def replies(channel, count):
+    for turn in range(count):
+        preview = f'[{channel}:{turn}] ' + '<div date="01/01/2023" credit="50">event</div> ' * (turn * 7)
+        yield preview.strip()
+        yield f'[{channel}:{turn}] Do you want to add this event to the calendar? (yes/no/revise)'
+
+
+async def direct(channel, count):
+    for content in replies(id(channel), count):
+        while True:
+            try:
+                await channel.send(content)
+                break
+            except RateLimited as e:
+                await asyncio.sleep(e.retry_after)
+
+
+async def through_outbox(outbox, channel, count):
+    for content in replies(id(channel), count):
+        await outbox.send(id(channel), channel.send, content)
+    while len(outbox):
+        await asyncio.sleep(0.01)
+
+
+async def run(mode, channels, count, latency):
+    fakes = [FakeChannel(latency) for _ in range(channels)]
+    outbox = Outbox()
+    metrics.histograms.clear()
+    started = time.perf_counter()
+    if mode == 'direct':
+        await asyncio.gather(*(direct(channel, count) for channel in fakes))
+    else:
+        await asyncio.gather(*(through_outbox(outbox, channel, count) for channel in fakes))
+        while outbox._workers:
+            await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    for channel in fakes:
+        expected = '\n'.join(replies(id(channel), count))
+        # the outbox may merge at a line break or split at one
+        assert ''.join(''.join(channel.sent).split()) == ''.join(expected.split()), 'text lost or reordered'
+    sends = sum(len(channel.sent) for channel in fakes)
+    rejected = sum(channel.rejected for channel in fakes)
+    latencies = metrics.by_label('phase_seconds', 'phase').get('send')
+    return elapsed, sends, rejected, latencies
+
+
+# an export preview far over the limit, inside a code block
+def check_split():
+    text = '```html\n' + '\n'.join(f'<div date="01/{day % 28 + 1:02}/2023">event {day}</div>' for day in range(400)) + '\n```'
+    chunks = split_message(text)
+    assert all(len(chunk) <= LIMIT for chunk in chunks), 'a chunk is over the limit'
+    assert all(chunk.count(FENCE) % 2 == 0 for chunk in chunks), 'a chunk leaves a code block open'
+    return len(text), len(chunks)
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--replies', type=int, default=6, help='preview + question pairs per channel')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per send')
+    args = parser.parse_args()
+
+    length, chunks = check_split()
+    print(f'split: {length} characters in a code block -> {chunks} messages, all within {LIMIT} and fenced')
+    print('mode | total (s) | sends | 429s | send latency p50 / p95 (ms)')
+    for mode in ('direct', 'outbox'):
+        elapsed, sends, rejected, latencies = asyncio.run(run(mode, args.channels, args.replies, args.latency))
+        percentiles = (f'{latencies.quantile(0.5) * 1e3:g} / {latencies.quantile(0.95) * 1e3:g}'
+                       if latencies else '-')
+        print(f'{mode} | {elapsed:.2f} | {sends} | {rejected} | {percentiles}')
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,103 @@
+# Parse throughput and peak memory of the dedicated events.html scanner against
+# the BeautifulSoup path, after checking that the scanner reads the same divs as
+# the find_all lookups main.py used before it (tests/test_events_parser.py runs
+# the same check).
+#
+#   python -m benchmarks.bench_parser [--days 3650 36500]
+
+import argparse
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from benchmarks.synthetic import generate_calendar
+from calendar_model import Calendar, parse_records, soup_records, tag_attrs
+
+SAMPLES = [
+    '<div date="1/2/2023" credit="5">a <br> b</div>',
+    "<div credit='7' date='01/03/2023'>single quotes</div>",
+    '<div id="events">\n <div DATE="01/04/2023" credit=9>\n  nested in a container\n </div>\n</div>',
+    '<!-- <div date="01/05/2023" credit="1">commented out</div> -->',
+    '<div class="base" credit="3" start="02/01/2023" end="02/03/2023" hue="10"><i>q &amp; a</i></div>',
+    '<div start="01/01/2023" end="01/03/2023" color="#fff">p</div >',
+]
+
+
+def div_text(html):
+    return BeautifulSoup(html, 'html.parser').div.get_text()
+
+
+# the calendar divs as main.py found them before the scanner, in document order
+def find_all_records(soup):
+    events = soup.find_all('div', attrs={'date': True, 'credit': True})
+    seen = {id(tag) for tag in events}
+    periods = [tag for tag in soup.find_all('div', attrs={'start': True, 'end': True}) if id(tag) not in seen]
+    tags = sorted(events + periods, key=lambda tag: (tag.sourceline, tag.sourcepos))
+    return [('Event' if id(tag) in seen else 'Period', tag_attrs(tag), tag.get_text()) for tag in tags]
+
+
+def check_equivalence(text):
+    soup = BeautifulSoup(text, 'html.parser')
+    fast = [(type(record).__name__, record.attrs, div_text(record.html)) for record in parse_records(text)]
+    assert fast == find_all_records(soup), f'scanner and find_all disagree on {text[:80]!r}'
+    # and a lookup by date finds the div find_all(...)[0] found (for about 50
+    # dates: every find_all walks the whole tree)
+    calendar = Calendar.from_html(text)
+    events = soup.find_all('div', attrs={'date': True, 'credit': True})
+    for tag in events[::max(1, len(events) // 50)]:
+        first = soup.find_all('div', attrs={'date': tag['date'], 'credit': True})[0]
+        event = calendar.find_event(tag['date'])
+        assert (event.attrs, div_text(event.html)) == (tag_attrs(first), first.get_text()), tag['date']
+
+
+def elapsed(func, text):
+    started = time.perf_counter()
+    func(text)
+    return time.perf_counter() - started
+
+
+# measured in a separate run: tracing allocations slows the parsers down a lot
+def peak_memory(func, text):
+    tracemalloc.start()
+    func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run(days):
+    text = generate_calendar(days)
+    check_equivalence(text)
+    check_equivalence(BeautifulSoup(text, 'html.parser').prettify())
+
+    megabytes = len(text.encode('utf-8')) / 2 ** 20
+    soup_parse = lambda text: list(soup_records(text))
+    return {
+        'days': days,
+        'file (MB)': megabytes,
+        'scanner (MB/s)': megabytes / elapsed(parse_records, text),
+        'soup (MB/s)': megabytes / elapsed(soup_parse, text),
+        'scanner peak (MB)': peak_memory(parse_records, text) / 2 ** 20,
+        'soup peak (MB)': peak_memory(soup_parse, text) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, nargs='+', default=[3650, 36500])
+    args = parser.parse_args()
+
+    for sample in SAMPLES:
+        check_equivalence(sample)
+
+    rows = [run(days) for days in args.days]
+    columns = list(rows[0])
+    print(' | '.join(columns))
+    for row in rows:
+        print(' | '.join(f'{row[column]:.2f}' if isinstance(row[column], float) else str(row[column])
+                         for column in columns))
+
+
+if __name__ == '__main__':
+    main()
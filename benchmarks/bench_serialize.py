@@ -0,0 +1,61 @@
+# Serialization after a single edit: soup.prettify() against splicing the
+# changed div into the original text. Reports time, upload size and how many
+# lines the resulting commit would touch.
+#
+#   python -m benchmarks.bench_serialize [--years 1 10 30]
+
+import argparse
+import difflib
+import timeit
+from datetime import timedelta
+
+from bs4 import BeautifulSoup
+
+from benchmarks.synthetic import FIRST_DAY, format_date, generate_calendar
+from calendar_model import Calendar, Mutation
+
+
+def changed_lines(before, after):
+    diff = difflib.unified_diff(before.splitlines(), after.splitlines(), lineterm='', n=0)
+    return sum(1 for line in diff if line[:1] in '+-' and line[:3] not in ('+++', '---'))
+
+
+def run(years):
+    text = generate_calendar(years * 365)
+    day = format_date(FIRST_DAY + timedelta(days=years * 365 // 2))
+    new_div = f'<div date="{day}" credit="42">revised <br> day</div>'
+
+    soup = BeautifulSoup(text, 'html.parser')
+    soup.find('div', attrs={'date': day}).replace_with(BeautifulSoup(new_div, 'html.parser'))
+    calendar = Calendar.from_html(text)
+    calendar.apply(Mutation('put_event', day, new_div))
+
+    prettified = soup.prettify()
+    spliced = calendar.to_html()
+    return {
+        'years': years,
+        'file (KB)': len(text.encode('utf-8')) / 1024,
+        'prettify (ms)': min(timeit.repeat(soup.prettify, number=1, repeat=3)) * 1e3,
+        'splice (ms)': min(timeit.repeat(calendar._splice, number=1, repeat=3)) * 1e3,
+        'prettify upload (KB)': len(prettified.encode('utf-8')) / 1024,
+        'splice upload (KB)': len(spliced.encode('utf-8')) / 1024,
+        'prettify diff lines': changed_lines(text, prettified),
+        'splice diff lines': changed_lines(text, spliced),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 10, 30])
+    args = parser.parse_args()
+
+    rows = [run(years) for years in args.years]
+    columns = list(rows[0])
+    print(' | '.join(columns))
+    for row in rows:
+        print(' | '.join(f'{row[column]:.2f}' if isinstance(row[column], float) else str(row[column])
+                         for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Load test of the conversation router: N simulated users each run an
+# interactive command at the same time and answer its prompts. Reports how long
+# an answer takes to reach its command as the number of open sessions grows,
+# and checks that no command ever receives another user's answer.
+#
+#   python -m benchmarks.bench_sessions [--sessions 10 100 1000 5000]
+
+import argparse
+import asyncio
+import math
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+from conversation import ConversationRouter
+
+STEPS = 5
+
+
+def fake_message(channel, author, content):
+    return SimpleNamespace(channel=SimpleNamespace(id=channel), author=SimpleNamespace(id=author),
+                           content=content, sent_at=time.perf_counter())
+
+
+async def command(router, ctx, latencies):
+    for step in range(STEPS):
+        message = await router.wait_for_message(ctx)
+        latencies.append(time.perf_counter() - message.sent_at)
+        assert message.content == f'{ctx.author.id}:{step}', 'answer routed to the wrong session'
+    router.close(ctx)
+
+
+async def user(router, channel, author, rng):
+    for step in range(STEPS):
+        await asyncio.sleep(rng.uniform(0, 1.0))
+        router.dispatch(fake_message(channel, author, f'{author}:{step}'))
+
+
+async def run(sessions):
+    router = ConversationRouter(timeout=30)
+    rng = random.Random(sessions)
+    latencies = []
+    tasks = []
+    for author in range(sessions):
+        channel = author % 7  # several users share each channel
+        ctx = SimpleNamespace(channel=SimpleNamespace(id=channel), author=SimpleNamespace(id=author))
+        router.open(ctx)
+        tasks.append(command(router, ctx, latencies))
+        tasks.append(user(router, channel, author, rng))
+    await asyncio.gather(*tasks)
+    assert len(router) == 0
+
+    latencies.sort()
+    return {
+        'sessions': sessions,
+        'answers': len(latencies),
+        'p50 (ms)': statistics.median(latencies) * 1e3,
+        'p99 (ms)': latencies[math.ceil(len(latencies) * 0.99) - 1] * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    args = parser.parse_args()
+
+    rows = [asyncio.run(run(sessions)) for sessions in args.sessions]
+    columns = list(rows[0])
+    print(' | '.join(columns))
+    for row in rows:
+        print(' | '.join(f'{row[column]:.2f}' if isinstance(row[column], float) else str(row[column])
+                         for column in columns))
+
+
+if __name__ == '__main__':
+    main()
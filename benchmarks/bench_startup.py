@@ -0,0 +1,145 @@
+# How fast the bot is ready: after starting, and after Discord drops it.
+#
+# The first part imports main.py in a fresh interpreter (as restart.py used to
+# do after every disconnect) and reports how long that takes, and whether
+# PyGithub, BeautifulSoup and NumPy were left for their first use.
+#
+# The second part runs the bot's own client and supervisor (discord.py itself,
+# not a stand-in) against a local fake of Discord: the first logins are refused
+# with a Cloudflare-style 429, the client is closed while the supervisor waits
+# out the last one, and once connected the gateway drops the connection a few
+# times. It reports the time from each disconnect to READY or RESUMED, next to
+# what restart.py took (7 seconds of sleep plus a cold import, before even
+# reaching GitHub and Discord). A command that is waiting for the user's answer
+# over all of it is answered at the end, to show that it carried on.
+#
+#   python -m benchmarks.bench_startup [--outages 5] [--bans 3] [--min-delay 0.05]
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import github
+
+from benchmarks.fake_discord import FakeContext, FakeDiscordAPI
+from benchmarks.fake_github import FakeGithub, FakeRepo
+from benchmarks.synthetic import generate_calendar
+
+ENVIRONMENT = {'GITHUB_TOKEN': 'offline', 'GITHUB_REPO_NAME': 'benchmark/calendar', 'COMMIT_WINDOW_SECONDS': '0',
+               'JOURNAL_PATH': ':memory:'}
+IMPORT = '''
+import sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(elapsed, *(name in sys.modules for name in ('github', 'bs4', 'numpy')))
+'''
+EAGER = 'import github, bs4, numpy\n'
+
+for name, value in ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+github.Github = FakeGithub
+import main  # noqa: E402
+
+
+# seconds to import main.py in a new interpreter, and which heavy modules it loaded
+def cold_import(runs, eager=False):
+    times = []
+    for _ in range(runs):
+        script = IMPORT.replace('import main\n', 'import main\n' + EAGER) if eager else IMPORT
+        output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True,
+                                env={**os.environ, **ENVIRONMENT}).stdout.split()
+        times.append(float(output[0]))
+    return statistics.median(times), dict(zip(('github', 'bs4', 'numpy'), (value == 'True' for value in output[1:])))
+
+
+async def run(outages, bans, min_delay):
+    api = FakeDiscordAPI(bans=bans, retry_after=min_delay * 2)
+    await api.start()
+    FakeGithub.repos['benchmark/calendar'] = FakeRepo({'events.html': generate_calendar(365)})
+    client, supervisor = main.client, main.supervisor
+    supervisor.token = 'offline'
+    supervisor.min_delay, supervisor.max_delay = min_delay, min_delay * 8
+    # there are no guilds to wait for
+    client._connection.guild_ready_timeout = 0
+    ctx = FakeContext()
+    ready = []
+    waiting = []
+
+    # while the supervisor waits out the last ban the client is closed, as
+    # discord.py does when it gives up: logging in again needs a new HTTP session
+    async def close_during_backoff():
+        while api.logins < bans:
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(min_delay / 4)
+        await client.close()
+
+    async def on_ready():
+        ready.append(supervisor.last_ready)
+        if len(ready) == 1:
+            # a command waits for its answers over every disconnect
+            ctx.tenant = await main.tenants.get(None, ctx.author.id)
+            main.conversations.open(ctx)
+            waiting.append(asyncio.create_task(main.new_event.callback(ctx)))
+        if len(ready) <= outages:
+            await asyncio.sleep(0.05)
+            await api.drop()
+            return
+        for message in ctx.answers(['gym', 'no', '85', 'yes']):
+            main.conversations.dispatch(message)
+        await waiting[0]
+        main.conversations.close(ctx)
+        # the fake gateway hangs up first: aiohttp's client waits 30 seconds for
+        # the fake to answer a close started from this side
+        await api.drop(code=1000)
+        await client.close()
+
+    client.add_listener(on_ready, 'on_ready')
+    client.add_listener(on_ready, 'on_resumed')
+    closer = asyncio.create_task(close_during_backoff()) if bans else None
+    try:
+        await supervisor.run()
+    finally:
+        await api.stop()
+    await ctx.tenant.replayer.drain()
+    assert closer is None or closer.done()
+    assert 'Successfully added events for the date!' in ctx.sent, f'the waiting command did not finish: {ctx.sent}'
+    assert supervisor.reconnects == bans, supervisor.reconnects
+    assert api.identifies == 1 and api.resumes == outages, (api.identifies, api.resumes)
+    return ready, supervisor
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--outages', type=int, default=5, help='connections dropped by the gateway')
+    parser.add_argument('--bans', type=int, default=3, help='logins refused before the first connection')
+    parser.add_argument('--min-delay', type=float, default=0.05, help='first backoff delay in seconds')
+    parser.add_argument('--import-runs', type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    lazy, loaded = cold_import(args.import_runs)
+    eager, _ = cold_import(args.import_runs, eager=True)
+    print(f'import main: {lazy * 1e3:.0f} ms ({eager * 1e3:.0f} ms with PyGithub, BeautifulSoup and NumPy); '
+          f'loaded at import: {", ".join(name for name, value in loaded.items() if value) or "none of them"}')
+
+    started = time.perf_counter()
+    ready, supervisor = asyncio.run(run(args.outages, args.bans, args.min_delay))
+    elapsed = time.perf_counter() - started
+    reconnects = ready[1:]
+    closed = ', closed during the last one' if args.bans else ''
+    print(f'{args.bans} refused logins (first backoff {args.min_delay * 1e3:g} ms{closed}), '
+          f'then {args.outages} dropped connections, in {elapsed:.2f}s')
+    print(f'time to ready: startup {ready[0]:.2f}s, after a dropped connection p50 '
+          f'{statistics.median(reconnects) * 1e3:.1f} ms, max {max(reconnects) * 1e3:.1f} ms')
+    print(f'restart.py: at least {7 + lazy:.2f}s after every disconnect (7s sleep and a cold import), '
+          f'and the command waiting for an answer was lost; here it finished after the last reconnect')
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,138 @@
+# Hundreds of tenants in one process, against the fake GitHub: every tenant is
+# a guild with its own repository, spread over a handful of tokens. A skewed
+# stream of edits (a few busy guilds, a long tail of quiet ones) goes through
+# the registry. One tenant's repository refuses every commit for the whole run,
+# to show that its edits wait in its own journal without holding up anybody else.
+#
+# Reports the latency of a tenant's first command (opening it), of commands on
+# a cached tenant and of commands after its cache was evicted, how much the
+# caches hold against the budget, and how many clients and threads are shared.
+# Asserts that every edit landed in its own tenant's repository exactly once.
+#
+#   python -m benchmarks.bench_tenants [--tenants 300] [--commands 3000] [--budget-mb 4]
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+
+import github
+
+from benchmarks.fake_github import FakeGithub, FakeRepo
+from benchmarks.synthetic import FIRST_DAY, format_date, generate_calendar
+
+github.Github = FakeGithub
+from calendar_model import Calendar, Mutation, event_div  # noqa: E402
+from tenants import TenantRegistry, make_config  # noqa: E402
+
+TOKENS = 4
+
+
+def configs(count):
+    for index in range(TOKENS):
+        os.environ[f'BENCHMARK_TOKEN_{index}'] = 'offline'
+    return {f'guild-{guild}': make_config(f'guild-{guild}', {'repo': f'tenant/{guild}',
+                                                              'token': f'BENCHMARK_TOKEN_{guild % TOKENS}'})
+            for guild in range(count)}
+
+
+def refuse(*args, **kwargs):
+    raise github.GithubException(503, {'message': 'Service Unavailable'}, {})
+
+
+async def command(registry, guild, index):
+    started = time.perf_counter()
+    cached = any(tenant.key == f'guild-{guild}' and len(tenant.documents) for tenant in registry)
+    tenant = await registry.get(guild, user_id=0)
+    layout = await tenant.layout()
+    day = format_date(FIRST_DAY + timedelta(days=1000 + index))
+    mutation = Mutation('put_event', day, event_div(day, 50, [f'{guild}:{index}']))
+    await tenant.submit(layout, layout.path_for(day), [mutation], f'[Calendar Bot]: Update events for {day}')
+    return time.perf_counter() - started, cached
+
+
+async def run(count, commands, days, budget, directory):
+    for guild in range(count):
+        FakeGithub.repos[f'tenant/{guild}'] = FakeRepo({'events.html': generate_calendar(days, seed=guild)})
+    FakeGithub.repos['tenant/0'].create_git_commit = refuse
+    registry = TenantRegistry(configs(count), journal_directory=directory, budget=budget, commit_window=0.01)
+
+    rng = random.Random(0)
+    # guild g is picked with a weight of 1 / (g + 1)
+    weights = [1 / (guild + 1) for guild in range(count)]
+    stream = [guild for guild in range(count)] + rng.choices(range(count), weights, k=max(0, commands - count))
+    rng.shuffle(stream)
+
+    first, warm, evicted = [], [], []
+    seen = set()
+    expected = {}
+    tracemalloc.start()
+    for index, guild in enumerate(stream):
+        elapsed, cached = await command(registry, guild, index)
+        (warm if cached else evicted if guild in seen else first).append(elapsed)
+        seen.add(guild)
+        expected.setdefault(guild, []).append(index)
+    for tenant in registry:
+        if tenant.key != 'guild-0':
+            await tenant.replayer.drain()
+    # what the caches hold, parsed calendars included: the memory freed by dropping them
+    cached = registry.cached()
+    before, _ = tracemalloc.get_traced_memory()
+    for tenant in registry:
+        tenant.documents.clear()
+    gc.collect()
+    held = before - tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    for guild, indexes in expected.items():
+        if guild == 0:
+            continue
+        calendar = Calendar.from_html(FakeGithub.repos[f'tenant/{guild}'].text('events.html'))
+        edits = [event.descriptions[0] for event in calendar.events if event.descriptions[0].startswith(f'{guild}:')]
+        assert sorted(edits) == sorted(f'{guild}:{index}' for index in indexes), f'guild {guild} lost or mixed up edits'
+    down = next(tenant for tenant in registry if tenant.key == 'guild-0')
+    assert len(down.journal) == len(expected[0]), 'the tenant that cannot commit lost edits'
+
+    evictions = sum(tenant.documents.evictions for tenant in registry)
+    return {
+        'first': first, 'warm': warm, 'evicted': evicted, 'held': held, 'cached': cached,
+        'evictions': evictions, 'clients': len(registry._clients), 'threads': threading.active_count(),
+        'tenants': len(registry), 'waiting': len(down.journal),
+    }
+
+
+def p50(values):
+    return f'{statistics.median(values) * 1e3:.2f} ms ({len(values)})' if values else '-'
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tenants', type=int, default=300)
+    parser.add_argument('--commands', type=int, default=3000)
+    parser.add_argument('--days', type=int, default=365, help='size of every tenant\'s calendar')
+    parser.add_argument('--budget-mb', type=float, default=4.0)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        result = asyncio.run(run(args.tenants, args.commands, args.days, int(args.budget_mb * 2 ** 20), directory))
+    print(f'{result["tenants"]} tenants, {args.commands} commands, {args.days} days each')
+    print(f'first command p50 {p50(result["first"])}, cached p50 {p50(result["warm"])}, '
+          f'after eviction p50 {p50(result["evicted"])}')
+    print(f'cache {result["cached"] / 2 ** 20:.1f} MB (estimated) within a budget of {args.budget_mb:g} MB, '
+          f'{result["held"] / 2 ** 20:.1f} MB measured, {result["evictions"]} evictions')
+    print(f'{result["clients"]} GitHub clients, {result["threads"]} threads')
+    print(f'{result["waiting"]} edits of the tenant that cannot commit wait in its journal; '
+          'every other edit landed in its own repository exactly once')
+
+
+if __name__ == '__main__':
+    run_benchmark()
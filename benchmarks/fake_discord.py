@@ -0,0 +1,128 @@
+# A scripted stand-in for a discord command context: the user's answers are
+# queued up front and everything the bot sends is recorded. FakeDiscordAPI
+# below stands in for Discord itself, for a real client to log in and connect to.
+
+import json
+from itertools import count
+from types import SimpleNamespace
+
+import discord
+import yarl
+from aiohttp import web
+
+_ids = count(1000)
+
+
+class FakeAttachment:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self._data = data
+
+    async def read(self):
+        return self._data
+
+
+class FakeMessage:
+    def __init__(self, author, channel, content, attachments=()):
+        self.id = next(_ids)
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.attachments = list(attachments)
+
+
+class FakeContext:
+    def __init__(self, user_id=1, channel_id=1, name='benchmark', content='', attachments=()):
+        self.author = SimpleNamespace(id=user_id, name=name, bot=False)
+        self.channel = SimpleNamespace(id=channel_id)
+        self.guild = None
+        self.message = FakeMessage(self.author, self.channel, content, attachments)
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+        return FakeMessage(None, self.channel, content)
+
+    def answers(self, contents):
+        return [FakeMessage(self.author, self.channel, content) for content in contents]
+
+
+# The parts of Discord's REST API and gateway that logging in and connecting
+# use, served on localhost so that a real discord.py client can run against it
+# (see start()). `bans` logins are refused like Cloudflare does: a 429 without
+# a Via header, which discord.py does not retry itself. drop() closes the open
+# gateway connections with a code discord.py resumes from.
+class FakeDiscordAPI:
+    USER = {'id': '2', 'username': 'calendar-bot', 'discriminator': '0001', 'avatar': None, 'bot': True}
+
+    def __init__(self, bans=0, retry_after=0.1):
+        self.bans = bans
+        self.retry_after = retry_after
+        self.logins = 0
+        self.identifies = 0
+        self.resumes = 0
+        self._sockets = set()
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api/v10/users/@me', self._me)
+        app.router.add_get('/api/v10/oauth2/applications/@me', self._application)
+        app.router.add_get('/gateway', self._gateway)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        discord.http.Route.BASE = f'{self.url}/api/v10'
+        discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(f'ws://127.0.0.1:{port}/gateway')
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _me(self, request):
+        self.logins += 1
+        if self.logins <= self.bans:
+            return web.Response(status=429, text='You are being rate limited.',
+                                headers={'Retry-After': str(self.retry_after)})
+        return json_response(self.USER)
+
+    async def _application(self, request):
+        owner = {'id': '1', 'username': 'owner', 'discriminator': '0001', 'avatar': None}
+        return json_response({'id': '2', 'name': 'Calendar Bot', 'description': '', 'icon': None,
+                                  'rpc_origins': [], 'bot_public': False, 'bot_require_code_grant': False,
+                                  'owner': owner, 'verify_key': '', 'flags': 0})
+
+    async def _gateway(self, request):
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        self._sockets.add(socket)
+        sequence = 0
+        await socket.send_json({'op': 10, 'd': {'heartbeat_interval': 45000}})
+        async for message in socket:
+            payload = message.json()
+            if payload['op'] == 1:
+                await socket.send_json({'op': 11})
+                continue
+            sequence += 1
+            if payload['op'] == 2:
+                self.identifies += 1
+                await socket.send_json({'op': 0, 't': 'READY', 's': sequence, 'd': {
+                    'v': 10, 'user': self.USER, 'guilds': [], 'session_id': 'benchmark',
+                    'resume_gateway_url': str(request.url.with_query(None)), 'application': {'id': '2', 'flags': 0}}})
+            elif payload['op'] == 6:
+                self.resumes += 1
+                await socket.send_json({'op': 0, 't': 'RESUMED', 's': sequence, 'd': {}})
+        self._sockets.discard(socket)
+        return socket
+
+    async def drop(self, code=4000):
+        for socket in list(self._sockets):
+            await socket.close(code=code)
+
+
+# discord.py only decodes a body whose content type is exactly application/json
+def json_response(data):
+    return web.Response(body=json.dumps(data).encode('utf-8'), headers={'Content-Type': 'application/json'})
@@ -0,0 +1,188 @@
+# An in-process stand-in for the parts of PyGithub the bot uses: the contents
+# API (get_contents / update_file, with ETag revalidation) and the Git Data API
+# (refs, commits, trees). Every call can be slowed down by `delay` seconds to
+# mimic network round trips, and calls are counted per method. Setting `down`,
+# or a `failure_rate` between 0 and 1, makes calls fail with a 503 before they
+# take effect; a `lost_rate` between 0 and 1 makes pushes (update_file, ref
+# edits) fail with a 502 after they took effect, like a response lost on the way back.
+
+import random
+import time
+from collections import Counter
+from itertools import count
+
+from github import GithubException
+
+from storage import blob_sha
+
+
+class FakeContentFile:
+    def __init__(self, repo, path, ref):
+        self._repo = repo
+        self.path = path
+        self._ref = ref
+        self._load()
+
+    def _load(self):
+        data = self._repo._read(self.path, self._ref).encode('utf-8')
+        self.decoded_content = data
+        self.sha = blob_sha(data)
+        self.etag = self.sha
+
+    # conditional request: False when the blob did not change (a 304)
+    def update(self):
+        self._repo._call('update')
+        old = self.etag
+        self._load()
+        return self.sha != old
+
+
+class FakeTree:
+    def __init__(self, sha, files):
+        self.sha = sha
+        self.files = files
+
+
+class FakeCommit:
+    def __init__(self, sha, tree, parents, message):
+        self.sha = sha
+        self.tree = tree
+        self.parents = parents
+        self.message = message
+        self.date = time.time()
+
+    # get_commits() gives Commit objects whose `commit` is the git commit
+    @property
+    def commit(self):
+        return self
+
+
+class FakeRef:
+    def __init__(self, repo, branch):
+        self._repo = repo
+        self._branch = branch
+        self.object = FakeCommit(repo._heads[branch], None, [], '')
+
+    def edit(self, sha, force=False):
+        self._repo._call('edit_ref')
+        commit = self._repo._commits[sha]
+        head = self._repo._heads[self._branch]
+        if not force and head not in [parent.sha for parent in commit.parents]:
+            raise GithubException(422, {'message': 'Update is not a fast forward'}, {})
+        self._repo._heads[self._branch] = sha
+        self.object = commit
+        self._repo._lose()
+
+
+class FakeRepo:
+    def __init__(self, files, branch='master', delay=0.0):
+        self.delay = delay
+        self.down = False
+        self.failure_rate = 0.0
+        self.lost_rate = 0.0
+        self.lost = 0
+        self._rng = random.Random(0)
+        self.calls = Counter()
+        self._ids = count(1)
+        self._commits = {}
+        self._heads = {}
+        root = self._new_commit(dict(files), [], 'initial')
+        self._heads[branch] = root.sha
+
+    def _call(self, name):
+        self.calls[name] += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.down or self._rng.random() < self.failure_rate:
+            raise GithubException(503, {'message': 'Service Unavailable'}, {})
+
+    # called once a push took effect
+    def _lose(self):
+        if self._rng.random() < self.lost_rate:
+            self.lost += 1
+            raise GithubException(502, {'message': 'Bad Gateway'}, {})
+
+    def _new_commit(self, files, parents, message):
+        sha = f'{next(self._ids):040x}'
+        commit = FakeCommit(sha, FakeTree(sha, files), parents, message)
+        self._commits[sha] = commit
+        return commit
+
+    def _head(self, ref):
+        return self._commits[self._heads.get(ref, ref)]
+
+    def _read(self, path, ref):
+        files = self._head(ref).tree.files
+        if path not in files:
+            raise GithubException(404, {'message': 'Not Found'}, {})
+        return files[path]
+
+    # what the branch holds right now, for checks and reports
+    def text(self, path, branch='master'):
+        return self._read(path, branch)
+
+    def get_contents(self, path, ref='master'):
+        self._call('get_contents')
+        return FakeContentFile(self, path, ref)
+
+    def update_file(self, path, message, content, sha, branch='master'):
+        self._call('update_file')
+        head = self._head(branch)
+        current = head.tree.files.get(path, '').encode('utf-8')
+        if blob_sha(current) != sha:
+            raise GithubException(409, {'message': f'{path} does not match {sha}'}, {})
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        files = dict(head.tree.files)
+        files[path] = content
+        commit = self._new_commit(files, [head], message)
+        self._heads[branch] = commit.sha
+        self._lose()
+        return {'commit': commit, 'content': FakeContentFile(self, path, branch)}
+
+    # the commits reachable from `sha` made since the datetime `since`, newest first
+    def get_commits(self, sha, since):
+        self._call('get_commits')
+        commits, seen, stack = [], set(), [self._head(sha)]
+        while stack:
+            commit = stack.pop()
+            if commit.sha not in seen and commit.date >= since.timestamp():
+                seen.add(commit.sha)
+                commits.append(commit)
+                stack.extend(commit.parents)
+        return sorted(commits, key=lambda commit: commit.date, reverse=True)
+
+    def get_git_ref(self, ref):
+        self._call('get_git_ref')
+        return FakeRef(self, ref.split('/', 1)[1])
+
+    def get_git_commit(self, sha):
+        self._call('get_git_commit')
+        return self._commits[sha]
+
+    def create_git_tree(self, elements, base_tree=None):
+        self._call('create_git_tree')
+        files = dict(base_tree.files) if base_tree is not None else {}
+        for element in elements:
+            identity = element._identity
+            if identity.get('sha', '') is None:
+                files.pop(identity['path'], None)
+            else:
+                files[identity['path']] = identity['content']
+        return FakeTree(None, files)
+
+    def create_git_commit(self, message, tree, parents):
+        self._call('create_git_commit')
+        return self._new_commit(tree.files, list(parents), message)
+
+
+class FakeGithub:
+    repos = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_repo(self, name):
+        if name not in self.repos:
+            self.repos[name] = FakeRepo({'events.html': ''})
+        return self.repos[name]
@@ -0,0 +1,36 @@
+# Synthetic events.html files for the benchmarks: N days of events followed by
+# M ordinary periods and B base periods spread over the same days.
+
+import random
+from datetime import date, timedelta
+
+from calendar_model import base_period_div, event_div, period_div
+
+FIRST_DAY = date(1990, 1, 1)
+WORDS = ['gym', 'paper deadline', 'groceries', 'called mom', 'code review', 'movie night',
+         'hiking', 'dentist', 'read a book', 'team lunch', 'flight', 'rainy day']
+
+
+def format_date(day):
+    return day.strftime('%m/%d/%Y')
+
+
+def random_event(day, rng):
+    return event_div(format_date(day), rng.randint(0, 100), rng.sample(WORDS, rng.randint(1, 4)))
+
+
+def random_period(start, rng, base=False):
+    end = format_date(start + timedelta(days=rng.randint(1, 60)))
+    description = rng.choice(WORDS).capitalize()
+    if base:
+        return base_period_div(format_date(start), end, rng.randint(0, 100), rng.randint(0, 360), description)
+    return period_div(format_date(start), end, '#%06x' % rng.randrange(0x1000000), description)
+
+
+def generate_calendar(days, periods=0, base_periods=0, seed=0):
+    rng = random.Random(seed)
+    lines = [random_event(FIRST_DAY + timedelta(days=i), rng) for i in range(days)]
+    starts = sorted([(rng.randrange(max(days, 1)), False) for _ in range(periods)] +
+                    [(rng.randrange(max(days, 1)), True) for _ in range(base_periods)])
+    lines += [random_period(FIRST_DAY + timedelta(days=offset), rng, base) for offset, base in starts]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,120 @@
+# Bulk import and export of events and periods as CSV or JSON.
+# Both formats hold the same rows:
+#   type         event | period | base
+#   date         events only, mm/dd/yyyy
+#   start, end   periods only, mm/dd/yyyy
+#   credit       events and base periods, 0-100
+#   hue          base periods, 0-360
+#   color        ordinary periods, #xxxxxx
+#   description  for events, several events separated by " | "
+
+import csv
+import io
+import json
+
+from calendar_model import base_period_div, event_div, parse_div, period_div
+from validation import CREDIT_RANGE, HUE_RANGE, parse_color, parse_date, parse_integer, parse_period_dates, split_events
+
+COLUMNS = ['type', 'date', 'start', 'end', 'credit', 'hue', 'color', 'description']
+EVENT_SEPARATOR = ' | '
+
+
+def format_of(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension not in ('csv', 'json'):
+        raise ValueError('Please attach a .csv or a .json file.')
+    return extension
+
+
+def read_rows(data, file_format):
+    text = data.decode('utf-8-sig')
+    if file_format == 'csv':
+        return csv.DictReader(io.StringIO(text))
+    rows = json.loads(text)
+    if not isinstance(rows, list):
+        raise ValueError('The JSON file should contain a list of rows.')
+    return rows
+
+
+def _field(row, name):
+    value = row.get(name)
+    return '' if value is None else str(value).strip()
+
+
+# one row -> the div it describes, with the same rules as the interactive prompts
+def row_to_div(row):
+    if not isinstance(row, dict):
+        raise ValueError('not a row')
+    kind = _field(row, 'type').lower()
+    if kind not in ('event', 'period', 'base'):
+        raise ValueError(f'unknown type "{kind}" (expected event, period or base)')
+    description = _field(row, 'description')
+    if not description:
+        raise ValueError('missing description')
+
+    if kind == 'event':
+        events = split_events(description)
+        return event_div(parse_date(_field(row, 'date')), parse_integer(_field(row, 'credit'), CREDIT_RANGE), events)
+
+    start, end = parse_period_dates(_field(row, 'start'), _field(row, 'end'))
+    if kind == 'period':
+        return period_div(start, end, parse_color(_field(row, 'color')), description)
+    return base_period_div(start, end, parse_integer(_field(row, 'credit'), CREDIT_RANGE),
+                           parse_integer(_field(row, 'hue'), HUE_RANGE), description)
+
+
+# the date of an event div, or the (start, end) of a period div
+def div_key(div):
+    attrs = parse_div(div)
+    return (attrs['date'],) if 'date' in attrs else (attrs['start'], attrs['end'])
+
+
+# validates all rows in one pass: (divs, [(row number, reason), ...]). Of
+# several rows for the same date or period only the last one is imported, so
+# that what is counted is what the merge does; the others are rejected.
+def validate_rows(rows):
+    divs = {}
+    rejected = []
+    for number, row in enumerate(rows, start=1):
+        try:
+            div = row_to_div(row)
+        except ValueError as e:
+            rejected.append((number, str(e)))
+            continue
+        key = div_key(div)
+        if key in divs:
+            earlier, _ = divs.pop(key)
+            rejected.append((earlier, f'replaced by row {number}, which has the same {"date" if len(key) == 1 else "dates"}'))
+        divs[key] = number, div
+    rejected.sort()
+    return [div for _, div in divs.values()], rejected
+
+
+def export_rows(calendar):
+    for event in calendar.events:
+        yield {'type': 'event', 'date': event.date, 'credit': event.attrs.get('credit', ''),
+               'description': EVENT_SEPARATOR.join(event.descriptions)}
+    for period in calendar.periods:
+        row = {'type': 'base' if period.base else 'period', 'start': period.start, 'end': period.end,
+               'description': period.description}
+        if period.base:
+            row.update(credit=period.attrs.get('credit', ''), hue=period.attrs.get('hue', ''))
+        else:
+            row['color'] = period.attrs.get('color', '')
+        yield row
+
+
+def write_rows(rows, file_format):
+    buffer = io.StringIO()
+    if file_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    else:
+        # one row per line keeps large exports readable and diffable
+        buffer.write('[\n')
+        for index, row in enumerate(rows):
+            buffer.write((',\n' if index else '') + json.dumps(row))
+        buffer.write('\n]\n')
+    return buffer.getvalue().encode('utf-8')
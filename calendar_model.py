@@ -0,0 +1,514 @@
+# An indexed view of events.html, built once per parsed document.
+# Events are looked up through a hash index on the date ordinal, and the sorted
+# lists of event dates and period start dates give O(log n) insertion points
+# via bisect, instead of scanning every div and calling strptime on each one.
+#
+# The original text is kept as is. Every div remembers the span it came from,
+# and edits are written back by splicing only the changed spans into the
+# original string, so everything outside the edited divs stays byte-identical.
+
+import logging
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date
+from itertools import count
+
+from events_parser import MalformedCalendar, is_calendar_div, scan_divs
+
+DATE_FORMAT = '%m/%d/%Y'
+
+
+# 'mm/dd/yyyy' (leading zeros optional) -> proleptic Gregorian ordinal.
+# Much cheaper than datetime.strptime when indexing thousands of divs.
+def date_ordinal(value):
+    month, day, year = value.strip().split('/')
+    return date(int(year), int(month), int(day)).toordinal()
+
+
+# A pending edit, described by what it does rather than by the div it touches,
+# so it can be applied again on top of a newer copy of the file.
+#   add_event:     key = date,         html = new div (added even if the date has one)
+#   put_event:     key = date,         html = new div (replaces the date's div, or adds it)
+#   delete_event:  key = date
+#   put_period:    key = (start, end), html = new div
+#   delete_period: key = (start, end)
+#   merge:         key = None,         html = list of new divs, each put like above
+Mutation = namedtuple('Mutation', ['action', 'key', 'html'], defaults=[None])
+
+
+_line_break = re.compile(r'<br\s*/?>', re.IGNORECASE)
+_italic = re.compile(r'</?i\s*>', re.IGNORECASE)
+
+
+def tag_attrs(tag):
+    return {name: ' '.join(value) if isinstance(value, list) else value for name, value in tag.attrs.items()}
+
+
+# attributes of a single new div, e.g. one built by add_event or add_period
+def parse_div(html):
+    try:
+        for attrs, _, _ in scan_divs(html):
+            return attrs
+    except MalformedCalendar:
+        pass
+    from bs4 import BeautifulSoup
+    return tag_attrs(BeautifulSoup(html, 'html.parser').div)
+
+
+# a div of the calendar: its attributes, its current html, and where it came from.
+# `span` is its (start, end) in the original text; divs added since the file was
+# parsed have no span and an `anchor` instead: (offset, prefix, suffix).
+class Record:
+    def __init__(self, attrs, html, span=None):
+        self.attrs = attrs
+        self.html = html
+        self.span = span
+        self.anchor = None
+        self.seq = 0
+
+    def __str__(self):
+        return self.html
+
+    # the text between the opening and closing tags, on a single line
+    @property
+    def inner_text(self):
+        inner = self.html[self.html.index('>') + 1:self.html.rindex('<')]
+        return ' '.join(inner.split())
+
+
+# event format:
+# <div date="mm/dd/yyyy" credit="xx">event A <br> event B <br> event C</div>
+class Event(Record):
+    def __init__(self, attrs, html, span=None):
+        super().__init__(attrs, html, span)
+        self.date = attrs['date']
+        self.ordinal = date_ordinal(self.date)
+
+    @property
+    def credit(self):
+        return int(self.attrs['credit'])
+
+    @property
+    def descriptions(self):
+        return [part.strip() for part in _line_break.split(self.inner_text) if part.strip()]
+
+
+# period format:
+# <div start="mm/dd/yyyy" end="mm/dd/yyyy" color="#{color-hex}">Period Description</div>
+# <div class="base" credit="xx" start="mm/dd/yyyy" end="mm/dd/yyyy" hue="xxx"><i>Period Description</i></div>
+class Period(Record):
+    def __init__(self, attrs, html, span=None):
+        super().__init__(attrs, html, span)
+        self.start = attrs['start']
+        self.end = attrs['end']
+        self.start_ordinal = date_ordinal(self.start)
+        self.end_ordinal = date_ordinal(self.end)
+        self.ordinal = self.start_ordinal
+
+    @property
+    def key(self):
+        return self.start_ordinal, self.end_ordinal
+
+    @property
+    def base(self):
+        return 'base' in self.attrs.get('class', '').split()
+
+    @property
+    def description(self):
+        return _italic.sub('', self.inner_text).strip()
+
+
+def event_div(event_date, credit, events):
+    events_str = '<br> '.join(events)
+    return f'<div date="{event_date}" credit="{credit}">{events_str}</div>'
+
+
+def period_div(start_date, end_date, color, description):
+    return f'<div start="{start_date}" end="{end_date}" color="{color}">{description}</div>'
+
+
+def base_period_div(start_date, end_date, credit, hue, description):
+    return f'<div class="base" credit="{credit}" start="{start_date}" end="{end_date}" hue="{hue}"><i>{description}</i></div>'
+
+
+def make_record(attrs, html, span=None):
+    if 'date' in attrs and 'credit' in attrs:
+        return Event(attrs, html, span)
+    if 'start' in attrs and 'end' in attrs:
+        return Period(attrs, html, span)
+    return None
+
+
+class Calendar:
+    def __init__(self, source, records):
+        self.source = source
+        events = [record for record in records if isinstance(record, Event)]
+        periods = [record for record in records if isinstance(record, Period)]
+
+        # sorted() is stable, so divs sharing a date keep their document order
+        self._events = sorted(events, key=lambda event: event.ordinal)
+        self._event_ordinals = [event.ordinal for event in self._events]
+        self._periods = sorted(periods, key=lambda period: period.start_ordinal)
+        self._period_starts = [period.start_ordinal for period in self._periods]
+
+        # hash indexes; like find_all(...)[0], the first div wins on duplicates
+        self._events_by_date = {}
+        for event in events:
+            self._events_by_date.setdefault(event.ordinal, event)
+        self._periods_by_range = {}
+        for period in periods:
+            self._periods_by_range.setdefault(period.key, period)
+
+        # divs go after the last one in the file when there is nothing of their kind to sit next to
+        self._last = max(records, key=lambda record: record.span[1], default=None)
+
+        # records whose html has to be written, and spans of deleted divs
+        self._changed = {}
+        self._deleted = []
+        self._seq = count(1)
+        self._html = source
+        self._columns = None
+
+    @classmethod
+    def from_html(cls, text):
+        return cls(text, parse_records(text))
+
+    def to_html(self):
+        if self._html is None:
+            self._html = self._splice()
+        return self._html
+
+    # the text the commit queue writes back
+    def to_text(self):
+        return self.to_html()
+
+    @property
+    def events(self):
+        return self._events
+
+    @property
+    def periods(self):
+        return self._periods
+
+    # NumPy columns of the credits and periods for the analytics commands
+    # (analytics.py), built on first use and kept up to date by every edit after that
+    @property
+    def columns(self):
+        if self._columns is None:
+            from analytics import CalendarColumns
+            self._columns = CalendarColumns(self._events, self._periods)
+        return self._columns
+
+    def find_event(self, event_date):
+        return self._events_by_date.get(date_ordinal(event_date))
+
+    def find_period(self, start_date, end_date):
+        return self._periods_by_range.get((date_ordinal(start_date), date_ordinal(end_date)))
+
+    # whether a div for the same date, or the same period, is already there
+    def contains(self, html):
+        record = make_record(parse_div(html), html)
+        if isinstance(record, Event):
+            return record.ordinal in self._events_by_date
+        return isinstance(record, Period) and record.key in self._periods_by_range
+
+    # new events go after every event of the same or an earlier date
+    def insert_event(self, html):
+        event = Event(parse_div(html), html)
+        index = bisect_right(self._event_ordinals, event.ordinal)
+        self._place(event, self._events, index)
+        self._events.insert(index, event)
+        self._event_ordinals.insert(index, event.ordinal)
+        self._events_by_date.setdefault(event.ordinal, event)
+        if self._columns is not None:
+            self._columns.insert_event(index, event)
+        return event
+
+    def replace_event(self, event, html):
+        new_event = Event(parse_div(html), html)
+        if new_event.ordinal != event.ordinal:
+            self.delete_event(event)
+            return self.insert_event(html)
+        index = _position(self._events, self._event_ordinals, event.ordinal, event)
+        self._take_over(event, new_event)
+        self._events[index] = new_event
+        if self._events_by_date.get(event.ordinal) is event:
+            self._events_by_date[event.ordinal] = new_event
+        if self._columns is not None:
+            self._columns.replace_event(index, new_event)
+        return new_event
+
+    def delete_event(self, event):
+        index = _position(self._events, self._event_ordinals, event.ordinal, event)
+        del self._events[index]
+        del self._event_ordinals[index]
+        if self._columns is not None:
+            self._columns.delete_event(index)
+        self._remove(event)
+        if self._events_by_date.get(event.ordinal) is event:
+            del self._events_by_date[event.ordinal]
+            # another div may be left for the same date
+            index = bisect_left(self._event_ordinals, event.ordinal)
+            if index < len(self._event_ordinals) and self._event_ordinals[index] == event.ordinal:
+                self._events_by_date[event.ordinal] = self._events[index]
+
+    # the periods' start dates are in time order
+    def insert_period(self, html):
+        period = Period(parse_div(html), html)
+        index = bisect_right(self._period_starts, period.start_ordinal)
+        self._place(period, self._periods, index)
+        self._periods.insert(index, period)
+        self._period_starts.insert(index, period.start_ordinal)
+        self._periods_by_range.setdefault(period.key, period)
+        if self._columns is not None:
+            self._columns.insert_period(index, period)
+        return period
+
+    def replace_period(self, period, html):
+        new_period = Period(parse_div(html), html)
+        if new_period.key != period.key:
+            self.delete_period(period)
+            return self.insert_period(html)
+        index = _position(self._periods, self._period_starts, period.start_ordinal, period)
+        self._take_over(period, new_period)
+        self._periods[index] = new_period
+        if self._periods_by_range.get(period.key) is period:
+            self._periods_by_range[period.key] = new_period
+        if self._columns is not None:
+            self._columns.replace_period(index, new_period)
+        return new_period
+
+    def delete_period(self, period):
+        index = _position(self._periods, self._period_starts, period.start_ordinal, period)
+        del self._periods[index]
+        del self._period_starts[index]
+        if self._columns is not None:
+            self._columns.delete_period(index)
+        self._remove(period)
+        if self._periods_by_range.get(period.key) is period:
+            del self._periods_by_range[period.key]
+            index = bisect_left(self._period_starts, period.start_ordinal)
+            while index < len(self._period_starts) and self._period_starts[index] == period.start_ordinal:
+                if self._periods[index].key == period.key:
+                    self._periods_by_range[period.key] = self._periods[index]
+                    break
+                index += 1
+
+    def apply(self, mutation):
+        action, key, html = mutation
+        if action == 'add_event':
+            self.insert_event(html)
+        elif action == 'put_event':
+            event = self.find_event(key)
+            if event is None:
+                self.insert_event(html)
+            else:
+                self.replace_event(event, html)
+        elif action == 'delete_event':
+            event = self.find_event(key)
+            if event is not None:
+                self.delete_event(event)
+        elif action == 'put_period':
+            period = self.find_period(*key)
+            if period is None:
+                self.insert_period(html)
+            else:
+                self.replace_period(period, html)
+        elif action == 'delete_period':
+            period = self.find_period(*key)
+            if period is not None:
+                self.delete_period(period)
+        elif action == 'merge':
+            self.merge(html)
+        else:
+            raise ValueError(f'Unknown mutation: {action}')
+
+    # puts many divs at once, e.g. for an import: divs for existing dates and
+    # periods replace them, and the new ones are merged into the sorted lists in
+    # one pass instead of one list insertion each. Returns (inserted, replaced).
+    def merge(self, htmls):
+        new_events = {}
+        new_periods = {}
+        replaced = 0
+        for html in htmls:
+            record = make_record(parse_div(html), html)
+            if isinstance(record, Event):
+                existing = self._events_by_date.get(record.ordinal)
+                if existing is not None:
+                    self.replace_event(existing, html)
+                    replaced += 1
+                else:
+                    replaced += record.ordinal in new_events
+                    new_events[record.ordinal] = record
+            elif isinstance(record, Period):
+                existing = self._periods_by_range.get(record.key)
+                if existing is not None:
+                    self.replace_period(existing, html)
+                    replaced += 1
+                else:
+                    replaced += record.key in new_periods
+                    new_periods[record.key] = record
+            else:
+                raise ValueError(f'Not a calendar div: {html}')
+
+        # a bulk import rebuilds the columns on next use rather than inserting one by one
+        if new_events or new_periods:
+            self._columns = None
+        if new_events:
+            self._events = self._merge_sorted(self._events, sorted(new_events.values(), key=lambda event: event.ordinal))
+            self._event_ordinals = [event.ordinal for event in self._events]
+            for event in new_events.values():
+                self._events_by_date.setdefault(event.ordinal, event)
+        if new_periods:
+            self._periods = self._merge_sorted(self._periods, sorted(new_periods.values(), key=lambda period: period.key))
+            self._period_starts = [period.start_ordinal for period in self._periods]
+            for period in new_periods.values():
+                self._periods_by_range.setdefault(period.key, period)
+        return len(new_events) + len(new_periods), replaced
+
+    def _merge_sorted(self, records, new_records):
+        merged = []
+        index = 0
+        for record in new_records:
+            while index < len(records) and records[index].ordinal <= record.ordinal:
+                merged.append(records[index])
+                index += 1
+            following = records[index] if index < len(records) else None
+            self._place_between(record, following, merged[-1] if merged else None)
+            merged.append(record)
+        merged.extend(records[index:])
+        return merged
+
+    ###### splicing ######
+    # a new div is written next to its neighbour in date order: before the next
+    # one, or after the previous one when it is the latest. If that neighbour is
+    # new as well, it shares the neighbour's anchor and is ordered by date there.
+    def _place(self, record, records, index):
+        following = records[index] if index < len(records) else None
+        self._place_between(record, following, records[-1] if records else None)
+
+    def _place_between(self, record, following, preceding):
+        record.seq = next(self._seq)
+        if following is not None:
+            neighbour, before = following, True
+        elif preceding is not None:
+            neighbour, before = preceding, False
+        else:
+            neighbour, before = self._last, False
+
+        if neighbour is None:
+            prefix = '' if not self.source or self.source.endswith('\n') else '\n'
+            record.anchor = (len(self.source), prefix, '\n')
+        elif neighbour.anchor is not None:
+            record.anchor = neighbour.anchor
+        else:
+            start, end, indent = self._line(neighbour)
+            if indent is None:
+                # the neighbour shares its line with other markup: write inline
+                record.anchor = (start, '', '') if before else (end, '', '')
+            else:
+                record.anchor = (start if before else end, indent, '\n')
+        self._changed[id(record)] = record
+        self._html = None
+
+    def _take_over(self, old, new):
+        new.span, new.anchor, new.seq = old.span, old.anchor, old.seq
+        self._changed.pop(id(old), None)
+        self._changed[id(new)] = new
+        self._html = None
+
+    def _remove(self, record):
+        self._changed.pop(id(record), None)
+        if record.span is not None:
+            start, end, _ = self._line(record)
+            self._deleted.append((start, end))
+        self._html = None
+
+    # the whole line of a div that sits alone on it (with the indentation in front
+    # and the line break after it), so divs are added and removed as full lines
+    def _line(self, record):
+        start, end = record.span
+        line_start = self.source.rfind('\n', 0, start) + 1
+        line_end = self.source.find('\n', end)
+        line_end = len(self.source) if line_end < 0 else line_end + 1
+        indent = self.source[line_start:start]
+        if indent.strip() or self.source[end:line_end].strip():
+            return start, end, None
+        return line_start, line_end, indent
+
+    def _splice(self):
+        edits = [(start, 1, 0, 0, end, '') for start, end in self._deleted]
+        for record in self._changed.values():
+            if record.anchor is None:
+                start, end = record.span
+                edits.append((start, 1, 0, 0, end, record.html))
+            else:
+                offset, prefix, suffix = record.anchor
+                edits.append((offset, 0, record.ordinal, record.seq, offset, prefix + record.html + suffix))
+        edits.sort(key=lambda edit: edit[:4])
+
+        pieces = []
+        cursor = 0
+        for start, _, _, _, end, text in edits:
+            if start > cursor:
+                pieces.append(self.source[cursor:start])
+            pieces.append(text)
+            cursor = max(cursor, end)
+        pieces.append(self.source[cursor:])
+        return ''.join(pieces)
+
+
+# index of record in a list sorted by ordinals, without a linear scan
+def _position(records, ordinals, ordinal, record):
+    index = bisect_left(ordinals, ordinal)
+    while records[index] is not record:
+        index += 1
+    return index
+
+
+_div_close = re.compile(r'</div\s*>', re.IGNORECASE)
+
+
+# calendar records straight from the text with the dedicated scanner, or from
+# BeautifulSoup when the file does not follow the expected grammar
+def parse_records(text):
+    try:
+        divs = list(scan_divs(text))
+    except MalformedCalendar as e:
+        logging.info(f"falling back to BeautifulSoup: {e}")
+        divs = soup_divs(text)
+    records = (readable_record(attrs, text, start, end) for attrs, start, end in divs)
+    return [record for record in records if record is not None]
+
+
+# a div whose dates cannot be read (a hand edit like date="1/5") is left in the
+# text as it is but not indexed, instead of making the whole calendar unusable
+def readable_record(attrs, text, start, end):
+    try:
+        return make_record(attrs, text[start:end], (start, end))
+    except ValueError:
+        logging.info(f"skipping the div with unreadable dates at offset {start}: {text[start:end][:80]}")
+        return None
+
+
+# (attrs, start, end) of the calendar divs as BeautifulSoup's html.parser sees
+# them, with source spans rebuilt from the line/column it records for every
+# start tag. Calendar divs never contain other divs, so a div ends at the next </div>.
+def soup_divs(text):
+    from bs4 import BeautifulSoup
+
+    line_starts = [0] + [match.end() for match in re.finditer('\n', text)]
+    for tag in BeautifulSoup(text, 'html.parser').find_all('div'):
+        attrs = tag_attrs(tag)
+        if not is_calendar_div(attrs):
+            continue
+        start = line_starts[tag.sourceline - 1] + tag.sourcepos
+        close = _div_close.search(text, start)
+        yield attrs, start, close.end() if close else len(text)
+
+
+# calendar records from BeautifulSoup's html.parser
+def soup_records(text):
+    for attrs, start, end in soup_divs(text):
+        yield make_record(attrs, text[start:end], (start, end))
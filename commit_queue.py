@@ -0,0 +1,151 @@
+# Coalesces confirmed edits into as few commits as possible.
+# Mutations submitted within `window` seconds of each other are applied to the
+# latest copy of their files and pushed as a single commit. If the branch moved
+# in the meantime the push is not a fast forward: the files are fetched again,
+# the same mutations are replayed on top, and the commit is retried.
+#
+# Edits submitted with a `uid` (journal entries) name it in the commit's
+# trailer. An edit that may have been pushed before (a push whose response was
+# lost, or one from before a restart) comes with `since`, the time it was
+# confirmed: the commits made since then are searched for its uid, and if one
+# has it the edit landed and is not applied again, even with other commits on top.
+
+import asyncio
+import logging
+
+from metrics import metrics
+from storage import CommitConflict, blob_sha
+
+# phases of a batch are recorded under this name, whichever commands it holds
+COMMAND = 'commit_queue'
+# trailer line naming a journal entry in a commit message
+TRAILER = 'Journal-Entry: '
+
+
+class PendingEdit:
+    def __init__(self, path, mutations, message, future, uid=None, since=None):
+        self.path = path
+        self.mutations = mutations
+        self.message = message
+        self.future = future
+        self.uid = uid
+        self.since = since
+
+
+class CommitQueue:
+    def __init__(self, storage, documents, window=1.0, max_attempts=5):
+        self.storage = storage
+        self.documents = documents
+        self.window = window
+        self.max_attempts = max_attempts
+        self.commits = 0
+        self.conflicts = 0
+        self._pending = []
+        self._flusher = None
+
+    # resolves with the sha of the commit that contains the mutations
+    async def submit(self, path, mutations, message):
+        return await self.submit_many({path: mutations}, message)
+
+    # mutations of several files ({path: mutations}) that must land in the same commit
+    async def submit_many(self, edits, message, uid=None, since=None):
+        future = asyncio.get_running_loop().create_future()
+        for path, mutations in edits.items():
+            self._pending.append(PendingEdit(path, list(mutations), message, future, uid, since))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                sha = await self._commit(batch)
+            except Exception as e:
+                for edit in batch:
+                    self.documents.invalidate(edit.path)
+                    if not edit.future.done():
+                        edit.future.set_exception(e)
+            else:
+                for edit in batch:
+                    if not edit.future.done():
+                        edit.future.set_result(sha)
+
+    async def _commit(self, batch):
+        for attempt in range(1, self.max_attempts + 1):
+            with metrics.timer('head', COMMAND):
+                head = await self.storage.get_head()
+            landed = await self._landed(head, batch)
+            if landed:
+                done = [edit for edit in batch if edit.uid in landed]
+                for edit in done:
+                    if not edit.future.done():
+                        edit.future.set_result(None)
+                batch = [edit for edit in batch if edit.uid not in landed]
+                if done:
+                    metrics.inc('replayed_edits_skipped', len(done))
+                    logging.info(f"{len(done)} edit(s) were already committed, skipping them")
+                if not batch:
+                    return None
+            paths = list(dict.fromkeys(edit.path for edit in batch))
+            message = commit_message([edit.message for edit in batch], [edit.uid for edit in batch])
+            files = {}
+            documents = {}
+            for path in paths:
+                document = await self.documents.get(path)
+                with metrics.timer('mutate', COMMAND):
+                    for edit in batch:
+                        if edit.path == path:
+                            for mutation in edit.mutations:
+                                document.parsed.apply(mutation)
+                documents[path] = document
+                with metrics.timer('serialize', COMMAND):
+                    files[path] = document.parsed.to_text()
+
+            try:
+                with metrics.timer('upload', COMMAND):
+                    sha = await self.storage.commit_files(head, files, message)
+            except CommitConflict:
+                # the cached trees already carry our mutations: drop them and rebase
+                self.conflicts += 1
+                metrics.inc('commit_conflicts')
+                for path in paths:
+                    self.documents.invalidate(path)
+                logging.info(f"commit conflict on {', '.join(paths)}, retrying ({attempt}/{self.max_attempts})")
+                continue
+
+            self.commits += 1
+            metrics.inc('commits')
+            metrics.inc('committed_edits', len(batch))
+            for path, text in files.items():
+                self.documents.store(path, text, documents[path].parsed, blob_sha(text.encode('utf-8')))
+            logging.info(f"committed {len(batch)} edit(s) as {sha}")
+            return sha
+
+        raise CommitConflict(f"gave up after {self.max_attempts} conflicting attempts")
+
+    # uids of the edits in `batch` that are already in a commit up to `head`
+    async def _landed(self, head, batch):
+        since = min((edit.since for edit in batch if edit.uid and edit.since is not None), default=None)
+        if since is None:
+            return set()
+        with metrics.timer('history', COMMAND):
+            messages = await self.storage.commit_messages(head, since)
+        return {uid for message in messages for uid in trailer_uids(message)}
+
+
+def commit_message(messages, uids=()):
+    messages = list(dict.fromkeys(messages))
+    if len(messages) == 1:
+        message = messages[0]
+    else:
+        message = f'[Calendar Bot]: {len(messages)} updates\n\n' + '\n'.join(messages)
+    uids = [uid for uid in dict.fromkeys(uids) if uid]
+    if uids:
+        message += '\n\n' + '\n'.join(TRAILER + uid for uid in uids)
+    return message
+
+
+def trailer_uids(message):
+    return {line[len(TRAILER):].strip() for line in (message or '').splitlines() if line.startswith(TRAILER)}
@@ -0,0 +1,84 @@
+# Routes the answers of interactive commands to the command that asked for them.
+# Every running command owns a session keyed by (channel, author); incoming
+# messages are handed to the matching session with one dict lookup, so users
+# talking to the bot at the same time never see each other's answers, and a
+# session that gets no answer in time is closed instead of waiting forever.
+
+import asyncio
+
+from metrics import metrics
+
+
+class SessionTimeout(asyncio.TimeoutError):
+    pass
+
+
+# the user started another command in the same channel
+class SessionReplaced(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, key):
+        self.key = key
+        self.messages = asyncio.Queue()
+        self.closed = None  # exception raised to the waiting command once closed
+
+
+class ConversationRouter:
+    def __init__(self, timeout=300.0):
+        self.timeout = timeout
+        self._sessions = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def key(message_or_ctx):
+        return message_or_ctx.channel.id, message_or_ctx.author.id
+
+    def open(self, ctx):
+        key = self.key(ctx)
+        previous = self._sessions.get(key)
+        if previous is not None:
+            self._close(previous, SessionReplaced())
+        session = self._sessions[key] = Session(key)
+        # the command keeps its own session even after a newer one takes the key
+        ctx.session = session
+        return session
+
+    def close(self, ctx):
+        session = getattr(ctx, 'session', None)
+        if session is not None:
+            self._close(session, None)
+
+    def _close(self, session, reason):
+        if self._sessions.get(session.key) is session:
+            del self._sessions[session.key]
+        session.closed = reason
+        if reason is not None:
+            session.messages.put_nowait(None)  # wake the waiting command up
+
+    # returns True when the message was an answer to a running command
+    def dispatch(self, message):
+        session = self._sessions.get(self.key(message))
+        if session is None:
+            return False
+        session.messages.put_nowait(message)
+        return True
+
+    async def wait_for_message(self, ctx, timeout=None):
+        session = getattr(ctx, 'session', None)
+        if session is None:
+            session = self.open(ctx)
+        if session.closed is not None:
+            raise session.closed
+        try:
+            with metrics.timer('user_wait'):
+                message = await asyncio.wait_for(session.messages.get(), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._close(session, SessionTimeout())
+            raise session.closed from None
+        if message is None:
+            raise session.closed
+        return message
@@ -0,0 +1,65 @@
+# A small scanner for the div grammar of events.html:
+#   <div date credit>, <div start end color> and <div class="base" credit start end hue>
+# It finds the calendar divs, their attributes and their (start, end) offsets in
+# a single pass over the text without building a DOM. Anything it does not
+# understand raises MalformedCalendar, and the caller falls back to BeautifulSoup.
+
+import re
+from html import unescape
+
+# one alternative per thing we care about: a comment, a well-formed start tag,
+# an end tag, and any other "<div" or "</div", which we cannot read
+_markup = re.compile(
+    r'<!--.*?-->'
+    r'|<div((?:\s+[^\s"\'>/=]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'=<>`]+))?)*)\s*(/?)>'
+    r'|(</div\s*>)'
+    r'|(</?div\b)',
+    re.IGNORECASE | re.DOTALL)
+_attribute = re.compile(r'([^\s"\'>/=]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'=<>`]+)))?')
+
+
+class MalformedCalendar(ValueError):
+    pass
+
+
+def is_calendar_div(attrs):
+    return ('date' in attrs and 'credit' in attrs) or ('start' in attrs and 'end' in attrs)
+
+
+def parse_attributes(text):
+    attrs = {}
+    for match in _attribute.finditer(text):
+        name, double, single, bare = match.groups()
+        value = double if double is not None else single if single is not None else bare
+        if value is None:
+            value = ''
+        elif '&' in value:
+            value = unescape(value)
+        attrs[name.lower()] = value
+    return attrs
+
+
+# yields (attrs, start, end) for every calendar div, in document order
+def scan_divs(text):
+    inside = None  # (attrs, start) of the calendar div we are in
+    for match in _markup.finditer(text):
+        attributes, self_closing, end_tag, unreadable = match.groups()
+        if unreadable is not None:
+            raise MalformedCalendar(f'unreadable div tag at offset {match.start()}')
+        if end_tag is not None:
+            if inside is not None:
+                attrs, start = inside
+                inside = None
+                yield attrs, start, match.end()
+        elif attributes is not None:
+            if inside is not None:
+                # calendar divs never contain other divs
+                raise MalformedCalendar(f'nested <div> at offset {match.start()}')
+            attrs = parse_attributes(attributes)
+            if is_calendar_div(attrs):
+                if self_closing:
+                    raise MalformedCalendar(f'self-closing <div/> at offset {match.start()}')
+                inside = (attrs, match.start())
+
+    if inside is not None:
+        raise MalformedCalendar(f'unclosed <div> at offset {inside[1]}')
@@ -0,0 +1,190 @@
+# A local write-ahead journal for confirmed edits. A command's mutations are
+# written to SQLite before the user is told they succeeded; a background
+# replayer then pushes them to GitHub through the commit queue, retrying with
+# exponential backoff while GitHub is slow or down. Entries are only removed
+# once their commit landed, so edits survive outages and restarts.
+#
+# A commit can land without us hearing about it (the response to the push is
+# lost, or the bot dies before removing the entry), so an entry may be pushed
+# twice. Every entry carries a random `uid` that goes into the trailer of the
+# commit holding it. An entry that may have been pushed (it failed before, or
+# was written by an earlier process) is replayed with its `created` time, and
+# the commit queue skips it if a commit made since then names its uid. That
+# makes replaying an entry safe even for add_event, and even when other
+# commits landed on top of it.
+
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from calendar_model import Mutation
+from metrics import metrics
+
+
+# mutations are stored as JSON lists; period keys come back as tuples
+def encode_edits(edits):
+    return json.dumps({path: [list(mutation) for mutation in mutations] for path, mutations in edits.items()})
+
+
+def decode_edits(text):
+    return {path: [Mutation(action, tuple(key) if isinstance(key, list) else key, html)
+                   for action, key, html in mutations]
+            for path, mutations in json.loads(text).items()}
+
+
+class JournalEntry:
+    def __init__(self, id, uid, created, message, edits, attempts=0, error=None, maybe_pushed=False):
+        self.id = id
+        self.uid = uid
+        self.created = created
+        self.message = message
+        self.edits = edits
+        self.attempts = attempts
+        self.error = error
+        # whether a commit holding this entry may have landed without us knowing
+        self.maybe_pushed = maybe_pushed
+
+
+# `executor` and `labels` let many journals share one worker thread and tell
+# their metrics apart (see tenants.py)
+class Journal:
+    def __init__(self, path, executor=None, **labels):
+        self.path = path
+        self.labels = labels
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS edits (id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL, '
+                         'message TEXT, edits TEXT, attempts INTEGER DEFAULT 0, error TEXT, uid TEXT)')
+        # journals written before entries had a uid get one now
+        if 'uid' not in [row[1] for row in self._db.execute('PRAGMA table_info(edits)')]:
+            self._db.execute('ALTER TABLE edits ADD COLUMN uid TEXT')
+        for (entry_id,) in self._db.execute('SELECT id FROM edits WHERE uid IS NULL').fetchall():
+            self._db.execute('UPDATE edits SET uid = ? WHERE id = ?', (uuid.uuid4().hex, entry_id))
+        # sqlite3 blocks on fsync: writes go to one worker thread, like GitHubStorage
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+        # everything not yet on GitHub, in the order it was confirmed
+        self.entries = {}
+        for row in self._db.execute('SELECT id, uid, created, message, edits, attempts, error FROM edits ORDER BY id'):
+            entry_id, uid, created, message, edits, attempts, error = row
+            # the process that wrote it may have pushed it just before it stopped
+            self.entries[entry_id] = JournalEntry(entry_id, uid, created, message, decode_edits(edits), attempts, error,
+                                                  maybe_pushed=True)
+        metrics.set('journal_pending', len(self.entries), **self.labels)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown()
+        self._db.close()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    # durable once this returns
+    async def append(self, edits, message):
+        created = time.time()
+        uid = uuid.uuid4().hex
+        entry_id = await self._run(self._insert, uid, created, message, encode_edits(edits))
+        entry = self.entries[entry_id] = JournalEntry(entry_id, uid, created, message, edits)
+        metrics.set('journal_pending', len(self.entries), **self.labels)
+        return entry
+
+    def _insert(self, uid, created, message, edits):
+        return self._db.execute('INSERT INTO edits (uid, created, message, edits) VALUES (?, ?, ?, ?)',
+                                (uid, created, message, edits)).lastrowid
+
+    async def remove(self, ids):
+        await self._run(self._delete, list(ids))
+        for entry_id in ids:
+            self.entries.pop(entry_id, None)
+        metrics.set('journal_pending', len(self.entries), **self.labels)
+
+    def _delete(self, ids):
+        self._db.executemany('DELETE FROM edits WHERE id = ?', [(entry_id,) for entry_id in ids])
+
+    async def record_failure(self, ids, error):
+        await self._run(self._fail, list(ids), error)
+        for entry_id in ids:
+            entry = self.entries.get(entry_id)
+            if entry is not None:
+                entry.attempts += 1
+                entry.error = error
+                entry.maybe_pushed = True
+
+    def _fail(self, ids, error):
+        self._db.executemany('UPDATE edits SET attempts = attempts + 1, error = ? WHERE id = ?',
+                             [(error, entry_id) for entry_id in ids])
+
+    # (entry id, mutations) of the unsynced entries that touch one file, oldest first
+    def pending(self, path):
+        return [(entry.id, entry.edits[path]) for entry in self.entries.values() if path in entry.edits]
+
+
+class JournalReplayer:
+    def __init__(self, journal, commits, min_delay=1.0, max_delay=300.0):
+        self.journal = journal
+        self.commits = commits
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._task = None
+        self._wake = None
+        self._idle = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def notify(self):
+        if self._wake is not None:
+            self._idle.clear()
+            self._wake.set()
+
+    # returns once every journal entry has been pushed
+    async def drain(self):
+        while self.journal.entries:
+            self.notify()
+            await self._idle.wait()
+
+    async def _run(self):
+        delay = self.min_delay
+        while True:
+            entries = list(self.journal.entries.values())
+            if not entries:
+                self._idle.set()
+                await self._wake.wait()
+                self._wake.clear()
+                continue
+
+            started = time.perf_counter()
+            # submitted together, so the commit queue coalesces them in order
+            results = await asyncio.gather(*(self.commits.submit_many(entry.edits, entry.message, entry.uid,
+                                                                      entry.created if entry.maybe_pushed else None)
+                                             for entry in entries), return_exceptions=True)
+            done = [entry.id for entry, result in zip(entries, results) if not isinstance(result, BaseException)]
+            failed = [(entry.id, result) for entry, result in zip(entries, results) if isinstance(result, BaseException)]
+            if done:
+                await self.journal.remove(done)
+                metrics.observe('phase_seconds', time.perf_counter() - started, phase='replay', command='journal')
+            if not failed:
+                delay = self.min_delay
+                continue
+
+            error = failed[0][1]
+            await self.journal.record_failure([entry_id for entry_id, _ in failed], f'{type(error).__name__}: {error}')
+            metrics.inc('journal_replay_failures')
+            wait = delay * random.uniform(0.5, 1.5)
+            logging.info(f"could not sync {len(failed)} edit(s) to GitHub ({error}), retrying in {wait:.0f}s")
+            delay = min(delay * 2, self.max_delay)
+            # a new edit does not cut the backoff short
+            await asyncio.sleep(wait)
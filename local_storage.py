@@ -0,0 +1,181 @@
+# Storage backends on the local disk.
+#
+# FileSystemStorage keeps the calendar files in a plain directory: nothing is
+# versioned and nothing leaves the machine, which is what tests and offline
+# runs want. LocalGitStorage works on a clone of the website repository:
+# reads come straight from the working copy, every commit is a local git
+# commit, and a background task pulls and pushes so that the website catches up.
+# A stat() call replaces the REST round trip that GitHubStorage needs to
+# revalidate a cached file.
+
+import asyncio
+import logging
+import os
+import random
+
+from metrics import metrics
+from storage import CLOCK_SKEW, CommitConflict, Storage, StoredFile, blob_sha
+
+
+class FileSystemStorage(Storage):
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self._revision = 0
+
+    def _path(self, path):
+        return os.path.join(self.directory, *path.split('/'))
+
+    # files are rewritten, never modified in place, so a change always shows
+    # in the modification time, the size or the inode
+    @staticmethod
+    def _handle(stat):
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    async def read(self, path):
+        with open(self._path(path), 'rb') as f:
+            data = f.read()
+            handle = self._handle(os.fstat(f.fileno()))
+        return StoredFile(data, blob_sha(data), handle)
+
+    async def read_if_changed(self, path, handle):
+        try:
+            if self._handle(os.stat(self._path(path))) == handle:
+                return None
+        except FileNotFoundError:
+            pass
+        return await self.read(path)
+
+    async def get_head(self):
+        return self._revision
+
+    async def commit_files(self, head, files, message):
+        if head != self._revision:
+            raise CommitConflict(f'revision {head} is behind {self._revision}')
+        self._write(files)
+        self._revision += 1
+        return str(self._revision)
+
+    # each file is written next to its target and renamed over it, so a reader
+    # never sees half a file
+    def _write(self, files):
+        for path, text in files.items():
+            target = self._path(path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temporary = f'{target}.tmp'
+            with open(temporary, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+            os.replace(temporary, target)
+
+
+class GitError(Exception):
+    pass
+
+
+class LocalGitStorage(FileSystemStorage):
+    def __init__(self, directory, branch='master', remote='origin', sync_interval=60.0,
+                 min_delay=5.0, max_delay=600.0):
+        super().__init__(directory)
+        self.branch = branch
+        self.remote = remote
+        self.sync_interval = sync_interval
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._lock = None
+        self._dirty = None
+        self._syncer = None
+
+    async def git(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            'git', '-C', self.directory, *args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        metrics.inc('git_commands', command=args[0])
+        if process.returncode != 0:
+            raise GitError(f'git {" ".join(args)}: {stderr.decode(errors="replace").strip()}')
+        return stdout.decode().strip()
+
+    # the working copy is shared with the background pull: one git operation at a time
+    def _start(self):
+        if self._syncer is None or self._syncer.done():
+            self._lock = asyncio.Lock()
+            self._dirty = asyncio.Event()
+            self._syncer = asyncio.create_task(self._sync_forever())
+
+    async def get_head(self):
+        self._start()
+        return await self.git('rev-parse', 'HEAD')
+
+    async def commit_messages(self, head, since):
+        log = await self.git('log', f'--since=@{int(since) - CLOCK_SKEW}', '--format=%B%x00', head)
+        return [message.strip() for message in log.split('\0') if message.strip()]
+
+    async def commit_files(self, head, files, message):
+        self._start()
+        async with self._lock:
+            current = await self.git('rev-parse', 'HEAD')
+            if current != head:
+                raise CommitConflict(f'HEAD moved from {head} to {current}')
+            self._write(files)
+            await self.git('add', '--', *files)
+            # an edit that leaves the files as they were (the same text put
+            # again) has nothing to commit: it is already at HEAD
+            try:
+                await self.git('diff', '--cached', '--quiet')
+            except GitError:
+                await self.git('commit', '--quiet', '-m', message)
+            else:
+                return current
+            sha = await self.git('rev-parse', 'HEAD')
+        self._dirty.set()
+        return sha
+
+    # stops the background sync; commits not pushed yet are pushed by the next
+    # run. Waits for a git command in flight, so that no pull or rebase is cut short.
+    async def close(self):
+        if self._syncer is None:
+            return
+        async with self._lock:
+            self._syncer.cancel()
+            try:
+                await self._syncer
+            except asyncio.CancelledError:
+                pass
+        self._syncer = None
+
+    # pulls (rebasing our commits on top) and pushes right after a commit, and
+    # every `sync_interval` seconds otherwise; failures are retried with backoff
+    async def _sync_forever(self):
+        delay = self.min_delay
+        while True:
+            try:
+                await asyncio.wait_for(self._dirty.wait(), self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._dirty.clear()
+            try:
+                await self.sync()
+            except GitError as e:
+                metrics.inc('git_sync_failures')
+                wait = delay * random.uniform(0.5, 1.5)
+                logging.info(f"could not sync {self.directory} with {self.remote}: {e}; retrying in {wait:.0f}s")
+                delay = min(delay * 2, self.max_delay)
+                await asyncio.sleep(wait)
+                self._dirty.set()
+            else:
+                delay = self.min_delay
+
+    async def sync(self):
+        async with self._lock:
+            try:
+                await self.git('pull', '--rebase', '--quiet', self.remote, self.branch)
+            except GitError:
+                # leave the working copy as it was rather than half rebased
+                try:
+                    await self.git('rebase', '--abort')
+                except GitError:
+                    pass
+                raise
+            # counted rather than remembered, so commits left over from a previous run get pushed too
+            unpushed = int(await self.git('rev-list', '--count', f'{self.remote}/{self.branch}..HEAD'))
+            if unpushed:
+                await self.git('push', '--quiet', self.remote, f'HEAD:{self.branch}')
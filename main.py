@@ -1,77 +1,189 @@
 # A simple discord bot that can be used to update my website: https://huangweiran.club/LifeCalendar/
 # It can be used to add/revise/delete life events/periods.
 
+import csv
+import io
 import os
+import time
+import asyncio
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
-from github import Github
-from datetime import datetime
-from bs4 import BeautifulSoup
+from storage import CommitConflict
+from calendar_model import Mutation, base_period_div, event_div, period_div
+from tenants import DEFAULT, TenantRegistry, load_tenants, make_config
+from calendar_io import export_rows, format_of, read_rows, validate_rows, write_rows
+from validation import CREDIT_RANGE, HUE_RANGE, parse_color, parse_date, parse_integer
+from arguments import complete, complete_period, parse_date_arguments, parse_event_arguments, parse_period_arguments
+from conversation import ConversationRouter, SessionReplaced, SessionTimeout
+from metrics import current_command, metrics
+from outbox import Outbox
+from supervisor import Supervisor
+from shards import GRANULARITIES, LEGACY_PATH, MANIFEST_PATH, Manifest, divs_by_path, shard_edits, split_calendar
+from datetime import date, datetime
 import logging
-import pytz
-import re
-from os import system
 
 logging.basicConfig(level=logging.INFO)
 
 load_dotenv()
-github_token = os.getenv('GITHUB_TOKEN')
-repo_name = os.getenv('GITHUB_REPO_NAME')
-
-if github_token is None:
-    print("Github token not found")
-    exit(1)
-
-if repo_name is None:
-    print("Github repo name not found")
-    exit(1)
+# where the calendar files live: github (the default), git (a local clone that
+# is pushed in the background) or filesystem (a plain directory, e.g. for tests)
+storage_backend = os.getenv('CALENDAR_STORAGE', 'github')
+branch = os.getenv('CALENDAR_BRANCH', 'master')
+# guilds and users with calendars of their own (see tenants.py); the calendar
+# configured below serves everybody else, and is optional when there is a tenants file
+tenants_file = os.getenv('TENANTS_FILE')
+tenant_configs = {}
+
+if tenants_file is None or os.getenv('GITHUB_REPO_NAME') or os.getenv('CALENDAR_DIRECTORY'):
+    if storage_backend == 'github':
+        github_token = os.getenv('GITHUB_TOKEN')
+        repo_name = os.getenv('GITHUB_REPO_NAME')
+
+        if github_token is None:
+            print("Github token not found")
+            exit(1)
+
+        if repo_name is None:
+            print("Github repo name not found")
+            exit(1)
+    elif storage_backend in ('git', 'filesystem'):
+        if os.getenv('CALENDAR_DIRECTORY') is None:
+            print("Calendar directory not found")
+            exit(1)
+    else:
+        print(f"Unknown storage backend: {storage_backend}")
+        exit(1)
+    try:
+        tenant_configs[DEFAULT] = make_config(DEFAULT, {
+            'storage': storage_backend, 'repo': os.getenv('GITHUB_REPO_NAME'), 'branch': branch,
+            'path': os.getenv('CALENDAR_PATH', LEGACY_PATH), 'directory': os.getenv('CALENDAR_DIRECTORY'),
+            'timezone': os.getenv('CALENDAR_TIMEZONE', 'US/Central'),
+            'journal': os.getenv('JOURNAL_PATH', 'journal.sqlite3')})
+    except ValueError as e:
+        print(e)
+        exit(1)
+
+if tenants_file is not None:
+    try:
+        tenant_configs.update(load_tenants(tenants_file))
+    except (OSError, ValueError) as e:
+        print(f"Could not load {tenants_file}: {e}")
+        exit(1)
 
-g = Github(github_token)
-repo = g.get_repo(repo_name)
+tenants = TenantRegistry(tenant_configs, journal_directory=os.getenv('JOURNAL_DIRECTORY', 'journals'),
+                         budget=int(float(os.getenv('CACHE_BUDGET_MB', '64')) * 2 ** 20),
+                         commit_window=float(os.getenv('COMMIT_WINDOW_SECONDS', '1.0')))
 
 intents = discord.Intents.all()
 intents.members = True
 intents.messages = True
 intents.reactions = True
-client = commands.Bot(command_prefix='!', intents=intents)
+# replies are merged, split and paced per channel by the outbox
+outbox = Outbox(window=float(os.getenv('OUTBOX_WINDOW_SECONDS', '0.02')))
+
+
+class CalendarContext(commands.Context):
+    async def send(self, content=None, **kwargs):
+        await outbox.send(self.channel.id, super().send, content, **kwargs)
+
+
+class CalendarBot(commands.Bot):
+    async def get_context(self, origin, *, cls=CalendarContext):
+        return await super().get_context(origin, cls=cls)
+
+
+client = CalendarBot(command_prefix='!', intents=intents)
+# every command gets its own session; answers are routed by (channel, author)
+conversations = ConversationRouter(timeout=float(os.getenv('SESSION_TIMEOUT_SECONDS', '300')))
+# reconnects after Discord errors without restarting the process (see supervisor.py)
+supervisor = Supervisor(client, os.getenv('DISCORD_TOKEN'),
+                        max_delay=float(os.getenv('RECONNECT_MAX_SECONDS', '300')))
+
+
+# edits left over from the last run are pushed in the background, so they do
+# not hold up the connection; metrics are written to METRICS_FILE every 30
+# seconds and/or served on METRICS_PORT. This runs on every login, and the
+# supervisor logs in again after a failed reconnect: everything starts only once.
+@client.event
+async def setup_hook():
+    # keep references, the loop only holds tasks weakly
+    if getattr(client, 'resume_task', None) is None:
+        client.resume_task = asyncio.create_task(tenants.resume())
+    if os.getenv('METRICS_FILE') and getattr(client, 'metrics_writer', None) is None:
+        client.metrics_writer = asyncio.create_task(metrics.write_periodically(os.getenv('METRICS_FILE')))
+    if os.getenv('METRICS_PORT') and getattr(client, 'metrics_server', None) is None:
+        client.metrics_server = await metrics.serve(int(os.getenv('METRICS_PORT')))
+
+
+# raised before a command runs when neither the guild nor the user has a calendar
+class NoCalendar(commands.CommandError):
+    pass
+
+
+@client.before_invoke
+async def open_session(ctx):
+    # the calendar this command works on; !help works without one
+    ctx.tenant = await tenants.get(ctx.guild.id if ctx.guild else None, ctx.author.id)
+    if ctx.tenant is None and ctx.command.name != 'help':
+        raise NoCalendar()
+    conversations.open(ctx)
+    # phases recorded while the command runs are attributed to it
+    current_command.set(ctx.command.name)
+    ctx.started = time.perf_counter()
+
+
+@client.after_invoke
+async def close_session(ctx):
+    conversations.close(ctx)
+    tenants.trim()
+    metrics.inc('commands', command=ctx.command.name)
+    metrics.observe('phase_seconds', time.perf_counter() - ctx.started, phase='total', command=ctx.command.name)
+
+
+@client.listen('on_message')
+async def route_answer(message):
+    if message.author == client.user:
+        return
+    # a new command is not an answer: it replaces the session in before_invoke
+    if message.content.startswith(client.command_prefix):
+        name = message.content[len(client.command_prefix):].split(maxsplit=1)
+        if name and client.get_command(name[0]) is not None:
+            return
+    conversations.dispatch(message)
+
 
 ###### utils: get verified values  ######
 async def wait_for_date(ctx):
     while True:
-        response = await client.wait_for('message')
+        response = await conversations.wait_for_message(ctx)
         try:
-            datetime.strptime(response.content, '%m/%d/%Y')
+            parse_date(response.content)
             break
-        except ValueError:
-            await ctx.send('Please enter a valid date in the format mm/dd/yyyy.')
+        except ValueError as e:
+            await ctx.send(str(e))
 
     return response
 
 async def wait_for_color(ctx):
-    regex = re.compile(r"^#(?:[0-9a-fA-F]{3}){1,2}$")
     while True:
-        response = await client.wait_for('message')
-        if regex.match(response.content):
+        response = await conversations.wait_for_message(ctx)
+        try:
+            parse_color(response.content)
             break
-        await ctx.send('Please enter a valid color in the format #xxxxxx.')
+        except ValueError as e:
+            await ctx.send(str(e))
 
     return response
 
 async def wait_for_integer(ctx, range = None):
     while True:
-        response = await client.wait_for('message')
+        response = await conversations.wait_for_message(ctx)
         try:
-            value = int(response.content)
-            if range is not None:
-                if value < range[0] or value > range[1]:
-                    raise ValueError
+            value = parse_integer(response.content, range)
             break
-        except ValueError:
-            if range is None:
-                await ctx.send('Please enter a valid integer.')
-            else:
-                await ctx.send(f'Please enter a valid integer between {range[0]} and {range[1]}.')
+        except ValueError as e:
+            await ctx.send(str(e))
 
     return value
 
@@ -82,7 +194,7 @@ async def wait_for_options(ctx, options=None):
     # find in the list of options, return index if found, ask for re-enter if not found
     while True:
         try:
-            response = await client.wait_for('message')
+            response = await conversations.wait_for_message(ctx)
             index = options.index(response.content.lower())
             return index
         except ValueError:
@@ -93,29 +205,36 @@ async def wait_for_options(ctx, options=None):
 
 # event format:
 # <div date="mm/dd/yyyy" credit="xx">event A <br> event B <br> event C</div>
-async def add_event(ctx, event_date):
-    events = []
-    response = await client.wait_for('message')  # the first event
+# `events` and `rating` come from the command's arguments when it was given
+# any; only the missing ones are asked for, and the preview is skipped unless
+# `confirm` is set.
+async def add_event(ctx, event_date, events=None, rating=None, confirm=True):
+    if events is None:
+        events = []
+        response = await conversations.wait_for_message(ctx)  # the first event
+
+        # Add the first event to the list
+        events.append(response.content)
 
-    # Add the first event to the list
-    events.append(response.content)
+        # keep asking for events until the user says 'No'
+        while True:
+            await ctx.send('Do you want to add another event? If so, what is it? If not, type "No"')
+            response = await conversations.wait_for_message(ctx)
+            if response.content.lower() == 'no':
+                break
+            events.append(response.content)
 
-    # keep asking for events until the user says 'No'
-    while True:
-        await ctx.send('Do you want to add another event? If so, what is it? If not, type "No"')
-        response = await client.wait_for('message')
-        if response.content.lower() == 'no':
-            break
-        events.append(response.content)
+    if rating is None:
+        await ctx.send('On a scale from 0 to 100, how would you rate your day?')
+        rating = await wait_for_integer(ctx, range=CREDIT_RANGE)
 
-    await ctx.send('On a scale from 0 to 100, how would you rate your day?')
-    rating = await wait_for_integer(ctx, range=[0, 100])
+    if not confirm:
+        return event_div(event_date, rating, events)
 
     # this outer while loop is to ensure that the user can revise their input multiple times
     while True:
         # compile the generated new div and display it to the user
-        events_str = '<br> '.join(events)
-        new_div = f'<div date="{event_date}" credit="{rating}">{events_str}</div>'
+        new_div = event_div(event_date, rating, events)
 
         await ctx.send("Here is the new event you added:\n\n" + new_div)
         await ctx.send("Do you want to add this event to the calendar? (yes/no/revise)")
@@ -130,7 +249,7 @@ async def add_event(ctx, event_date):
         else:  # revise the event
             while True:
                 await ctx.send('Which event do you want to revise (enter the number)? (or type "done" to finish)')
-                response = await client.wait_for('message')
+                response = await conversations.wait_for_message(ctx)
                 if response.content.lower() == 'done':
                     break
                 try:
@@ -139,7 +258,7 @@ async def add_event(ctx, event_date):
                         await ctx.send(f"Invalid event number. Please enter a number between 1 and {len(events)}.")
                         continue
                     await ctx.send(f"Okay, what do you want to change event {index} to?")
-                    response = await client.wait_for('message')
+                    response = await conversations.wait_for_message(ctx)
                     events[index - 1] = response.content
                 except ValueError:
                     # if the user enters a non-integer
@@ -147,174 +266,161 @@ async def add_event(ctx, event_date):
                     continue
 
 
+# tells the user which arguments were rejected; they are asked for again
+async def report_invalid(ctx, errors):
+    for error in errors:
+        await ctx.send(error)
+
+
+async def ask_date(ctx, prompt, date=None):
+    if date is None:
+        await ctx.send(prompt)
+        response = await wait_for_date(ctx)
+        date = datetime.strptime(response.content, '%m/%d/%Y').strftime('%m/%d/%Y')
+    return date
+
+
 @client.command()
-async def new_event(ctx):
-    # get the time in the US/Central timezone
-    tz = pytz.timezone('US/Central')
-    now = datetime.now(tz)
+async def new_event(ctx, *args):
+    # get the time in the calendar's timezone
+    now = datetime.now(ctx.tenant.timezone)
     today = now.strftime("%m/%d/%Y")
     logging.info(f"initiated new_event by {ctx.author.name} at {now}")
 
+    values, errors = parse_event_arguments(args)
+    await report_invalid(ctx, errors)
+    one_shot = complete(values, errors, 'events', 'credit')
     # Send the initial message and wait for a response
-    await ctx.send('Sure. So what events do you want to add?')
-    new_div = await add_event(ctx, today)
+    if 'events' not in values:
+        await ctx.send('Sure. So what events do you want to add?')
+    new_div = await add_event(ctx, today, values.get('events'), values.get('credit'), confirm=not one_shot)
 
     if new_div is not None:
-        file_contents = repo.get_contents('events.html')
-        soup = BeautifulSoup(file_contents.decoded_content.decode('utf-8'), 'html.parser')
-
-        # insert before the last </div>
-        soup.find_all('div')[-1].insert_after(BeautifulSoup(new_div, 'html.parser'))
-        new_contents = soup.prettify()
-
-        # update the file
-        new_contents_bytes = new_contents.encode('utf-8')
-        repo.update_file('events.html', f'[Calendar Bot]: Update events for {today}', new_contents_bytes, file_contents.sha,
-                         branch='master')
+        layout = await ctx.tenant.layout()
+        await ctx.tenant.submit(layout, layout.path_for(today), [Mutation('add_event', today, new_div)],
+                     f'[Calendar Bot]: Update events for {today}')
         await ctx.send('Successfully added events for the date!')
 
 
 @client.command()
-async def revise_event(ctx):
-    await ctx.send("Please enter the date of the event to be revised (format: mm/dd/yyyy):")
-    response = await wait_for_date(ctx)
-
-    date = datetime.strptime(response.content, '%m/%d/%Y').strftime('%m/%d/%Y')
-
-    file_contents = repo.get_contents('events.html')
-    soup = BeautifulSoup(file_contents.decoded_content.decode('utf-8'), 'html.parser')
-
-    # TODO: put the following code in command !reformat_file
-    # update all date attributes to the format mm/dd/yyyy
-    # the original format sometimes will lack the leading 0
-    # for div in soup.find_all('div'):
-    #     if 'date' in div.attrs:
-    #         div['date'] = datetime.strptime(div['date'], '%m/%d/%Y').strftime('%m/%d/%Y')
-    #     if 'start' in div.attrs:
-    #         div['start'] = datetime.strptime(div['start'], '%m/%d/%Y').strftime('%m/%d/%Y')
-    #     if 'end' in div.attrs:
-    #         div['end'] = datetime.strptime(div['end'], '%m/%d/%Y').strftime('%m/%d/%Y')
-
-    # get all the divs with a date and credit attribute
-    div = soup.find_all('div', attrs={'date': date, 'credit': True})
-
-    if len(div) == 0:
-        await ctx.send("No events found for that date. Do you want to add a new event for that date? (yes/no)")
-        choice = await wait_for_options(ctx, ['yes', 'no'])
-        if choice == 0:
+async def revise_event(ctx, *args):
+    values, errors = parse_event_arguments(args, with_date=True)
+    await report_invalid(ctx, errors)
+    one_shot = complete(values, errors, 'date', 'events', 'credit')
+    date = await ask_date(ctx, "Please enter the date of the event to be revised (format: mm/dd/yyyy):",
+                          values.get('date'))
+
+    layout = await ctx.tenant.layout()
+    path, calendar = await ctx.tenant.calendar_for(layout, date)
+    event = calendar.find_event(date)
+
+    if event is None:
+        if not one_shot:
+            await ctx.send("No events found for that date. Do you want to add a new event for that date? (yes/no)")
+            choice = await wait_for_options(ctx, ['yes', 'no'])
+            if choice == 1:
+                await ctx.send("Okay, I won't add it. Bye!")
+                return
+        if 'events' not in values:
             await ctx.send('Sure. So what events do you want to add?')
-            new_div = await add_event(ctx, date)
-            if new_div is not None:
-                # find the correct place to insert the new div
-                inserted = False
-                all_divs = soup.find_all('div', attrs={'date': True, 'credit': True})
-                for div in all_divs:
-                    if datetime.strptime(div['date'], '%m/%d/%Y') > datetime.strptime(date, '%m/%d/%Y'):
-                        div.insert_before(BeautifulSoup(new_div, 'html.parser'))
-                        inserted = True
-                        logging.info(f"inserted new div for {date}")
-                        break
-                if not inserted:
-                    all_divs[-1].insert_after(BeautifulSoup(new_div, 'html.parser'))
-                    logging.info(f"Latest: inserted new div for {date}")
-            new_contents = soup.prettify()
-
-            # update the file
-            new_contents_bytes = new_contents.encode('utf-8')
-            repo.update_file('events.html', f'[Calendar Bot]: Revise events for {date}', new_contents_bytes, file_contents.sha,
-                             branch='master')
+        new_div = await add_event(ctx, date, values.get('events'), values.get('credit'), confirm=not one_shot)
+        if new_div is not None:
+            await ctx.tenant.submit(layout, path, [Mutation('put_event', date, new_div)],
+                         f'[Calendar Bot]: Revise events for {date}')
+            logging.info(f"inserted new div for {date}")
             await ctx.send('Successfully added events for the date!')
-            return
-        elif choice == 1:
-            await ctx.send("Okay, I won't add it. Bye!")
-            return
     else:
-        await ctx.send(f"The following events were found for {date}:\n\n{div[0]}")
-        await ctx.send("Do you want to revise this event? (yes/no)")
-        choice = await wait_for_options(ctx, ['yes', 'no'])
-        if choice == 0:
+        if not one_shot:
+            await ctx.send(f"The following events were found for {date}:\n\n{event}")
+        if not one_shot:
+            await ctx.send("Do you want to revise this event? (yes/no)")
+            choice = await wait_for_options(ctx, ['yes', 'no'])
+            if choice == 1:
+                await ctx.send("Okay, I won't revise it. Bye!")
+                return
+        if 'events' not in values:
             await ctx.send("Okay, what do you want to change it to?")
-            new_div = await add_event(ctx, date)
-            if new_div is not None:
-                div[0].replace_with(BeautifulSoup(new_div, 'html.parser'))
-                new_contents = soup.prettify()
-
-                # update the file
-                new_contents_bytes = new_contents.encode('utf-8')
-                repo.update_file('events.html', f'[Calendar Bot]: Revise events for {date}', new_contents_bytes, file_contents.sha,
-                                 branch='master')
-                await ctx.send('Successfully revised events for the date!')
-        elif choice == 1:
-            await ctx.send("Okay, I won't revise it. Bye!")
+        new_div = await add_event(ctx, date, values.get('events'), values.get('credit'), confirm=not one_shot)
+        if new_div is not None:
+            await ctx.tenant.submit(layout, path, [Mutation('put_event', date, new_div)],
+                         f'[Calendar Bot]: Revise events for {date}')
+            await ctx.send('Successfully revised events for the date!')
 
 @client.command()
-async def delete_event(ctx):
-    await ctx.send("Please enter the date of the event to be deleted (format: mm/dd/yyyy):")
-    response = await wait_for_date(ctx)
-
-    date = datetime.strptime(response.content, '%m/%d/%Y').strftime('%m/%d/%Y')
-
-    file_contents = repo.get_contents('events.html')
-    soup = BeautifulSoup(file_contents.decoded_content.decode('utf-8'), 'html.parser')
-
-    # get all the divs with a date and credit attribute
-    div = soup.find_all('div', attrs={'date': date, 'credit': True})
-
-    if len(div) == 0:
+async def delete_event(ctx, *args):
+    values, errors = parse_date_arguments(args)
+    await report_invalid(ctx, errors)
+    one_shot = complete(values, errors, 'date')
+    date = await ask_date(ctx, "Please enter the date of the event to be deleted (format: mm/dd/yyyy):",
+                          values.get('date'))
+
+    layout = await ctx.tenant.layout()
+    path, calendar = await ctx.tenant.calendar_for(layout, date)
+    event = calendar.find_event(date)
+
+    if event is None:
         await ctx.send("No events found for that date. Bye!")
         return
 
     else:
-        await ctx.send(f"The following events were found for {date}:\n\n{div[0]}")
-        await ctx.send("Do you want to delete this event? (yes/no)")
-        choice = await wait_for_options(ctx, ['yes', 'no'])
-        if choice == 0:
-            div[0].decompose()
-            new_contents = soup.prettify()
-
-            # update the file
-            new_contents_bytes = new_contents.encode('utf-8')
-            repo.update_file('events.html', f'[Calendar Bot]: Delete events for {date}', new_contents_bytes, file_contents.sha,
-                             branch='master')
-            await ctx.send('Successfully deleted events for the date!')
-        elif choice == 1:
-            await ctx.send("Okay, I won't delete it. Bye!")
+        if not one_shot:
+            await ctx.send(f"The following events were found for {date}:\n\n{event}")
+            await ctx.send("Do you want to delete this event? (yes/no)")
+            choice = await wait_for_options(ctx, ['yes', 'no'])
+            if choice == 1:
+                await ctx.send("Okay, I won't delete it. Bye!")
+                return
+        await ctx.tenant.submit(layout, path, [Mutation('delete_event', date)],
+                     f'[Calendar Bot]: Delete events for {date}')
+        await ctx.send('Successfully deleted events for the date!')
 
 # period format:
 # <div start="mm/dd/yyyy" end="mm/dd/yyyy" color="#{color-hex}">Period Description</div>
 # Note that we allow only a single sentence of description for a period.
 # Distinguish between ordinary periods and base periods. Base period format:
 # <div class="base" credit="xx" start="mm/dd/yyyy" end="mm/dd/yyyy" hue="xxx"><i>Period Description</i></div>
-async def add_period(ctx, start_date, end_date):
-    await ctx.send("Please enter the description of the period:")
-    response = await client.wait_for('message')
-
-    await ctx.send("Whether this period is a base period? (yes/no)")
-    base = await wait_for_options(ctx, ['yes', 'no'])
+# `values` holds the fields given as arguments; the others are asked for.
+async def add_period(ctx, start_date, end_date, values=None):
+    values = values or {}
+    description = values.get('description')
+    if description is None:
+        await ctx.send("Please enter the description of the period:")
+        description = (await conversations.wait_for_message(ctx)).content
+
+    if 'color' in values:
+        base = 1
+    elif 'credit' in values or 'hue' in values:
+        base = 0
+    else:
+        await ctx.send("Whether this period is a base period? (yes/no)")
+        base = await wait_for_options(ctx, ['yes', 'no'])
 
     if base == 0:
-        await ctx.send("Please enter the credit of the period:")
-        rating = await wait_for_integer(ctx, (0, 100))
+        rating = values.get('credit')
+        if rating is None:
+            await ctx.send("Please enter the credit of the period:")
+            rating = await wait_for_integer(ctx, CREDIT_RANGE)
 
-        await ctx.send("Please enter the hue of the period:")
-        hue = await wait_for_integer(ctx, (0, 360))
+        hue = values.get('hue')
+        if hue is None:
+            await ctx.send("Please enter the hue of the period:")
+            hue = await wait_for_integer(ctx, HUE_RANGE)
 
-        return f'<div class="base" credit="{rating}" start="{start_date}" end="{end_date}" hue="{hue}"><i>{response.content}</i></div>'
+        return base_period_div(start_date, end_date, rating, hue, description)
     elif base == 1:
-        await ctx.send("Please enter the color of the period (format: #{color-hex}):\n (You can use https://htmlcolorcodes.com/ to find a color)")
-        color = await wait_for_color(ctx)
+        color = values.get('color')
+        if color is None:
+            await ctx.send("Please enter the color of the period (format: #{color-hex}):\n (You can use https://htmlcolorcodes.com/ to find a color)")
+            color = (await wait_for_color(ctx)).content
 
-        return f'<div start="{start_date}" end="{end_date}" color="{color.content}">{response.content}</div>'
-
-@client.command()
-async def new_period(ctx):
-    await ctx.send("Please enter the start date of the period (format: mm/dd/yyyy):")
-    response = await wait_for_date(ctx)
-    start_date = datetime.strptime(response.content, '%m/%d/%Y')
+        return period_div(start_date, end_date, color, description)
 
-    await ctx.send("Please enter the end date of the period (format: mm/dd/yyyy):")
-    response = await wait_for_date(ctx)
-    end_date = datetime.strptime(response.content, '%m/%d/%Y')
+# asks for whichever date of the period is missing, then until the end is not before the start
+async def ask_period_dates(ctx, start_date=None, end_date=None):
+    start_date = await ask_date(ctx, "Please enter the start date of the period (format: mm/dd/yyyy):", start_date)
+    end_date = await ask_date(ctx, "Please enter the end date of the period (format: mm/dd/yyyy):", end_date)
+    start_date = datetime.strptime(start_date, '%m/%d/%Y')
+    end_date = datetime.strptime(end_date, '%m/%d/%Y')
 
     while end_date < start_date:
         await ctx.send("The end date must be after the start date. Please enter 1 to re-enter the start date, or 2 to re-enter the end date:")
@@ -329,132 +435,371 @@ async def new_period(ctx):
             response = await wait_for_date(ctx)
             end_date = datetime.strptime(response.content, '%m/%d/%Y')
 
-    start_date = start_date.strftime('%m/%d/%Y')
-    end_date = end_date.strftime('%m/%d/%Y')
+    return start_date.strftime('%m/%d/%Y'), end_date.strftime('%m/%d/%Y')
+
+@client.command()
+async def new_period(ctx, *args):
+    values, errors = parse_period_arguments(args)
+    await report_invalid(ctx, errors)
+    one_shot = complete_period(values, errors)
+    start_date, end_date = await ask_period_dates(ctx, values.get('start'), values.get('end'))
     # verify if it is an existing period
-    file_contents = repo.get_contents('events.html')
-    soup = BeautifulSoup(file_contents.decoded_content.decode('utf-8'), 'html.parser')
-    divs = soup.find_all('div', attrs={'start': start_date, 'end': end_date})
-
-    if len(divs) != 0:
-        # len(divs) should be exactly 1 in our case, because we never allow two same periods
-        await ctx.send(f"The following period was found:\n\n{divs[0]}\n Do you want to revise this period? (yes/no)")
-        choice = await wait_for_options(ctx, ['yes', 'no'])
-        if choice == 0:
+    layout = await ctx.tenant.layout()
+    path, calendar = await ctx.tenant.calendar_for(layout, start_date)
+    period = calendar.find_period(start_date, end_date)
+
+    if period is not None:
+        # there is at most one such period, because we never allow two same periods
+        if one_shot:
+            new_div = await add_period(ctx, start_date, end_date, values)
+        else:
+            await ctx.send(f"The following period was found:\n\n{period}\n Do you want to revise this period? (yes/no)")
+            choice = await wait_for_options(ctx, ['yes', 'no'])
+            if choice == 1:
+                await ctx.send("Okay, I won't revise it. Bye!")
+                return
             await ctx.send("Okay, what do you want to change it to?")
-            new_div = await add_period(ctx, start_date, end_date)
+            new_div = await add_period(ctx, start_date, end_date, values)
 
             await ctx.send(f"Okay, I will change it to:\n\n{new_div}\n Do you want to proceed? (yes/no)")
             final_choice = await wait_for_options(ctx, ['yes', 'no'])
-            if final_choice == 0:
-                if new_div is not None:
-                    divs[0].replace_with(BeautifulSoup(new_div, 'html.parser'))
-                    new_contents = soup.prettify()
-
-                    # update the file
-                    new_contents_bytes = new_contents.encode('utf-8')
-                    repo.update_file('events.html', f'[Calendar Bot]: Revise period from {start_date} to {end_date}', new_contents_bytes, file_contents.sha,
-                                     branch='master')
-                    await ctx.send('Successfully revised the period!')
-            elif final_choice == 1:
+            if final_choice == 1:
                 await ctx.send("Okay, I won't revise it. Bye!")
-        elif choice == 1:
-            await ctx.send("Okay, I won't revise it. Bye!")
+                return
+        if new_div is not None:
+            await ctx.tenant.submit(layout, path, [Mutation('put_period', (start_date, end_date), new_div)],
+                         f'[Calendar Bot]: Revise period from {start_date} to {end_date}')
+            await ctx.send('Successfully revised the period!')
     else:
-        await ctx.send("No period found. Do you want to add a new period? (yes/no)")
-        choice = await wait_for_options(ctx, ['yes', 'no'])
-        if choice == 0:
-            new_div = await add_period(ctx, start_date, end_date)
+        if one_shot:
+            new_div = await add_period(ctx, start_date, end_date, values)
+        else:
+            await ctx.send("No period found. Do you want to add a new period? (yes/no)")
+            choice = await wait_for_options(ctx, ['yes', 'no'])
+            if choice == 1:
+                await ctx.send("Okay, I won't add it. Bye!")
+                return
+            new_div = await add_period(ctx, start_date, end_date, values)
 
             await ctx.send(f"Okay, I will add the following period:\n\n{new_div}\n Do you want to proceed? (yes/no)")
             final_choice = await wait_for_options(ctx, ['yes', 'no'])
-            if final_choice == 0:
-                if new_div is not None:
-                    # find the correct position to insert the new period
-                    # (the periods' start dates) are in time order)
-                    inserted = False
-                    all_periods = soup.find_all('div', attrs={'start': True})
-                    for i in range(len(all_periods)):
-                        if datetime.strptime(all_periods[i]['start'], '%m/%d/%Y') > datetime.strptime(start_date, '%m/%d/%Y'):
-                            all_periods[i].insert_before(BeautifulSoup(new_div, 'html.parser'))
-                            inserted = True
-                            break
-                    if not inserted:
-                        all_periods[-1].insert_after(BeautifulSoup(new_div, 'html.parser'))
-
-                    new_contents = soup.prettify()
-
-                    # update the file
-                    new_contents_bytes = new_contents.encode('utf-8')
-                    repo.update_file('events.html', f'[Calendar Bot]: Add period from {start_date} to {end_date}', new_contents_bytes, file_contents.sha,
-                                     branch='master')
-                    await ctx.send('Successfully added the period!')
-            elif final_choice == 1:
+            if final_choice == 1:
                 await ctx.send("Okay, I won't add it. Bye!")
-        elif choice == 1:
-            await ctx.send("Okay, I won't add it. Bye!")
+                return
+        if new_div is not None:
+            await ctx.tenant.submit(layout, path, [Mutation('put_period', (start_date, end_date), new_div)],
+                         f'[Calendar Bot]: Add period from {start_date} to {end_date}')
+            await ctx.send('Successfully added the period!')
+
+@client.command()
+async def delete_period(ctx, *args):
+    values, errors = parse_period_arguments(args, dates_only=True)
+    await report_invalid(ctx, errors)
+    one_shot = complete(values, errors, 'start', 'end')
+    start_date, end_date = await ask_period_dates(ctx, values.get('start'), values.get('end'))
+    # verify if it is an existing period
+    layout = await ctx.tenant.layout()
+    path, calendar = await ctx.tenant.calendar_for(layout, start_date)
+    period = calendar.find_period(start_date, end_date)
+
+    if period is not None:
+        # there is at most one such period, because we never allow two same periods
+        if not one_shot:
+            await ctx.send(f"The following period was found:\n\n{period}\n Do you want to delete this period? (yes/no)")
+            choice = await wait_for_options(ctx, ['yes', 'no'])
+            if choice == 1:
+                await ctx.send("Okay, I won't delete it. Bye!")
+                return
+        await ctx.tenant.submit(layout, path, [Mutation('delete_period', (start_date, end_date))],
+                     f'[Calendar Bot]: Delete period from {start_date} to {end_date}')
+        await ctx.send('Successfully deleted the period!')
+    else:
+        await ctx.send("No period found. Bye!")
+
+# bulk import: a .csv or .json attachment with the columns described in calendar_io.py
+@client.command(name='import')
+async def import_calendar(ctx):
+    if not ctx.message.attachments:
+        await ctx.send("Please attach a .csv or .json file with the events and periods to import.")
+        return
+    attachment = ctx.message.attachments[0]
+    try:
+        file_format = format_of(attachment.filename)
+        rows = read_rows(await attachment.read(), file_format)
+        divs, rejected = validate_rows(rows)
+    except (ValueError, csv.Error) as e:
+        await ctx.send(f"I couldn't read {attachment.filename}: {e}")
+        return
+
+    layout = await ctx.tenant.layout()
+    grouped = divs_by_path(layout, divs)
+    replaced = 0
+    for path, shard_divs in grouped.items():
+        calendar = await ctx.tenant.read_document(path)
+        replaced += sum(1 for div in shard_divs if calendar.contains(div))
+    report = f"{len(divs) - replaced} to insert, {replaced} to replace, {len(rejected)} rejected."
+    if rejected:
+        report += "\n" + "\n".join(f"row {number}: {reason}" for number, reason in rejected[:10])
+        if len(rejected) > 10:
+            report += f"\n... and {len(rejected) - 10} more"
+    if not divs:
+        await ctx.send(f"Nothing to import. {report}")
+        return
 
+    await ctx.send(f"{report}\nDo you want to import them? (yes/no)")
+    choice = await wait_for_options(ctx, ['yes', 'no'])
+    if choice == 0:
+        edits = {path: [Mutation('merge', None, shard_divs)] for path, shard_divs in grouped.items()}
+        await ctx.tenant.record(shard_edits(layout, edits),
+                     f'[Calendar Bot]: Import {len(divs)} events and periods from {attachment.filename}')
+        await ctx.send(f"Successfully imported {attachment.filename}! {report}")
+    elif choice == 1:
+        await ctx.send("Okay, I won't import it. Bye!")
+
+@client.command(name='export')
+async def export_calendar(ctx, file_format='csv'):
+    if file_format not in ('csv', 'json'):
+        await ctx.send("Please choose csv or json.")
+        return
+    layout = await ctx.tenant.layout()
+    calendars = [await ctx.tenant.read_document(path) for path in layout.paths]
+    with metrics.timer('serialize'):
+        data = write_rows((row for calendar in calendars for row in export_rows(calendar)), file_format)
+    events = sum(len(calendar.events) for calendar in calendars)
+    periods = sum(len(calendar.periods) for calendar in calendars)
+    await ctx.send(f"{events} events and {periods} periods:",
+                   file=discord.File(io.BytesIO(data), filename=f'calendar.{file_format}'))
+
+# the shard files for the calendar as it is now, or why it cannot be split yet
+async def split_legacy(tenant, legacy_path, by):
+    if tenant.journal:
+        return None, (f"{len(tenant.journal)} edits are still waiting to be synced to GitHub (see !pending). "
+                      "Please try again once they are done.")
+    document = await tenant.documents.get(legacy_path)
+    try:
+        files = split_calendar(document.text, by)
+    except ValueError as e:
+        return None, f"I couldn't reformat {legacy_path}: {e}"
+    if not files:
+        return None, f"There is nothing in {legacy_path} to reformat. Bye!"
+    return files, None
+
+# one-off migration to the sharded layout: events.html is read once, every date
+# is rewritten as mm/dd/yyyy, and the per-year (or per-month) files and the
+# manifest are pushed in a single commit. events.html itself is left in place.
 @client.command()
-async def delete_period(ctx):
-    await ctx.send("Please enter the start date of the period (format: mm/dd/yyyy):")
-    response = await wait_for_date(ctx)
-    start_date = datetime.strptime(response.content, '%m/%d/%Y')
+async def reformat_file(ctx, by='year'):
+    if by not in GRANULARITIES:
+        await ctx.send(f"Please choose one of: {', '.join(GRANULARITIES)}.")
+        return
+    layout = await ctx.tenant.layout()
+    if layout.sharded:
+        await ctx.send(f"The calendar is already split into {len(layout.shards)} files. Bye!")
+        return
 
-    await ctx.send("Please enter the end date of the period (format: mm/dd/yyyy):")
-    response = await wait_for_date(ctx)
-    end_date = datetime.strptime(response.content, '%m/%d/%Y')
+    legacy_path = layout.path
+    files, problem = await split_legacy(ctx.tenant, legacy_path, by)
+    if problem:
+        await ctx.send(problem)
+        return
 
-    while end_date < start_date:
-        await ctx.send("The end date must be after the start date. Please enter 1 to re-enter the start date, or 2 to re-enter the end date:")
-        response = await wait_for_options(ctx, ['1', '2'])
+    await ctx.send(f"This will split {legacy_path} into {len(files)} files, one per {by}, from {min(files)} to "
+                   f"{max(files)}, and list them in {MANIFEST_PATH}. Do you want to proceed? (yes/no)")
+    choice = await wait_for_options(ctx, ['yes', 'no'])
+    if choice == 1:
+        await ctx.send("Okay, I won't reformat it. Bye!")
+        return
 
-        if response == 0:
-            await ctx.send("Please enter the start date of the period (format: mm/dd/yyyy):")
-            response = await wait_for_date(ctx)
-            start_date = datetime.strptime(response.content, '%m/%d/%Y')
-        elif response == 1:
-            await ctx.send("Please enter the end date of the period (format: mm/dd/yyyy):")
-            response = await wait_for_date(ctx)
-            end_date = datetime.strptime(response.content, '%m/%d/%Y')
+    # edits confirmed or replayed while the user was deciding went to
+    # legacy_path, which the site stops reading: split it again as of the head
+    # the commit goes on top of, so that a later edit is a CommitConflict
+    head = await ctx.tenant.storage.get_head()
+    files, problem = await split_legacy(ctx.tenant, legacy_path, by)
+    if problem:
+        await ctx.send(problem)
+        return
+    files[MANIFEST_PATH] = Manifest(by, files).to_text()
+    try:
+        await ctx.tenant.storage.commit_files(head, files, f'[Calendar Bot]: Split {legacy_path} into {len(files) - 1} files')
+    except CommitConflict:
+        await ctx.send("The calendar changed while I was reformatting it. Please try again.")
+        return
+    for path in files:
+        ctx.tenant.documents.invalidate(path)
+    await ctx.send(f"Done! Point the website at {MANIFEST_PATH} to load the new files.")
 
-    start_date = start_date.strftime('%m/%d/%Y')
-    end_date = end_date.strftime('%m/%d/%Y')
-    # verify if it is an existing period
-    file_contents = repo.get_contents('events.html')
-    soup = BeautifulSoup(file_contents.decoded_content.decode('utf-8'), 'html.parser')
-    divs = soup.find_all('div', attrs={'start': start_date, 'end': end_date})
-
-    if len(divs) != 0:
-        # len(divs) should be exactly 1 in our case, because we never allow two same periods
-        await ctx.send(f"The following period was found:\n\n{divs[0]}\n Do you want to delete this period? (yes/no)")
-        choice = await wait_for_options(ctx, ['yes', 'no'])
-        if choice == 0:
-            divs[0].decompose()
-            new_contents = soup.prettify()
-
-            # update the file
-            new_contents_bytes = new_contents.encode('utf-8')
-            repo.update_file('events.html', f'[Calendar Bot]: Delete period from {start_date} to {end_date}', new_contents_bytes, file_contents.sha,
-                             branch='master')
-            await ctx.send('Successfully deleted the period!')
-        elif choice == 1:
-            await ctx.send("Okay, I won't delete it. Bye!")
-    else:
-        await ctx.send("No period found. Bye!")
+###### analytics ######
+# numpy is imported by the first analytics command rather than at startup
+def credit_bar(mean):
+    return '█' * int(round(mean / 5))
+
+# `!summary [range]`: credit statistics over this year, a year, a month, two dates or "all"
+@client.command()
+async def summary(ctx, *args):
+    from analytics import credits_between, group_means, parse_range, summarize
+    try:
+        start, end, label = parse_range(args, datetime.now(ctx.tenant.timezone).date())
+    except ValueError as e:
+        await ctx.send(str(e))
+        return
+    layout = await ctx.tenant.layout()
+    calendars = [await ctx.tenant.read_document(path) for path in layout.paths_between(start, end)]
+    with metrics.timer('query'):
+        ordinals, credits = credits_between(calendars, start, end)
+        if not len(credits):
+            await ctx.send(f"No credits recorded for {label}.")
+            return
+        result = summarize(ordinals, credits)
+        # by month up to two years, by year beyond
+        by = 'month' if ordinals[-1] - ordinals[0] <= 731 else 'year'
+        groups, means, counts = group_means(ordinals, credits, by)
+
+    lines = [f'Credit for {label}: {result["count"]} days recorded',
+             f'mean {result["mean"]:.1f}, median {result["median"]:g}, std {result["std"]:.1f}',
+             f'lowest {result["min"]:g} on {result["min_date"]}, highest {result["max"]:g} on {result["max_date"]}',
+             '',
+             f'{by:<8} days  mean']
+    for group, mean, days in zip(groups, means, counts):
+        lines.append(f'{group:<8} {days:>4} {mean:>5.1f} {credit_bar(mean)}')
+    await ctx.send('```\n' + '\n'.join(lines) + '\n```')
+
+# `!trend [months]`: the average credit of each of the last months (12 by default) and where it is heading
+@client.command()
+async def trend(ctx, months: int = 12):
+    from analytics import credits_between, group_means, slope
+    if months < 2 or months > 120:
+        await ctx.send("Please choose between 2 and 120 months.")
+        return
+    today = datetime.now(ctx.tenant.timezone).date()
+    first_month = today.year * 12 + today.month - months
+    start = date(first_month // 12, first_month % 12 + 1, 1).toordinal()
+    end = today.toordinal()
+    layout = await ctx.tenant.layout()
+    calendars = [await ctx.tenant.read_document(path) for path in layout.paths_between(start, end)]
+    with metrics.timer('query'):
+        ordinals, credits = credits_between(calendars, start, end)
+        if len(credits) < 2:
+            await ctx.send(f"Not enough credits recorded in the last {months} months.")
+            return
+        groups, means, counts = group_means(ordinals, credits)
+        change = slope(ordinals, credits)
+
+    direction = 'up' if change > 0.05 else 'down' if change < -0.05 else 'flat'
+    lines = [f'Last {months} months: {direction}, {change:+.2f} points per 30 days', '',
+             'month    days  mean']
+    for group, mean, days in zip(groups, means, counts):
+        lines.append(f'{group:<8} {days:>4} {mean:>5.1f} {credit_bar(mean)}')
+    await ctx.send('```\n' + '\n'.join(lines) + '\n```')
+
+# `!overlaps [range]`: the periods that share a day with today, a date, a month, a year or two dates
+@client.command()
+async def overlaps(ctx, *args):
+    from analytics import FIRST, parse_range, periods_overlapping
+    today = datetime.now(ctx.tenant.timezone).date()
+    try:
+        start, end, label = parse_range(args or (today.strftime('%m/%d/%Y'),), today)
+    except ValueError as e:
+        await ctx.send(str(e))
+        return
+    layout = await ctx.tenant.layout()
+    # a period is filed under its start date, so every earlier file can hold one that reaches this far
+    calendars = [await ctx.tenant.read_document(path) for path in layout.paths_between(FIRST, end)]
+    with metrics.timer('query'):
+        periods = periods_overlapping(calendars, start, end)
+    if not periods:
+        await ctx.send(f"No periods overlap {label}.")
+        return
+    lines = [f"{len(periods)} period(s) overlap {label}:"]
+    for period in periods:
+        if period.base:
+            details = f"base, credit {period.attrs.get('credit')}, hue {period.attrs.get('hue')}"
+        else:
+            details = period.attrs.get('color', 'no color')
+        lines.append(f"{period.start} - {period.end} {period.description} ({details})")
+    await ctx.send('\n'.join(lines))
+
+# edits confirmed but not on GitHub yet; `!pending drop <id>` gives up on one
+@client.command()
+async def pending(ctx, action=None, entry_id: int = None):
+    journal = ctx.tenant.journal
+    if action == 'drop':
+        if entry_id not in journal.entries:
+            await ctx.send("There is no pending edit with that number.")
+            return
+        await journal.remove([entry_id])
+        await ctx.send(f"Dropped edit #{entry_id} from the journal.")
+        return
+    if not journal:
+        await ctx.send("Everything is synced to GitHub.")
+        return
+    now = time.time()
+    lines = [f"{len(journal)} edit(s) waiting to be synced to GitHub:"]
+    for entry in list(journal.entries.values())[:10]:
+        line = f"#{entry.id} ({now - entry.created:.0f}s ago) {entry.message}"
+        if entry.attempts:
+            line += f" - {entry.attempts} failed attempt(s), last error: {entry.error}"
+        lines.append(line)
+    if len(journal) > 10:
+        lines.append(f"... and {len(journal) - 10} more")
+    await ctx.send('\n'.join(lines))
+
+# latency of every phase over all commands, GitHub usage, and how this
+# calendar's cache and commits are doing
+@client.command()
+async def stats(ctx):
+    tenant = ctx.tenant
+    lines = ['phase        count   p50 ms   p95 ms']
+    for phase, histogram in sorted(metrics.by_label('phase_seconds', 'phase').items()):
+        lines.append(f'{phase:<12} {histogram.count:>5} {histogram.quantile(0.5) * 1e3:>8g} {histogram.quantile(0.95) * 1e3:>8g}')
+
+    calls = {dict(labels)['operation']: int(value) for (name, labels), value in metrics.counters.items()
+             if name == 'github_calls'}
+    remaining, limit = tenant.storage.rate_limit()
+    lines.append('')
+    lines.append(f'GitHub calls: {sum(calls.values())} ({", ".join(f"{op} {n}" for op, n in sorted(calls.items())) or "none"})')
+    lines.append(f'Rate limit: {remaining}/{limit}' if limit > 0 else 'Rate limit: unknown yet')
+    for (name, labels), value in metrics.gauges.items():
+        labels = dict(labels)
+        if name == 'document_bytes' and labels.get('tenant') == tenant.labels.get('tenant'):
+            lines.append(f'{labels["path"]}: {value / 1024:.1f} KB')
+    cache = tenant.documents.stats()
+    lines.append(f'Cache: {cache["hits"]} hits, {cache["misses"]} misses, {cache["revalidations"]} revalidations, '
+                 f'{cache["evictions"]} evictions')
+    lines.append(f'Commits: {tenant.commits.commits}, conflicts: {tenant.commits.conflicts}, '
+                 f'unsynced edits: {len(tenant.journal)}, open sessions: {len(conversations)}')
+    lines.append(f'Calendars: {len(tenants)} open, {tenants.cached() / 2 ** 20:.1f} of '
+                 f'{tenants.budget / 2 ** 20:.0f} MB cached')
+    sent = {name: int(metrics.counters.get((name, ()), 0))
+            for name in ('outbox_messages', 'outbox_sends', 'outbox_rate_limited')}
+    lines.append(f'Outbox: {len(outbox)} queued, {sent["outbox_messages"]} messages in {sent["outbox_sends"]} sends, '
+                 f'{sent["outbox_rate_limited"]} rate limited')
+    ready = f'{supervisor.last_ready:.1f}s' if supervisor.last_ready is not None else 'unknown'
+    lines.append(f'Connection: {supervisor.reconnects} reconnects, last ready after {ready}')
+    await ctx.send('```\n' + '\n'.join(lines) + '\n```')
 
 # handle the command to add an event
 @client.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
         await ctx.send("Command not found. Please use !help to see the list of commands.")
+    elif isinstance(error, NoCalendar):
+        await ctx.send("There is no calendar set up for this server or for you yet.")
+    # bad quoting, a missing argument, or one that is not a number (`!trend soon`)
+    elif isinstance(error, commands.UserInputError):
+        await ctx.send(f"I couldn't read the arguments: {error}")
+    elif isinstance(error, commands.CommandInvokeError) and isinstance(error.original, SessionTimeout):
+        await ctx.send(f"No answer from {ctx.author.name} for a while, so I stopped this command. Bye!")
+    elif isinstance(error, commands.CommandInvokeError) and isinstance(error.original, SessionReplaced):
+        logging.info(f"{ctx.command} by {ctx.author.name} replaced by a newer command")
     else:
         raise error
 
-if __name__ == '__main__':
+# the git backend's background sync is stopped once the bot is closed
+async def run():
     try:
-        client.run(os.getenv('DISCORD_TOKEN'))
-    except discord.errors.HTTPException as e:
-        # restart the bot if the bot is disconnected
-        logging.info(f"Blocked by HTTP error: {e}")
-        system("python restart.py")
-        system('kill 1')
+        await supervisor.run()
+    finally:
+        await tenants.close()
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -0,0 +1,148 @@
+# Lightweight in-process metrics: latency histograms per command phase,
+# counters and gauges, rendered in the Prometheus text format. Recording is a
+# perf_counter call, a bisect over a short bucket list and a dict lookup, so it
+# stays on in production.
+
+import asyncio
+import contextvars
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+PREFIX = 'calendar_bot_'
+# seconds; the last bucket (+Inf) catches everything slower
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# the command being run, so phases deep in the call stack are attributed to it
+current_command = contextvars.ContextVar('current_command', default='none')
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for index, value in enumerate(other.counts):
+            self.counts[index] += value
+        self.sum += other.sum
+        self.count += other.count
+
+    # upper bound of the bucket holding the q-th quantile
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, value in enumerate(self.counts):
+            seen += value
+            if seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else float('inf')
+        return float('inf')
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)
+        self.counters = defaultdict(float)
+        self.gauges = {}
+
+    def observe(self, name, value, **labels):
+        self.histograms[name, _labels(labels)].observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        self.counters[name, _labels(labels)] += amount
+
+    def set(self, name, value, **labels):
+        self.gauges[name, _labels(labels)] = value
+
+    # times one phase of a command: fetch, parse, mutate, serialize, upload, user_wait, ...
+    @contextmanager
+    def timer(self, phase, command=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('phase_seconds', time.perf_counter() - started,
+                         phase=phase, command=command or current_command.get())
+
+    # all observations of a histogram for one label value, summed over the others
+    def by_label(self, name, label):
+        merged = defaultdict(Histogram)
+        for (metric, labels), histogram in self.histograms.items():
+            if metric == name:
+                merged[dict(labels).get(label, '')].merge(histogram)
+        return merged
+
+    def render(self):
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(f'{PREFIX}{name}_total', 'counter')
+            lines.append(f'{PREFIX}{name}_total{_format_labels(labels)} {value:g}')
+        for (name, labels), value in sorted(self.gauges.items()):
+            declare(f'{PREFIX}{name}', 'gauge')
+            lines.append(f'{PREFIX}{name}{_format_labels(labels)} {value:g}')
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            declare(f'{PREFIX}{name}', 'histogram')
+            cumulative = 0
+            for bound, value in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += value
+                lines.append(f'{PREFIX}{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum:g}')
+            lines.append(f'{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    async def write_periodically(self, path, interval=30.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                with open(path, 'w') as f:
+                    f.write(self.render())
+            except OSError as e:
+                logging.info(f"could not write metrics to {path}: {e}")
+
+    # a minimal HTTP endpoint for Prometheus to scrape
+    async def serve(self, port):
+        async def handle(reader, writer):
+            try:
+                await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                pass
+            body = self.render().encode('utf-8')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+            await writer.drain()
+            writer.close()
+
+        return await asyncio.start_server(handle, port=port)
+
+
+metrics = Metrics()
@@ -0,0 +1,164 @@
+# Outbound messages. Handlers often send two or three messages in a row (a
+# preview, then the question about it); every one of them is a round trip to
+# Discord and counts against the channel's rate limit. The outbox queues them
+# per channel, merges the ones sent within `window` seconds into a single
+# message, splits anything over Discord's 2000 character limit on line breaks,
+# and paces the sends with a token bucket per route so that bursts wait for
+# their turn instead of running into 429s.
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import metrics
+
+LIMIT = 2000
+FENCE = '```'
+
+
+class Bucket:
+    # `rate` requests per `per` seconds; tokens can go negative, which is how
+    # a request books a slot in the future
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    # takes a token and returns how long to wait before using it
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens * self.per / self.rate)
+
+    # Discord said to back off: nothing goes out for `seconds`
+    def block(self, seconds):
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate / self.per
+
+
+# splits text into pieces of at most `limit` characters, at a line break if
+# possible, then at a space; a code block cut in two is closed and reopened
+def split_message(text, limit=LIMIT):
+    chunks = []
+    reopen = False
+    while text:
+        # a cut inside the reopened fence would give back the same text
+        start = 0
+        if reopen:
+            text = FENCE + '\n' + text
+            start = len(FENCE) + 1
+        if len(text) <= limit:
+            chunks.append(text)
+            break
+        room = limit - len(FENCE) - 1  # for closing a code block
+        cut = text.rfind('\n', start, room)
+        if cut <= start:
+            cut = text.rfind(' ', start, room)
+        if cut <= start:
+            cut = room
+        chunk = text[:cut]
+        # the line break or space we cut at is not carried over
+        text = text[cut + 1:] if text[cut] in '\n ' else text[cut:]
+        reopen = chunk.count(FENCE) % 2 == 1
+        chunks.append(chunk + '\n' + FENCE if reopen else chunk)
+    return chunks
+
+
+class Outgoing:
+    def __init__(self, deliver, content, kwargs):
+        self.deliver = deliver
+        self.content = content
+        self.kwargs = kwargs
+        self.queued = time.perf_counter()
+
+    @property
+    def text(self):
+        return '' if self.content is None else str(self.content)
+
+
+class Outbox:
+    def __init__(self, window=0.02, channel_rate=(5, 5.0), global_rate=(50, 1.0)):
+        self.window = window
+        self.channel_rate = channel_rate
+        self.global_bucket = Bucket(*global_rate)
+        self._buckets = {}
+        self._queues = {}
+        self._workers = {}
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    # queues a message for `channel`; `deliver(content, **kwargs)` actually sends it
+    async def send(self, channel, deliver, content=None, **kwargs):
+        self._queues.setdefault(channel, deque()).append(Outgoing(deliver, content, kwargs))
+        metrics.set('outbox_queue_depth', len(self))
+        worker = self._workers.get(channel)
+        if worker is None or worker.done():
+            self._workers[channel] = asyncio.create_task(self._drain(channel))
+
+    async def _drain(self, channel):
+        queue = self._queues[channel]
+        await asyncio.sleep(self.window)
+        while queue:
+            batch = self._next_batch(queue)
+            metrics.set('outbox_queue_depth', len(self))
+            await self._deliver(channel, batch)
+            if not queue:
+                # give the handler a moment to add the next prompt
+                await asyncio.sleep(self.window)
+        del self._queues[channel]
+        del self._workers[channel]
+
+    # consecutive plain text messages, merged while they fit in one message;
+    # a message with a file or an embed goes on its own
+    def _next_batch(self, queue):
+        batch = [queue.popleft()]
+        if batch[0].kwargs:
+            return batch
+        length = len(batch[0].text)
+        while queue and not queue[0].kwargs and length + 1 + len(queue[0].text) <= LIMIT:
+            length += 1 + len(queue[0].text)
+            batch.append(queue.popleft())
+        return batch
+
+    async def _deliver(self, channel, batch):
+        first = batch[0]
+        content = '\n'.join(item.text for item in batch if item.content is not None)
+        chunks = split_message(content) if content else [None]
+        metrics.inc('outbox_messages', len(batch))
+        for index, chunk in enumerate(chunks):
+            # files and embeds go with the last piece
+            kwargs = first.kwargs if index == len(chunks) - 1 else {}
+            await self._send_paced(channel, first.deliver, chunk, kwargs)
+        now = time.perf_counter()
+        for item in batch:
+            metrics.observe('phase_seconds', now - item.queued, phase='send', command='outbox')
+
+    async def _send_paced(self, channel, deliver, content, kwargs):
+        bucket = self._buckets.get(channel)
+        if bucket is None:
+            bucket = self._buckets[channel] = Bucket(*self.channel_rate)
+        for _ in range(3):
+            wait = max(bucket.take(), self.global_bucket.take())
+            if wait:
+                metrics.inc('outbox_paced')
+                await asyncio.sleep(wait)
+            try:
+                await deliver(content, **kwargs)
+                metrics.inc('outbox_sends')
+                return
+            except Exception as e:
+                if getattr(e, 'status', None) != 429:
+                    logging.info(f"could not send a message to channel {channel}: {e}")
+                    return
+                retry_after = getattr(e, 'retry_after', None) or 1.0
+                metrics.inc('outbox_rate_limited')
+                bucket.block(retry_after)
+        logging.info(f"gave up sending a message to channel {channel} after repeated 429s")
@@ -0,0 +1,169 @@
+# Sharded storage for the calendar. The legacy layout keeps every div in
+# events.html, so each edit downloads, parses and uploads the whole history.
+# After !reformat_file the divs live in one file per year (or per month) under
+# events/, and events/manifest.json lists the files for the website to load:
+#   {"by": "year", "shards": ["events/2021.html", "events/2022.html"]}
+# An event belongs to the shard of its date and a period to the shard of its
+# start date, so an edit only touches one small file.
+
+import json
+import posixpath
+import re
+from datetime import date, datetime
+
+from calendar_model import Calendar, Mutation, Period, make_record, parse_div, soup_divs
+from events_parser import MalformedCalendar, scan_divs
+from validation import DATE_FORMAT
+
+LEGACY_PATH = 'events.html'
+SHARD_DIRECTORY = 'events'
+MANIFEST_PATH = f'{SHARD_DIRECTORY}/manifest.json'
+GRANULARITIES = ('year', 'month')
+
+# a date attribute inside a start tag, quoted or not
+_date_attribute = re.compile(r'''(\s(?:date|start|end)\s*=\s*)(["']?)([^"'\s>]*)\2''', re.IGNORECASE)
+
+
+# the date that decides which shard a div goes to
+def shard_date(attrs):
+    return attrs['date'] if 'date' in attrs and 'credit' in attrs else attrs['start']
+
+
+def shard_path(day, by='year'):
+    month, _, year = day.strip().split('/')
+    if by == 'month':
+        return f'{SHARD_DIRECTORY}/{int(year)}-{int(month):02d}.html'
+    return f'{SHARD_DIRECTORY}/{int(year)}.html'
+
+
+# (first, last) day ordinals a shard can hold
+def shard_range(path):
+    year, _, month = posixpath.splitext(posixpath.basename(path))[0].partition('-')
+    if not month:
+        return date(int(year), 1, 1).toordinal(), date(int(year), 12, 31).toordinal()
+    year, month = int(year), int(month)
+    return date(year, month, 1).toordinal(), date(year + month // 12, month % 12 + 1, 1).toordinal() - 1
+
+
+# The legacy layout: everything in one file.
+class SingleFile:
+    sharded = False
+
+    def __init__(self, path=LEGACY_PATH):
+        self.path = path
+
+    @property
+    def paths(self):
+        return [self.path]
+
+    def path_for(self, day):
+        return self.path
+
+    def paths_between(self, start, end):
+        return [self.path]
+
+
+class Manifest:
+    sharded = True
+
+    def __init__(self, by='year', shards=()):
+        self.by = by
+        self.shards = sorted(set(shards))
+
+    @classmethod
+    def from_json(cls, text):
+        if not text.strip():
+            return cls()
+        data = json.loads(text)
+        return cls(data.get('by', 'year'), data.get('shards', []))
+
+    # the text the commit queue writes back
+    def to_text(self):
+        return json.dumps({'by': self.by, 'shards': self.shards}, indent=2) + '\n'
+
+    @property
+    def paths(self):
+        return self.shards
+
+    def path_for(self, day):
+        return shard_path(day, self.by)
+
+    # the shards that can hold divs dated from `start` to `end` (ordinals)
+    def paths_between(self, start, end):
+        paths = []
+        for path in self.shards:
+            first, last = shard_range(path)
+            if first <= end and last >= start:
+                paths.append(path)
+        return paths
+
+    # add_shard: key = path of a shard created by the same commit
+    def apply(self, mutation):
+        if mutation.action != 'add_shard':
+            raise ValueError(f'Unknown mutation: {mutation.action}')
+        if mutation.key not in self.shards:
+            self.shards = sorted(self.shards + [mutation.key])
+
+
+# the parse function of the document cache: the manifest is JSON, the rest are calendars
+def parse_document(path, text):
+    if path == MANIFEST_PATH:
+        return Manifest.from_json(text)
+    return Calendar.from_html(text)
+
+
+# the edits for one commit: the mutations of each file, plus a manifest entry
+# for every shard that does not exist yet
+def shard_edits(layout, mutations_by_path):
+    edits = dict(mutations_by_path)
+    if layout.sharded:
+        new_shards = [path for path in edits if path not in layout.shards]
+        if new_shards:
+            edits[MANIFEST_PATH] = [Mutation('add_shard', path) for path in new_shards]
+    return edits
+
+
+# groups new divs by the file they belong to
+def divs_by_path(layout, divs):
+    grouped = {}
+    for div in divs:
+        grouped.setdefault(layout.path_for(shard_date(parse_div(div))), []).append(div)
+    return grouped
+
+
+# rewrites the date attributes of a div as mm/dd/yyyy, adding the leading zeros
+# that older entries sometimes lack
+def normalize_div(html):
+    end = html.index('>')
+
+    def normalize(match):
+        prefix, _, value = match.groups()
+        try:
+            value = datetime.strptime(value.strip(), DATE_FORMAT).strftime(DATE_FORMAT)
+        except ValueError:
+            raise ValueError(f'invalid date "{value}" in {html}') from None
+        return f'{prefix}"{value}"'
+
+    return _date_attribute.sub(normalize, html[:end]) + html[end:]
+
+
+# Splits the legacy file into shards in a single pass over its divs:
+# {path: text}, each shard holding its events by date and then its periods by
+# start date. Text outside the calendar divs is not carried over.
+def split_calendar(text, by='year'):
+    try:
+        return _split(((attrs, text[start:end]) for attrs, start, end in scan_divs(text)), by)
+    except MalformedCalendar:
+        return _split(((attrs, text[start:end]) for attrs, start, end in soup_divs(text)), by)
+
+
+def _split(divs, by):
+    shards = {}
+    for attrs, html in divs:
+        html = normalize_div(html)
+        record = make_record(attrs, html)
+        # events sort before periods within a shard
+        key = (isinstance(record, Period), record.ordinal)
+        shards.setdefault(shard_path(shard_date(attrs), by), []).append((key, html))
+    return {path: '\n'.join(html for _, html in sorted(divs, key=lambda item: item[0])) + '\n'
+            for path, divs in sorted(shards.items())}
@@ -0,0 +1,330 @@
+# Where the calendar files live. Commands never talk to a backend directly: they
+# go through the DocumentCache and the CommitQueue below, which only use the
+# Storage interface, so the same bot runs against GitHub, a local git clone, or
+# a plain directory (see local_storage.py).
+#
+# GitHubStorage is the default. PyGithub is a synchronous library: calling it
+# straight from a command handler freezes the whole discord event loop until
+# the HTTP round trip returns, so every call runs on a worker thread. It is
+# also slow to import, so it is only imported once a GitHub call is made.
+
+import asyncio
+import hashlib
+import posixpath
+from abc import ABC, abstractmethod
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+from metrics import metrics
+
+
+# raised when the branch moved while a commit was being prepared
+class CommitConflict(Exception):
+    pass
+
+
+# seconds between our clock and the one that dates commits that we allow for
+CLOCK_SKEW = 300
+
+
+# the SHA git gives a blob with these bytes, so we know it without asking GitHub
+def blob_sha(data):
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+# one version of a file: its bytes, its blob SHA, and whatever the backend
+# needs to find out cheaply whether the file changed since (`handle`)
+StoredFile = namedtuple('StoredFile', ['data', 'sha', 'handle'])
+
+
+# a backend missing one of the abstract methods fails when it is created
+class Storage(ABC):
+    # a StoredFile; FileNotFoundError when there is no such file
+    @abstractmethod
+    async def read(self, path):
+        pass
+
+    # a newer StoredFile, or None when the file is known not to have changed
+    @abstractmethod
+    async def read_if_changed(self, path, handle):
+        pass
+
+    # an opaque marker of the current revision, handed back to commit_files
+    @abstractmethod
+    async def get_head(self):
+        pass
+
+    # writes {path: text} as one commit on top of `head` and returns its id;
+    # CommitConflict when the head moved in the meantime
+    @abstractmethod
+    async def commit_files(self, head, files, message):
+        pass
+
+    # messages of the commits up to `head` made since `since` (a time.time()),
+    # newest first; none for a backend without history
+    async def commit_messages(self, head, since):
+        return []
+
+    # stops whatever the backend runs in the background
+    async def close(self):
+        pass
+
+    # (remaining, limit) of an API rate limit, (-1, -1) when there is none
+    def rate_limit(self):
+        return -1, -1
+
+
+class GitHubStorage(Storage):
+    # `executor`: repositories opened through the same Github client must share
+    # its worker (see tenants.py)
+    def __init__(self, repo, branch='master', executor=None):
+        self.repo = repo
+        self.branch = branch
+        # a single worker: PyGithub reuses one connection object per Requester,
+        # which is not safe to share between threads. Calls are serialized,
+        # but the event loop stays free while they are in flight.
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='github')
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        finally:
+            metrics.inc('github_calls', operation=func.__name__.lstrip('_'))
+            remaining, limit = self.rate_limit()
+            if limit > 0:
+                metrics.set('github_rate_limit_remaining', remaining)
+                metrics.set('github_rate_limit', limit)
+
+    # (remaining, limit) as of the last response's headers; (-1, -1) before the
+    # first call. Read from the requester so that it never costs a request.
+    def rate_limit(self):
+        requester = getattr(self.repo, '_requester', None)
+        return getattr(requester, 'rate_limiting', (-1, -1))
+
+    async def read(self, path):
+        from github import GithubException
+        try:
+            content_file = await self.run(self.repo.get_contents, path, ref=self.branch)
+        except GithubException as e:
+            if e.status == 404:
+                raise FileNotFoundError(path) from e
+            raise
+        return StoredFile(content_file.decoded_content, content_file.sha, content_file)
+
+    # a conditional request (If-None-Match with the stored ETag); GitHub answers
+    # 304 when nothing changed, which does not count against the rate limit
+    async def read_if_changed(self, path, handle):
+        if not await self.run(handle.update):
+            return None
+        return StoredFile(handle.decoded_content, handle.sha, handle)
+
+    async def get_head(self):
+        return await self.run(self._get_head)
+
+    def _get_head(self):
+        ref = self.repo.get_git_ref(f'heads/{self.branch}')
+        return ref, self.repo.get_git_commit(ref.object.sha)
+
+    # one request per page of 30 commits; the commit dates are GitHub's, so
+    # the window starts CLOCK_SKEW seconds early
+    async def commit_messages(self, head, since):
+        return await self.run(self._commit_messages, head, since)
+
+    def _commit_messages(self, head, since):
+        after = datetime.fromtimestamp(since - CLOCK_SKEW, timezone.utc)
+        return [commit.commit.message for commit in self.repo.get_commits(sha=head[1].sha, since=after)]
+
+    # one commit for several files through the Git Data API: a tree on top of
+    # the head commit's tree, a commit object, then a fast-forward of the branch
+    async def commit_files(self, head, files, message):
+        return await self.run(self._commit_files, head, files, message)
+
+    def _commit_files(self, head, files, message):
+        from github import GithubException, InputGitTreeElement
+        ref, parent = head
+        elements = [InputGitTreeElement(path, '100644', 'blob', content=text) for path, text in files.items()]
+        tree = self.repo.create_git_tree(elements, parent.tree)
+        commit = self.repo.create_git_commit(message, tree, [parent])
+        try:
+            ref.edit(commit.sha)
+        except GithubException as e:
+            # not a fast forward: somebody else pushed since we read the head
+            if e.status in (409, 422):
+                raise CommitConflict(str(e)) from e
+            raise
+        return commit.sha
+
+
+# Another storage seen from one of its directories, for a calendar that does not
+# live at the root of its repository: events.html and events/ are looked up
+# next to each other under `directory`.
+class Subdirectory(Storage):
+    def __init__(self, storage, directory):
+        self.storage = storage
+        self.directory = directory.strip('/')
+
+    def _path(self, path):
+        return posixpath.join(self.directory, path)
+
+    async def read(self, path):
+        return await self.storage.read(self._path(path))
+
+    async def read_if_changed(self, path, handle):
+        return await self.storage.read_if_changed(self._path(path), handle)
+
+    async def get_head(self):
+        return await self.storage.get_head()
+
+    async def commit_files(self, head, files, message):
+        return await self.storage.commit_files(head, {self._path(path): text for path, text in files.items()}, message)
+
+    async def commit_messages(self, head, since):
+        return await self.storage.commit_messages(head, since)
+
+    async def close(self):
+        await self.storage.close()
+
+    def rate_limit(self):
+        return self.storage.rate_limit()
+
+
+# A parsed copy of a file kept in memory together with the blob SHA it came from.
+class CachedDocument:
+    def __init__(self, path, handle, text, parsed, sha):
+        self.path = path
+        self.handle = handle
+        self.text = text
+        self.parsed = parsed
+        self.sha = sha
+        # estimated bytes held, set by the cache
+        self.size = 0
+        # (key, parsed) of a second copy with changes that are not in the file
+        # yet (see DocumentCache.attach); it goes away with the document
+        self.overlay = None
+
+
+# Keeps the parsed calendar in memory between commands. Every lookup asks the
+# storage whether the file changed, which is cheap for every backend, and the
+# file is only decoded and parsed again when its blob SHA has moved.
+# `parse(path, text)` turns the text of a file into the object commands work on.
+#
+# A file that does not exist yet (a new shard, say) is cached as an empty
+# document with no handle and no SHA; it is read again once a commit has
+# created it.
+#
+# Documents are kept in least recently used order and `size` estimates the
+# memory they hold, text and parsed copy, as `bytes_per_character` times the
+# length of their text, so that several caches can share a memory budget
+# (see tenants.py). `labels` tell the metrics of several caches apart.
+class DocumentCache:
+    def __init__(self, storage, parse, bytes_per_character=1, **labels):
+        self.storage = storage
+        self.parse = parse
+        self.bytes_per_character = bytes_per_character
+        self.labels = labels
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.size = 0
+        # called whenever a document was added, e.g. to apply a shared budget
+        self.on_grow = None
+        self._documents = OrderedDict()
+
+    def __len__(self):
+        return len(self._documents)
+
+    async def get(self, path):
+        document = self._documents.get(path)
+        if document is not None:
+            self._documents.move_to_end(path)
+        if document is not None and document.handle is None and document.sha is None:
+            self.hits += 1
+            return document
+        if document is None or document.handle is None:
+            try:
+                with metrics.timer('fetch'):
+                    stored = await self.storage.read(path)
+            except FileNotFoundError:
+                return self._missing(path)
+            return self._load(path, stored)
+
+        self.revalidations += 1
+        with metrics.timer('revalidate'):
+            stored = await self.storage.read_if_changed(path, document.handle)
+        if stored is None or stored.sha == document.sha:
+            if stored is not None:
+                document.handle = stored.handle
+            self.hits += 1
+            return document
+        return self._load(path, stored)
+
+    def _load(self, path, stored):
+        self.misses += 1
+        metrics.set('document_bytes', len(stored.data), path=path, **self.labels)
+        text = stored.data.decode('utf-8')
+        with metrics.timer('parse'):
+            parsed = self.parse(path, text)
+        return self._remember(CachedDocument(path, stored.handle, text, parsed, stored.sha))
+
+    def _missing(self, path):
+        self.misses += 1
+        return self._remember(CachedDocument(path, None, '', self.parse(path, ''), None))
+
+    def _remember(self, document):
+        self.invalidate(document.path)
+        self._documents[document.path] = document
+        document.size = len(document.text) * self.bytes_per_character
+        self.size += document.size
+        if self.on_grow is not None:
+            self.on_grow()
+        return document
+
+    # called after a successful commit with the contents we just uploaded, so
+    # the next command does not have to parse them again. The old handle is
+    # kept for revalidation: the next check sees the new blob SHA we stored.
+    def store(self, path, text, parsed, sha):
+        document = self._documents.get(path)
+        if document is None:
+            return
+        metrics.set('document_bytes', len(text.encode('utf-8')), path=path, **self.labels)
+        self._remember(CachedDocument(path, document.handle, text, parsed, sha))
+
+    # keeps `parsed`, a copy of the document with changes that are not in the
+    # file yet, with the document under `key`; it counts against the size
+    def attach(self, document, key, parsed):
+        if self._documents.get(document.path) is not document:
+            return
+        if document.overlay is None:
+            extra = len(document.text) * self.bytes_per_character
+            document.size += extra
+            self.size += extra
+        document.overlay = key, parsed
+        if self.on_grow is not None:
+            self.on_grow()
+
+    def invalidate(self, path):
+        document = self._documents.pop(path, None)
+        if document is not None:
+            self.size -= document.size
+
+    def clear(self):
+        self._documents.clear()
+        self.size = 0
+
+    # drops the least recently used documents until at most `size` bytes are
+    # cached (as estimated); returns how many were freed
+    def shrink(self, size):
+        before = self.size
+        while self._documents and self.size > size:
+            _, document = self._documents.popitem(last=False)
+            self.size -= document.size
+            self.evictions += 1
+        return before - self.size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+                'evictions': self.evictions}
@@ -0,0 +1,125 @@
+# Keeps the bot connected, in place of restart.py. discord.py resumes dropped
+# gateway connections by itself; what reaches us is what it gives up on: an
+# HTTP error while logging in (a 429 from Cloudflare, a 5xx) or a connection
+# closed with a code it does not resume from. Instead
+# of starting a new interpreter after a fixed 7 seconds, the same client logs
+# in and connects again after a jittered exponential backoff, so the calendars
+# cached by the tenants, the journal replayers and the commands waiting for an
+# answer all carry on where they were.
+#
+# How long the bot was away is recorded as the "reconnect" phase (from the
+# disconnect to the next READY or RESUMED), and the first connection as "startup".
+#
+# Before logging in again the HTTP session is closed and, if closing it (or the
+# client) closed the connector, the connector is dropped: discord.py only makes
+# a new one when there is none, and clear() does not reset it. A closed client
+# has also lost its event loop, which is given back the way `async with` does.
+
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+import discord
+
+from metrics import metrics
+
+RETRYABLE = (discord.HTTPException, discord.GatewayNotFound, discord.ConnectionClosed, aiohttp.ClientError,
+             OSError, asyncio.TimeoutError)
+# close codes that mean the bot is misconfigured (bad token, intents or shards): retrying does not help
+FATAL_CLOSE_CODES = (4004, 4010, 4011, 4012, 4013, 4014)
+
+
+# `client` is a commands.Bot (Supervisor listens to its events with add_listener)
+class Supervisor:
+    def __init__(self, client, token, min_delay=1.0, max_delay=300.0, stable=60.0):
+        self.client = client
+        self.token = token
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        # a connection that stayed up this long resets the backoff
+        self.stable = stable
+        self.reconnects = 0
+        # None while disconnected
+        self.connected_since = None
+        # seconds from the disconnect (or from run()) to the last READY or RESUMED
+        self.last_ready = None
+        self._down_since = None
+        self._ready_once = False
+        # how long the connection that just dropped had been up
+        self._uptime = 0.0
+        client.add_listener(self._on_ready, 'on_ready')
+        client.add_listener(self._on_ready, 'on_resumed')
+        client.add_listener(self._on_disconnect, 'on_disconnect')
+
+    async def _on_ready(self):
+        now = time.perf_counter()
+        if self._down_since is not None:
+            phase = 'reconnect' if self._ready_once else 'startup'
+            self.last_ready = now - self._down_since
+            metrics.observe('phase_seconds', self.last_ready, phase=phase, command='supervisor')
+            logging.info(f"connected after {self.last_ready:.2f}s ({phase})")
+        self._down_since = None
+        self._ready_once = True
+        self.connected_since = now
+
+    async def _on_disconnect(self):
+        now = time.perf_counter()
+        if self._down_since is None:
+            self._down_since = now
+        if self.connected_since is not None:
+            self._uptime = now - self.connected_since
+            self.connected_since = None
+
+    def _retry_after(self, error, delay):
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        try:
+            return max(delay, float(headers.get('Retry-After', 0)))
+        except ValueError:
+            return delay
+
+    # a client ready to log in again: discord.py closes the client when it
+    # gives up, and a failed login leaves its session open
+    async def _reopen(self):
+        http = self.client.http
+        if self.client.is_closed():
+            self.client.clear()
+            await self.client._async_setup_hook()
+        else:
+            await http.close()
+        if http.connector is not discord.utils.MISSING and http.connector.closed:
+            http.connector = discord.utils.MISSING
+
+    # runs until the client is closed, or fails with an error that retrying cannot fix
+    async def run(self):
+        self._down_since = time.perf_counter()
+        delay = self.min_delay
+        logged_in = False
+        async with self.client:
+            while True:
+                try:
+                    if not logged_in:
+                        if self.reconnects:
+                            await self._reopen()
+                        await self.client.login(self.token)
+                        logged_in = True
+                    await self.client.connect(reconnect=True)
+                    return
+                except RETRYABLE as e:
+                    if isinstance(e, discord.ConnectionClosed) and e.code in FATAL_CLOSE_CODES:
+                        raise
+                    error = e
+                await self._on_disconnect()
+                if self._uptime >= self.stable:
+                    delay = self.min_delay
+                self._uptime = 0.0
+                wait = self._retry_after(error, delay * random.uniform(0.5, 1.5))
+                self.reconnects += 1
+                metrics.inc('reconnects')
+                logging.info(f"Blocked by {type(error).__name__}: {error}; reconnecting in {wait:.1f}s")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self.max_delay)
+                # discord.py closes the client when it gives up: log in again
+                if self.client.is_closed():
+                    logged_in = False
@@ -0,0 +1,253 @@
+# Multi-tenant mode: one process serves many calendars. Every guild, and
+# optionally every user, is mapped to its own repository, branch, file and
+# timezone in a JSON file (TENANTS_FILE):
+#   {"default": {"repo": "me/website"},
+#    "guilds": {"1234": {"repo": "team/website", "branch": "main", "path": "calendar/events.html"}},
+#    "users": {"5678": {"repo": "alice/website", "timezone": "Europe/Berlin", "token": "ALICE_GITHUB_TOKEN"}}}
+# A user's own entry wins over their guild's, and the guild's over the default.
+# `token` names the environment variable holding the GitHub token (GITHUB_TOKEN
+# by default); "storage": "git" or "filesystem" with a "directory" works too.
+#
+# A tenant is opened on its first command. Tenants on the same token share one
+# Github client, and with it one connection and worker thread; everything else
+# (document cache, commit queue, journal) is per tenant, so a slow or
+# conflicting calendar never holds up another one. The documents cached by all
+# tenants together are kept under a memory budget, evicting from the least
+# recently used tenants first. What a document takes is estimated from the
+# length of its text: parsed, a calendar takes about 14 bytes per character.
+
+import asyncio
+import json
+import logging
+import os
+import posixpath
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pytz
+
+from commit_queue import CommitQueue
+from journal import Journal, JournalReplayer
+from local_storage import FileSystemStorage, LocalGitStorage
+from metrics import metrics
+from shards import LEGACY_PATH, MANIFEST_PATH, SingleFile, parse_document, shard_edits
+from storage import DocumentCache, GitHubStorage, Subdirectory
+
+DEFAULT = 'default'
+BACKENDS = ('github', 'git', 'filesystem')
+# memory a cached calendar holds per character of its text, parsed copy
+# included (13-14 measured with tracemalloc on generated calendars)
+PARSED_BYTES_PER_CHARACTER = 14
+
+# `journal` is the journal's file; None puts it in the registry's journal directory
+TenantConfig = namedtuple('TenantConfig', ['key', 'storage', 'repo', 'branch', 'path', 'directory', 'timezone',
+                                           'token', 'journal'])
+
+
+# a TenantConfig from one entry of the tenants file; ValueError when it is unusable
+def make_config(key, entry):
+    storage = entry.get('storage', 'github')
+    if storage not in BACKENDS:
+        raise ValueError(f'{key}: unknown storage backend "{storage}"')
+    if storage == 'github' and not entry.get('repo'):
+        raise ValueError(f'{key}: no repo')
+    if storage != 'github' and not entry.get('directory'):
+        raise ValueError(f'{key}: no directory')
+    token = entry.get('token', 'GITHUB_TOKEN')
+    if storage == 'github' and os.getenv(token) is None:
+        raise ValueError(f'{key}: the environment variable {token} is not set')
+    timezone = entry.get('timezone', 'US/Central')
+    if timezone not in pytz.all_timezones_set:
+        raise ValueError(f'{key}: unknown timezone "{timezone}"')
+    return TenantConfig(key, storage, entry.get('repo'), entry.get('branch', 'master'),
+                        entry.get('path', LEGACY_PATH).strip('/'), entry.get('directory'), timezone, token,
+                        entry.get('journal'))
+
+
+# {key: TenantConfig}; keys are "default", "guild-<id>" and "user-<id>"
+def load_tenants(path):
+    with open(path) as f:
+        data = json.load(f)
+    configs = {}
+    if DEFAULT in data:
+        configs[DEFAULT] = make_config(DEFAULT, data[DEFAULT])
+    for kind in ('guilds', 'users'):
+        for key, entry in data.get(kind, {}).items():
+            name = f'{kind[:-1]}-{key}'
+            configs[name] = make_config(name, entry)
+    return configs
+
+
+# One calendar and everything that reads and writes it.
+class Tenant:
+    def __init__(self, config, storage, journal, commit_window=1.0):
+        self.config = config
+        self.key = config.key
+        # the default calendar keeps the metrics it had before tenants existed
+        self.labels = {} if config.key == DEFAULT else {'tenant': config.key}
+        # the legacy file; the storage is already inside its directory
+        self.path = posixpath.basename(config.path)
+        self.timezone = pytz.timezone(config.timezone)
+        self.storage = storage
+        self.documents = DocumentCache(storage, parse_document, PARSED_BYTES_PER_CHARACTER, **self.labels)
+        # edits confirmed within `commit_window` seconds of each other share a single commit
+        self.commits = CommitQueue(storage, self.documents, window=commit_window)
+        # confirmed edits are written here first and pushed to GitHub in the background
+        self.journal = journal
+        self.replayer = JournalReplayer(journal, self.commits)
+
+    # the parsed file as the user sees it: with the journaled edits that are not
+    # on GitHub yet. That copy is kept with the cached document, keyed by the
+    # ids of the entries applied to it: a new entry is applied on top of it, and
+    # the file is only parsed again once the document or the entries before it changed.
+    async def read_document(self, path):
+        document = await self.documents.get(path)
+        pending = self.journal.pending(path)
+        if not pending:
+            return document.parsed
+        ids = tuple(entry_id for entry_id, _ in pending)
+        if document.overlay is not None and ids[:len(document.overlay[0])] == document.overlay[0]:
+            applied, parsed = document.overlay
+        else:
+            applied, parsed = (), parse_document(path, document.text)
+        for _, mutations in pending[len(applied):]:
+            for mutation in mutations:
+                parsed.apply(mutation)
+        self.documents.attach(document, ids, parsed)
+        return parsed
+
+    # the single legacy file, or the manifest of the per-year files after !reformat_file
+    async def layout(self):
+        manifest = await self.read_document(MANIFEST_PATH)
+        return manifest if manifest.shards else SingleFile(self.path)
+
+    # the file holding the given date, and its calendar
+    async def calendar_for(self, layout, day):
+        path = layout.path_for(day)
+        return path, await self.read_document(path)
+
+    # confirmed edits are acknowledged as soon as they are in the journal
+    async def record(self, edits, message):
+        await self.journal.append(edits, message)
+        self.replayer.notify()
+
+    async def submit(self, layout, path, mutations, message):
+        await self.record(shard_edits(layout, {path: mutations}), message)
+
+
+class TenantRegistry:
+    def __init__(self, configs, journal_directory='journals', budget=64 * 2 ** 20, commit_window=1.0):
+        self.configs = configs
+        self.journal_directory = journal_directory
+        # bytes of cached documents (as estimated), over all tenants
+        self.budget = budget
+        self.commit_window = commit_window
+        # open tenants, least recently used first
+        self._tenants = OrderedDict()
+        self._opening = {}
+        # token -> (Github client, the worker thread its calls run on)
+        self._clients = {}
+        # SQLite writes of every journal go through one thread
+        self._journal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+
+    def __len__(self):
+        return len(self._tenants)
+
+    def __iter__(self):
+        return iter(list(self._tenants.values()))
+
+    def resolve(self, guild_id, user_id):
+        for key in (f'user-{user_id}', f'guild-{guild_id}', DEFAULT):
+            if key in self.configs:
+                return self.configs[key]
+        return None
+
+    # the tenant serving this user in this guild (None in direct messages), or
+    # None when neither has a calendar
+    async def get(self, guild_id, user_id):
+        config = self.resolve(guild_id, user_id)
+        if config is None:
+            return None
+        return await self.tenant(config)
+
+    async def tenant(self, config):
+        tenant = self._tenants.get(config.key)
+        if tenant is None:
+            # commands arriving while the tenant is being opened wait for the same connection
+            if config.key not in self._opening:
+                self._opening[config.key] = asyncio.ensure_future(self._connect(config))
+            try:
+                storage = await asyncio.shield(self._opening[config.key])
+            finally:
+                self._opening.pop(config.key, None)
+            tenant = self._tenants.get(config.key) or self.open(config, storage)
+        self._tenants.move_to_end(config.key)
+        self.trim()
+        return tenant
+
+    # a tenant on the given storage, replacing any open one with the same key
+    def open(self, config, storage):
+        journal_path = config.journal
+        if journal_path is None:
+            os.makedirs(self.journal_directory, exist_ok=True)
+            journal_path = os.path.join(self.journal_directory, f'{config.key}.sqlite3')
+        journal = Journal(journal_path, self._journal_executor,
+                          **({} if config.key == DEFAULT else {'tenant': config.key}))
+        tenant = self._tenants[config.key] = Tenant(config, storage, journal, self.commit_window)
+        # documents stored by background commits count against the budget too
+        tenant.documents.on_grow = self.trim
+        tenant.replayer.start()
+        metrics.set('tenants', len(self._tenants))
+        logging.info(f"opened calendar {config.key} with {len(journal)} unsynced edit(s)")
+        return tenant
+
+    async def _connect(self, config):
+        if config.storage == 'github':
+            client, executor = self._client(config.token)
+            # get_repo makes a request: on the client's worker like every other call
+            repo = await asyncio.get_running_loop().run_in_executor(executor, client.get_repo, config.repo)
+            storage = GitHubStorage(repo, branch=config.branch, executor=executor)
+        elif config.storage == 'git':
+            storage = LocalGitStorage(config.directory, branch=config.branch)
+        else:
+            storage = FileSystemStorage(config.directory)
+        directory = posixpath.dirname(config.path)
+        return Subdirectory(storage, directory) if directory else storage
+
+    def _client(self, token):
+        from github import Github
+        if token not in self._clients:
+            self._clients[token] = (Github(os.getenv(token)),
+                                    ThreadPoolExecutor(max_workers=1, thread_name_prefix='github'))
+        return self._clients[token]
+
+    # opens the default tenant and every tenant that has a journal on disk, so
+    # that edits left over from the last run are pushed without waiting for a command
+    async def resume(self):
+        for config in self.configs.values():
+            journal_path = config.journal or os.path.join(self.journal_directory, f'{config.key}.sqlite3')
+            if config.key != DEFAULT and not os.path.exists(journal_path):
+                continue
+            try:
+                await self.tenant(config)
+            except Exception as e:
+                logging.info(f"could not open calendar {config.key}: {e}")
+
+    # on shutdown: stops the background work of every open tenant's storage
+    async def close(self):
+        for tenant in self:
+            await tenant.storage.close()
+
+    # keeps the cached documents of all tenants under the budget, taking from
+    # the least recently used tenants first; the most recent one keeps its cache
+    def trim(self):
+        tenants = list(self._tenants.values())
+        excess = sum(tenant.documents.size for tenant in tenants) - self.budget
+        for tenant in tenants[:-1]:
+            if excess <= 0:
+                break
+            excess -= tenant.documents.shrink(max(0, tenant.documents.size - excess))
+        metrics.set('cached_bytes', self.cached())
+
+    def cached(self):
+        return sum(tenant.documents.size for tenant in self._tenants.values())
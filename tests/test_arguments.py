@@ -0,0 +1,41 @@
+# One-shot arguments: a field that has the wrong shape or is left over is
+# reported, and only a complete, valid set of arguments skips the confirmation.
+#
+#   python -m pytest tests
+
+from arguments import complete, complete_period, parse_date_arguments, parse_event_arguments, parse_period_arguments
+
+
+def test_full_arguments_skip_the_confirmation():
+    values, errors = parse_event_arguments(['01/05/2023', '70', 'gym | dentist'], with_date=True)
+    assert values == {'date': '01/05/2023', 'credit': 70, 'events': ['gym', 'dentist']} and not errors
+    assert complete(values, errors, 'date', 'events', 'credit')
+    values, errors = parse_period_arguments(['01/02/2023', '03/04/2023', '80', '200', 'Winter break'])
+    assert complete_period(values, errors)
+
+
+def test_a_date_in_the_wrong_format_is_reported():
+    values, errors = parse_date_arguments(['1-5-2023'])
+    assert 'date' not in values and errors
+    assert not complete(values, errors, 'date')
+
+    values, errors = parse_event_arguments(['1-5-2023', '70', 'gym'], with_date=True)
+    assert 'date' not in values and len(errors) == 1
+    assert values['events'] == ['gym'] and values['credit'] == 70
+
+
+def test_left_over_arguments_are_reported():
+    values, errors = parse_date_arguments(['01/05/2023', 'please'])
+    assert values == {'date': '01/05/2023'} and errors == ['Unexpected arguments: please']
+    assert not complete(values, errors, 'date')
+
+    values, errors = parse_period_arguments(['01/02/2023', '03/04/2023', 'Winter'], dates_only=True)
+    assert errors == ['Unexpected arguments: Winter']
+
+
+def test_missing_fields_keep_the_confirmation():
+    values, errors = parse_event_arguments(['gym'])
+    assert values == {'events': ['gym']} and not errors
+    assert not complete(values, errors, 'events', 'credit')
+    values, errors = parse_period_arguments(['01/02/2023', '03/04/2023', '80', 'Winter break'])
+    assert not complete_period(values, errors)
@@ -0,0 +1,29 @@
+# Several rows of an import for the same date or period: only the last one is
+# imported, and the counts shown before the import are the ones the merge does.
+#
+#   python -m pytest tests
+
+from calendar_io import validate_rows
+from calendar_model import Calendar
+
+TEXT = '<div date="01/04/2023" credit="70">gym</div>\n'
+ROWS = [
+    {'type': 'event', 'date': '01/05/2023', 'credit': '50', 'description': 'first'},
+    {'type': 'event', 'date': '1/5/2023', 'credit': '60', 'description': 'second'},
+    {'type': 'event', 'date': '01/04/2023', 'credit': '80', 'description': 'gym | dentist'},
+    {'type': 'period', 'start': '02/01/2023', 'end': '02/03/2023', 'color': '#ff8800', 'description': 'Trip'},
+    {'type': 'base', 'start': '02/01/2023', 'end': '02/03/2023', 'credit': '5', 'hue': '30', 'description': 'Trip'},
+    {'type': 'event', 'date': '13/01/2023', 'credit': '50', 'description': 'no such month'},
+]
+
+
+def test_duplicate_rows_keep_the_last_one():
+    divs, rejected = validate_rows(ROWS)
+    assert [number for number, _ in rejected] == [1, 4, 6]
+    assert 'replaced by row 2' in rejected[0][1]
+
+    calendar = Calendar.from_html(TEXT)
+    replaced = sum(1 for div in divs if calendar.contains(div))
+    assert calendar.merge(divs) == (len(divs) - replaced, replaced) == (2, 1)
+    assert calendar.find_event('01/05/2023').descriptions == ['second']
+    assert calendar.find_period('02/01/2023', '02/03/2023').base
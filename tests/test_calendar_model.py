@@ -0,0 +1,30 @@
+# A hand-edited div with dates that cannot be read is skipped, not fatal: the
+# rest of the calendar can still be read and edited, and the div stays in the
+# file as it was.
+#
+#   python -m pytest tests
+
+import pytest
+
+from calendar_model import Calendar, Mutation, event_div
+
+GOOD = '<div date="01/04/2023" credit="70">gym</div>\n'
+BAD = ['<div date="1/5" credit="50">no year</div>\n',
+       '<div date="02/30/2023" credit="50">no such day</div>\n',
+       '<div start="01/02/2023" end="soon" color="#ff8800">Trip</div>\n']
+# an unreadable tag sends the whole file through BeautifulSoup instead of the scanner
+FALLBACK = '<div"></div>\n'
+
+
+@pytest.mark.parametrize('fallback', [False, True], ids=['scanner', 'BeautifulSoup'])
+def test_unreadable_dates_are_skipped(fallback):
+    text = GOOD + ''.join(BAD) + (FALLBACK if fallback else '')
+    calendar = Calendar.from_html(text)
+    assert [event.date for event in calendar.events] == ['01/04/2023']
+    assert calendar.periods == []
+
+    calendar.apply(Mutation('put_event', '01/04/2023', event_div('01/04/2023', 80, ['gym', 'dentist'])))
+    calendar.apply(Mutation('add_event', '01/06/2023', event_div('01/06/2023', 60, ['read a book'])))
+    edited = calendar.to_text()
+    assert 'credit="80"' in edited and 'read a book' in edited
+    assert all(div in edited for div in BAD)
@@ -0,0 +1,27 @@
+# The events.html scanner reads the same calendar divs, and finds the same div
+# for a date, as the BeautifulSoup find_all lookups it replaced.
+#
+#   python -m pytest tests
+
+import pytest
+from bs4 import BeautifulSoup
+
+from benchmarks.bench_parser import SAMPLES, check_equivalence
+from benchmarks.synthetic import generate_calendar
+
+
+@pytest.mark.parametrize('text', SAMPLES)
+def test_samples(text):
+    check_equivalence(text)
+
+
+def test_synthetic_calendar():
+    text = generate_calendar(400, periods=40, base_periods=20)
+    check_equivalence(text)
+    check_equivalence(BeautifulSoup(text, 'html.parser').prettify())
+
+
+def test_duplicate_dates_find_the_first_div():
+    text = ('<div date="01/02/2023" credit="5">first</div>\n'
+            '<div date="01/02/2023" credit="6">second</div>\n')
+    check_equivalence(text)
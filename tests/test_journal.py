@@ -0,0 +1,61 @@
+# Fault injection for the write-ahead journal, against the fake GitHub (the
+# scenarios of benchmarks/bench_journal.py, smaller): every confirmed edit
+# lands exactly once, whether GitHub is down, flaky, or loses the response to
+# a push that went through (also when someone else pushes right after it).
+#
+#   python -m pytest tests
+
+import asyncio
+
+from github import GithubException
+
+from benchmarks.bench_journal import bot, check, confirm, flaky, lost, outage, reading
+from benchmarks.fake_github import FakeRepo
+from benchmarks.synthetic import generate_calendar
+from storage import blob_sha
+
+EDITS = 30
+
+
+def test_edits_survive_an_outage_and_a_restart(tmp_path):
+    _, _, attempts = asyncio.run(outage(str(tmp_path / 'journal.sqlite3'), EDITS))
+    assert attempts > 0, 'GitHub was never tried while it was down'
+
+
+def test_edits_land_once_when_calls_fail(tmp_path):
+    asyncio.run(flaky(str(tmp_path / 'journal.sqlite3'), EDITS, 0.2))
+
+
+def test_pushes_whose_response_was_lost_are_not_applied_twice(tmp_path):
+    _, _, responses = asyncio.run(lost(str(tmp_path / 'journal.sqlite3'), EDITS, 0.3))
+    assert responses > 0, 'no push that landed was retried'
+
+
+def test_reads_see_the_unsynced_edits(tmp_path):
+    asyncio.run(reading(str(tmp_path / 'journal.sqlite3'), 10, 365))
+
+
+# the first push lands, its response is lost, and another commit (another
+# tenant on the same branch, or a manual push) lands on top before the retry
+async def lost_then_overtaken(journal_path):
+    repo = FakeRepo({'events.html': generate_calendar(30), 'notes.txt': ''})
+    lose = repo._lose
+
+    def lose_once():
+        repo._lose = lose
+        repo.update_file('notes.txt', 'an unrelated commit', 'notes', blob_sha(b''))
+        raise GithubException(502, {'message': 'Bad Gateway'}, {})
+
+    repo._lose = lose_once
+    journal, replayer = bot(repo, journal_path)
+    replayer.start()
+    await confirm(journal, replayer, 3, action='add_event')
+    await replayer.drain()
+    journal.close()
+    return repo
+
+
+def test_a_lost_push_is_found_under_later_commits(tmp_path):
+    repo = asyncio.run(lost_then_overtaken(str(tmp_path / 'journal.sqlite3')))
+    assert repo.text('notes.txt') == 'notes'
+    check(repo, 3)
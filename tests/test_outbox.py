@@ -0,0 +1,27 @@
+# Messages over Discord's limit are split into pieces that fit, without losing
+# text and without leaving a code block open.
+#
+#   python -m pytest tests
+
+import pytest
+
+from outbox import FENCE, LIMIT, split_message
+
+
+def joined(chunks):
+    return ''.join(''.join(chunks).replace(FENCE, '').split())
+
+
+@pytest.mark.parametrize('text', [
+    # no line break or space after the fence line: only a hard cut makes progress
+    '```\n' + 'a' * 3000 + '\n```',
+    '```\n' + 'a' * 5000 + ' ' + 'a' * 10 + '\n```',
+    'intro\n```\n' + 'b' * 4500 + '\n```\nafter',
+    ' '.join(['word'] * 1500),
+    '```html\n' + '\n'.join(f'<div date="01/{day % 28 + 1:02}/2023">event {day}</div>' for day in range(400)) + '\n```',
+], ids=['unbroken code block', 'one late space', 'text around a code block', 'words', 'export preview'])
+def test_split_message(text):
+    chunks = split_message(text)
+    assert all(len(chunk) <= LIMIT for chunk in chunks), [len(chunk) for chunk in chunks]
+    assert all(chunk.count(FENCE) % 2 == 0 for chunk in chunks), 'a chunk leaves a code block open'
+    assert joined(chunks) == joined([text])
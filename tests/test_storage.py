@@ -0,0 +1,52 @@
+# GitHub calls run on a worker thread: while one command waits for a slow
+# GitHub response, the event loop keeps serving every other session.
+#
+#   python -m pytest tests
+
+import asyncio
+import time
+
+from benchmarks.fake_discord import FakeContext
+from benchmarks.fake_github import FakeRepo
+from benchmarks.synthetic import generate_calendar
+from conversation import ConversationRouter
+from storage import GitHubStorage
+
+DELAY = 0.5
+
+
+async def answer(router, ctx, contents):
+    for message in ctx.answers(contents):
+        await asyncio.sleep(0.02)
+        router.dispatch(message)
+
+
+async def ask(router, ctx, count):
+    received = []
+    for _ in range(count):
+        message = await router.wait_for_message(ctx)
+        received.append((message.content, time.perf_counter()))
+    return received
+
+
+async def slow_fetch_and_conversation():
+    storage = GitHubStorage(FakeRepo({'events.html': generate_calendar(30)}, delay=DELAY))
+    router = ConversationRouter(timeout=5)
+    ctx = FakeContext(user_id=2, channel_id=2)
+    router.open(ctx)
+
+    started = time.perf_counter()
+    fetch = asyncio.create_task(storage.read('events.html'))
+    # the second user starts answering once the first command's fetch is in flight
+    await asyncio.sleep(0)
+    received, _, stored = await asyncio.gather(ask(router, ctx, 3), answer(router, ctx, ['gym', 'no', '85']), fetch)
+    return started, time.perf_counter(), received, stored
+
+
+def test_sessions_are_served_while_a_github_call_is_in_flight():
+    started, finished, received, stored = asyncio.run(slow_fetch_and_conversation())
+    assert stored.data, 'the fetch returned nothing'
+    assert finished - started >= DELAY
+    assert [content for content, _ in received] == ['gym', 'no', '85']
+    # every answer reached its session long before the fetch came back
+    assert all(at - started < DELAY / 2 for _, at in received), [at - started for _, at in received]
@@ -0,0 +1,52 @@
+# The rules behind the wait_for_* prompts, usable on any text.
+# Each parser returns the normalized value or raises ValueError with a message
+# that can be shown to the user as is.
+
+import re
+from datetime import datetime
+
+DATE_FORMAT = '%m/%d/%Y'
+CREDIT_RANGE = (0, 100)
+HUE_RANGE = (0, 360)
+
+_color = re.compile(r"^#(?:[0-9a-fA-F]{3}){1,2}$")
+
+
+def parse_date(text):
+    try:
+        return datetime.strptime(text.strip(), DATE_FORMAT).strftime(DATE_FORMAT)
+    except ValueError:
+        raise ValueError('Please enter a valid date in the format mm/dd/yyyy.') from None
+
+
+def parse_color(text):
+    if not _color.match(text.strip()):
+        raise ValueError('Please enter a valid color in the format #xxxxxx.')
+    return text.strip()
+
+
+def parse_integer(text, range=None):
+    try:
+        value = int(text)
+        if range is not None and (value < range[0] or value > range[1]):
+            raise ValueError
+    except ValueError:
+        if range is None:
+            raise ValueError('Please enter a valid integer.') from None
+        raise ValueError(f'Please enter a valid integer between {range[0]} and {range[1]}.') from None
+    return value
+
+
+# "gym | paper deadline" -> ['gym', 'paper deadline']
+def split_events(text):
+    events = [event.strip() for event in text.split('|') if event.strip()]
+    if not events:
+        raise ValueError('Please enter at least one event.')
+    return events
+
+
+def parse_period_dates(start, end):
+    start, end = parse_date(start), parse_date(end)
+    if datetime.strptime(end, DATE_FORMAT) < datetime.strptime(start, DATE_FORMAT):
+        raise ValueError('The end date must be after the start date.')
+    return start, end